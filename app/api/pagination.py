@@ -0,0 +1,71 @@
+"""
+Pagination for the REST API.
+
+``KeysetPagination`` pages through append-only resources newest first by
+an indexed key such as ``(check_time, id)`` (see ``core.keyset``). Each
+page continues from the key of the previous page's last row, passed as an
+opaque ``?cursor=``, so a page costs an index range scan however deep it
+is, and no ``COUNT(*)`` is run.
+"""
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from core.keyset import decode_cursor, encode_cursor, keyset_page
+
+
+class PagePagination(PageNumberPagination):
+    """Numbered pages for small, mutable resources."""
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class KeysetPagination(BasePagination):
+    """Newest-first pages continuing from the last row's key.
+
+    Views name the key with ``keyset``, e.g. ``('check_time', 'id')``; it
+    must be unique, and indexed (behind any filtered columns) to be fast.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 100
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        fields = view.keyset
+        position = None
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            try:
+                position = decode_cursor(cursor, queryset.model, fields)
+            except ValueError:
+                raise NotFound('Invalid cursor.')
+        rows, self.next_position = keyset_page(queryset, fields, position, self.get_page_size(request))
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
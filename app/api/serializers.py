@@ -0,0 +1,129 @@
+"""
+API serializers.
+
+Every serializer declares the ``select_related`` and ``prefetch_related``
+lookups its fields need (``related``/``prefetch``, keyed by field name), so
+views load exactly what the requested fields read and every endpoint runs a
+fixed number of queries. Clients can ask for a subset of fields with
+``?fields=id,status``.
+"""
+from rest_framework import serializers
+
+from billing.models import Invoice, InvoiceItem
+from clients.models import Client
+from monitoring.models import Alert, Device, MonitoringResult
+
+
+class PlannedSerializer(serializers.ModelSerializer):
+    """Serializer with sparse fieldsets and a query plan per field."""
+    related = {}
+    prefetch = {}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        wanted = self.requested_fields(request)
+        if wanted:
+            for name in set(self.fields) - wanted:
+                self.fields.pop(name)
+
+    @staticmethod
+    def requested_fields(request):
+        fields = request and request.query_params.get('fields')
+        return {name.strip() for name in fields.split(',') if name.strip()} if fields else None
+
+    @classmethod
+    def optimize(cls, queryset, request=None):
+        """Apply the lookups needed by the fields a request asks for."""
+        wanted = cls.requested_fields(request) or set(cls.Meta.fields)
+        related = {lookup for name in wanted for lookup in cls.related.get(name, ())}
+        prefetch = {lookup for name in wanted for lookup in cls.prefetch.get(name, ())}
+        if related:
+            queryset = queryset.select_related(*sorted(related))
+        if prefetch:
+            queryset = queryset.prefetch_related(*sorted(prefetch))
+        return queryset
+
+
+class ClientSerializer(PlannedSerializer):
+    class Meta:
+        model = Client
+        fields = [
+            'id', 'name', 'slug', 'address', 'city', 'state', 'zip_code', 'phone', 'website', 'industry',
+            'is_active', 'created_at', 'updated_at',
+        ]
+
+
+class DeviceSerializer(PlannedSerializer):
+    client_name = serializers.CharField(source='client.name', read_only=True)
+    device_type = serializers.CharField(source='device_type.name', read_only=True, default=None)
+    availability = serializers.SerializerMethodField()
+
+    related = {
+        'client_name': ['client'],
+        'device_type': ['device_type'],
+        'availability': ['availability'],
+    }
+
+    class Meta:
+        model = Device
+        fields = [
+            'id', 'client', 'client_name', 'name', 'device_type', 'ip_address', 'mac_address', 'hostname',
+            'status', 'monitoring_enabled', 'availability', 'created_at', 'updated_at',
+        ]
+
+    def get_availability(self, device):
+        try:
+            availability = device.availability
+        except Device.availability.RelatedObjectDoesNotExist:
+            return None
+        return {'status': availability.status, 'since': availability.since}
+
+
+class MonitoringResultSerializer(PlannedSerializer):
+    device_name = serializers.CharField(source='device.name', read_only=True)
+
+    related = {'device_name': ['device']}
+
+    class Meta:
+        model = MonitoringResult
+        fields = [
+            'id', 'device', 'device_name', 'check_time', 'ping_status', 'ping_latency', 'snmp_status',
+            'cpu_load', 'memory_used', 'disk_used',
+        ]
+
+
+class AlertSerializer(PlannedSerializer):
+    device_name = serializers.CharField(source='device.name', read_only=True)
+    client = serializers.IntegerField(source='device.client_id', read_only=True)
+
+    related = {'device_name': ['device'], 'client': ['device']}
+
+    class Meta:
+        model = Alert
+        fields = [
+            'id', 'device', 'device_name', 'client', 'title', 'message', 'severity', 'status',
+            'created_at', 'acknowledged_at', 'resolved_at',
+        ]
+
+
+class InvoiceItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = InvoiceItem
+        fields = ['id', 'description', 'quantity', 'unit_price', 'total_price', 'device']
+
+
+class InvoiceSerializer(PlannedSerializer):
+    client_name = serializers.CharField(source='client.name', read_only=True)
+    items = InvoiceItemSerializer(many=True, read_only=True)
+
+    related = {'client_name': ['client']}
+    prefetch = {'items': ['items']}
+
+    class Meta:
+        model = Invoice
+        fields = [
+            'id', 'client', 'client_name', 'invoice_number', 'title', 'status', 'issue_date', 'due_date',
+            'billing_period_start', 'billing_period_end', 'subtotal', 'tax_percent', 'tax_amount', 'total',
+            'balance_due', 'aging_bucket', 'items', 'created_at', 'updated_at',
+        ]
@@ -0,0 +1,14 @@
+from rest_framework.routers import DefaultRouter
+
+from . import views
+
+app_name = 'api'
+
+router = DefaultRouter()
+router.register('clients', views.ClientViewSet)
+router.register('devices', views.DeviceViewSet)
+router.register('invoices', views.InvoiceViewSet)
+router.register('results', views.MonitoringResultViewSet)
+router.register('alerts', views.AlertViewSet)
+
+urlpatterns = router.urls
@@ -0,0 +1,67 @@
+from rest_framework import viewsets
+
+from billing.models import Invoice
+from clients.models import Client
+from monitoring.models import Alert, Device, MonitoringResult
+
+from .pagination import KeysetPagination
+from .serializers import (
+    AlertSerializer, ClientSerializer, DeviceSerializer, InvoiceSerializer, MonitoringResultSerializer,
+)
+
+
+class PlannedViewSet(viewsets.ReadOnlyModelViewSet):
+    """Read-only endpoint loading what its serializer's requested fields need."""
+
+    def get_queryset(self):
+        return self.get_serializer_class().optimize(self.queryset.all(), self.request)
+
+
+class ClientViewSet(PlannedViewSet):
+    queryset = Client.objects.all()
+    serializer_class = ClientSerializer
+    filterset_fields = ['is_active', 'slug']
+
+
+class DeviceViewSet(PlannedViewSet):
+    queryset = Device.objects.order_by('id')
+    serializer_class = DeviceSerializer
+    filterset_fields = ['client', 'status', 'device_type', 'monitoring_enabled']
+
+
+class InvoiceViewSet(PlannedViewSet):
+    queryset = Invoice.objects.order_by('-issue_date', '-id')
+    serializer_class = InvoiceSerializer
+    filterset_fields = {
+        'client': ['exact'],
+        'status': ['exact'],
+        'aging_bucket': ['exact'],
+        'issue_date': ['gte', 'lt'],
+    }
+
+
+class MonitoringResultViewSet(PlannedViewSet):
+    """Monitoring results, newest first, paged by ``(check_time, id)``."""
+    queryset = MonitoringResult.objects.all()
+    serializer_class = MonitoringResultSerializer
+    pagination_class = KeysetPagination
+    keyset = ('check_time', 'id')
+    filterset_fields = {
+        'device': ['exact'],
+        'check_time': ['gte', 'lt'],
+    }
+
+
+class AlertViewSet(PlannedViewSet):
+    """Alerts, newest first, paged by ``(created_at, id)``."""
+    queryset = Alert.objects.all()
+    serializer_class = AlertSerializer
+    pagination_class = KeysetPagination
+    keyset = ('created_at', 'id')
+    filterset_fields = {
+        'device': ['exact'],
+        'device__client': ['exact'],
+        'status': ['exact'],
+        'severity': ['exact'],
+        'created_at': ['gte', 'lt'],
+    }
@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import Quote, QuoteItem, Invoice, InvoiceItem, Payment
+from django.utils import timezone
+
+from core.search import IndexedSearchAdminMixin
+from .models import (
+    Quote, QuoteItem, Invoice, InvoiceItem, Payment, DeviceUsageDay, StripeSyncItem, StripeEvent,
+    ReceivableSummary, RevenueSummary,
+)
 
 
 class QuoteItemInline(admin.TabularInline):
@@ -46,9 +52,9 @@ class PaymentInline(admin.TabularInline):
 
 
 @admin.register(Invoice)
-class InvoiceAdmin(admin.ModelAdmin):
+class InvoiceAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
     list_display = ('invoice_number', 'client', 'title', 'status', 'issue_date', 'due_date', 'total', 'balance_due')
-    list_filter = ('status', 'issue_date', 'due_date', 'is_recurring')
+    list_filter = ('status', 'issue_date', 'due_date', 'is_recurring', 'aging_bucket')
     search_fields = ('invoice_number', 'title', 'client__name')
     readonly_fields = ('invoice_number', 'created_at', 'updated_at', 'subtotal', 'tax_amount', 'total', 'balance_due')
     fieldsets = (
@@ -80,3 +86,66 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ('payment_date', 'payment_method')
     search_fields = ('invoice__invoice_number', 'reference_number', 'notes')
     date_hierarchy = 'payment_date'
+
+
+@admin.register(DeviceUsageDay)
+class DeviceUsageDayAdmin(admin.ModelAdmin):
+    list_display = ('date', 'client', 'device_type', 'closing_devices', 'departed_devices', 'closing_amount', 'departed_amount')
+    list_filter = ('device_type',)
+    list_select_related = ('client', 'device_type')
+    search_fields = ('client__name',)
+    date_hierarchy = 'date'
+    readonly_fields = ('client', 'device_type', 'date', 'closing_devices', 'closing_amount', 'departed_devices', 'departed_amount')
+    
+    def has_add_permission(self, request):
+        return False  # Maintained by the usage snapshot and device status changes
+
+
+@admin.register(StripeSyncItem)
+class StripeSyncItemAdmin(admin.ModelAdmin):
+    list_display = ('model_name', 'object_id', 'status', 'attempts', 'next_attempt_at', 'synced_at')
+    list_filter = ('status', 'model_name')
+    search_fields = ('object_id', 'last_error')
+    readonly_fields = ('model_name', 'object_id', 'idempotency_key', 'attempts', 'last_error', 'created_at', 'updated_at', 'synced_at')
+    actions = ['retry_now']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.action(description='Retry selected items now')
+    def retry_now(self, request, queryset):
+        queryset.exclude(status='synced').update(status='pending', next_attempt_at=timezone.now(), attempts=0)
+
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'type', 'status', 'received_at', 'processed_at')
+    list_filter = ('status', 'type')
+    search_fields = ('event_id',)
+    readonly_fields = ('event_id', 'type', 'payload', 'status', 'error', 'received_at', 'processed_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ReceivableSummary)
+class ReceivableSummaryAdmin(admin.ModelAdmin):
+    list_display = ('client', 'current', 'days_1_30', 'days_31_60', 'days_61_90', 'days_over_90', 'total_due', 'open_invoices')
+    list_select_related = ('client',)
+    search_fields = ('client__name',)
+    readonly_fields = ('client', 'current', 'days_1_30', 'days_31_60', 'days_61_90', 'days_over_90', 'total_due', 'open_invoices', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False  # Maintained from invoice and payment changes
+
+
+@admin.register(RevenueSummary)
+class RevenueSummaryAdmin(admin.ModelAdmin):
+    list_display = ('month', 'client', 'invoiced', 'collected')
+    list_select_related = ('client',)
+    search_fields = ('client__name',)
+    date_hierarchy = 'month'
+    readonly_fields = ('client', 'month', 'invoiced', 'collected', 'updated_at')
+    
+    def has_add_permission(self, request):
+        return False  # Maintained from invoice and payment changes
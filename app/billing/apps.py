@@ -0,0 +1,21 @@
+from django.apps import AppConfig
+
+
+class BillingConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'billing'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from core import audit, search
+        from .models import Invoice, Payment, Quote
+
+        search.register(
+            Invoice, lambda invoice: f"{invoice.invoice_number} {invoice.title}",
+            ['invoice_number', 'title', 'notes', 'client.name'],
+            select_related=['client'],
+        )
+        audit.register(Invoice, lambda invoice: f"Invoice #{invoice.invoice_number}")
+        audit.register(Quote, lambda quote: f"Quote #{quote.quote_number}")
+        audit.register(Payment, lambda payment: f"Payment of ${payment.amount}")
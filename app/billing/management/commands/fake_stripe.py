@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from billing.stripe_fake import FakeStripeServer
+
+
+class Command(BaseCommand):
+    help = "Run a local in-memory stand-in for the Stripe API"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=12111)
+        parser.add_argument('--rate-limit', type=float, help="Answer with 429 above this many requests per second")
+
+    def handle(self, *args, **options):
+        server = FakeStripeServer(
+            (options['host'], options['port']), rate_limit=options['rate_limit'], verbose=True
+        )
+        self.stdout.write(f"Fake Stripe API listening on {server.url}, set STRIPE_API_BASE to use it")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
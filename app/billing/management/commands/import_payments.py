@@ -0,0 +1,45 @@
+import csv
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from billing.models import Payment
+from billing.reconciliation import READERS, PaymentImporter
+
+
+class Command(BaseCommand):
+    help = "Import bank or payment processor transactions and apply them to invoices"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or OFX statement to import")
+        parser.add_argument('--format', choices=sorted(READERS), help="Statement format (default: from file extension)")
+        parser.add_argument(
+            '--method',
+            default='ach',
+            choices=[choice for choice, _ in Payment.PAYMENT_METHOD_CHOICES],
+            help="Payment method for rows that do not specify one",
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--unmatched-report', help="Write rows that could not be applied to this CSV file")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f"Unknown statement format '{file_format}', use --format")
+
+        importer = PaymentImporter(payment_method=options['method'], batch_size=options['batch_size'])
+        with open(path, newline='', encoding='utf-8-sig', errors='replace') as stream:
+            summary = importer.run(READERS[file_format](stream))
+
+        if options['unmatched_report'] and importer.unmatched:
+            with open(options['unmatched_report'], 'w', newline='') as report:
+                writer = csv.DictWriter(report, fieldnames=list(importer.unmatched[0]))
+                writer.writeheader()
+                writer.writerows(importer.unmatched)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['imported']} payments, "
+            f"skipped {summary['duplicates']} duplicates, "
+            f"{summary['unmatched']} rows could not be applied"
+        ))
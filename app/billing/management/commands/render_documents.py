@@ -0,0 +1,32 @@
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+
+from billing.models import Invoice, Quote
+from billing.pdf import render_model
+
+
+class Command(BaseCommand):
+    help = "Render PDFs for invoices or quotes whose current version has not been rendered"
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help="Only render these documents")
+        parser.add_argument('--quotes', action='store_true', help="Render quotes instead of invoices")
+        parser.add_argument('--status', action='append', help="Only documents with this status (repeatable)")
+        parser.add_argument('--processes', type=int, help="Worker processes (default: one per CPU)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        model = Quote if options['quotes'] else Invoice
+        queryset = model.objects.order_by('id')
+        if options['ids']:
+            queryset = queryset.filter(id__in=options['ids'])
+        if options['status']:
+            queryset = queryset.filter(status__in=options['status'])
+
+        ids = queryset.values_list('id', flat=True).iterator()
+        rendered = 0
+        while batch := list(islice(ids, options['batch_size'])):
+            rendered += len(render_model(model, batch, processes=options['processes']))
+
+        self.stdout.write(self.style.SUCCESS(f"Rendered {rendered} {model._meta.verbose_name} PDFs"))
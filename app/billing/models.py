@@ -1,7 +1,14 @@
-from django.db import models
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Now
 from django.utils import timezone
 from clients.models import Client, ServiceAgreement
-from monitoring.models import Device
+from monitoring.models import Device, DeviceType
+from monitoring.uptime import device_uptime, period_bounds
 
 
 class Quote(models.Model):
@@ -83,6 +90,84 @@ class QuoteItem(models.Model):
         self.quote.save()
 
 
+# Invoices that still expect a payment
+OPEN_INVOICE_STATUSES = ('sent', 'overdue')
+
+AGING_BUCKET_CHOICES = [
+    ('current', 'Current'),
+    ('1_30', '1-30 days'),
+    ('31_60', '31-60 days'),
+    ('61_90', '61-90 days'),
+    ('over_90', 'Over 90 days'),
+]
+
+# Upper bound in days past due of each bucket after 'current'
+AGING_BUCKET_DAYS = [('1_30', 30), ('31_60', 60), ('61_90', 90)]
+
+
+def aging_bucket_for(due_date, today=None):
+    """Return the aging bucket of an open invoice due on ``due_date``."""
+    days_past_due = ((today or timezone.localdate()) - due_date).days
+    if days_past_due <= 0:
+        return 'current'
+    for bucket, max_days in AGING_BUCKET_DAYS:
+        if days_past_due <= max_days:
+            return bucket
+    return 'over_90'
+
+
+def aging_bucket_case(today=None):
+    """SQL equivalent of ``aging_bucket_for()`` on the ``due_date`` column."""
+    today = today or timezone.localdate()
+    return Case(
+        When(due_date__gte=today, then=Value('current')),
+        *[
+            When(due_date__gte=today - timedelta(days=max_days), then=Value(bucket))
+            for bucket, max_days in AGING_BUCKET_DAYS
+        ],
+        default=Value('over_90'),
+    )
+
+
+class InvoiceQuerySet(models.QuerySet):
+    """QuerySet with set-based balance helpers for invoices."""
+
+    def open(self):
+        """Invoices with an outstanding balance."""
+        return self.filter(status__in=OPEN_INVOICE_STATUSES, balance_due__gt=0)
+
+    def recompute_balances(self):
+        """Recompute ``balance_due`` and ``status`` from payments in one UPDATE.
+
+        Applies the same rules as ``Payment.save()`` to every invoice in the
+        queryset without loading them.
+        """
+        paid = Coalesce(
+            Subquery(
+                Payment.objects.filter(invoice=OuterRef('pk'))
+                .order_by()
+                .values('invoice')
+                .annotate(paid=Sum('amount'))
+                .values('paid')
+            ),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=12, decimal_places=2),
+        )
+        return self.update(
+            balance_due=F('total') - paid,
+            status=Case(
+                When(Q(total__lte=paid), then=Value('paid')),
+                When(status='paid', then=Value('sent')),
+                default=F('status'),
+            ),
+            aging_bucket=Case(
+                When(Q(total__lte=paid) | Q(status__in=('draft', 'canceled')), then=Value('')),
+                default=aging_bucket_case(),
+            ),
+            updated_at=Now(),
+        )
+
+
 class Invoice(models.Model):
     """Model representing an invoice to a client."""
     STATUS_CHOICES = [
@@ -121,16 +206,33 @@ class Invoice(models.Model):
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     balance_due = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     
+    # Receivables aging, blank unless the invoice is open
+    aging_bucket = models.CharField(max_length=10, choices=AGING_BUCKET_CHOICES, blank=True, db_index=True)
+    
     # Notes
     notes = models.TextField(blank=True)
     payment_terms = models.TextField(blank=True)
     
+    objects = InvoiceQuerySet.as_manager()
+    
+    # Client and issue date as last read from or written to the database
+    _loaded_client_id = None
+    _loaded_issue_date = None
+    
     class Meta:
         ordering = ['-issue_date']
         
     def __str__(self):
         return f"Invoice #{self.invoice_number} for {self.client.name}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember where the invoice was counted so summaries can move it
+        instance._loaded_client_id = instance.__dict__.get('client_id')
+        instance._loaded_issue_date = instance.__dict__.get('issue_date')
+        return instance
+    
     def save(self, *args, **kwargs):
         # Calculate tax and total
         self.tax_amount = round(self.subtotal * (self.tax_percent / 100), 2)
@@ -139,6 +241,11 @@ class Invoice(models.Model):
         if self.status != 'paid':
             self.balance_due = self.total
         
+        if self.status in OPEN_INVOICE_STATUSES and self.balance_due > 0:
+            self.aging_bucket = aging_bucket_for(self.due_date)
+        else:
+            self.aging_bucket = ''
+        
         # Generate invoice number if not provided
         if not self.invoice_number:
             prefix = "INV"
@@ -158,6 +265,44 @@ class Invoice(models.Model):
             self.invoice_number = f"{prefix}{year}{month}{new_number:04d}"
             
         super().save(*args, **kwargs)
+        self._loaded_client_id = self.client_id
+        self._loaded_issue_date = self.issue_date
+    
+    def add_sla_credit_items(self):
+        """Credit devices that missed the service agreement's uptime target."""
+        agreement = self.service_agreement
+        if not (agreement and agreement.sla_uptime_target is not None and agreement.sla_credit_percent):
+            return []
+        if not (self.billing_period_start and self.billing_period_end):
+            return []
+        
+        devices = list(
+            Device.objects.filter(client=self.client, monitoring_enabled=True)
+            .with_billing_price()
+            .only('id', 'name', 'created_at', 'custom_price')
+        )
+        start, end = period_bounds(self.billing_period_start, self.billing_period_end)
+        uptime = device_uptime(devices, start, end)
+        
+        items = []
+        for device in devices:
+            percent = uptime[device.id]['uptime']
+            if percent >= agreement.sla_uptime_target or not device.effective_price:
+                continue
+            credit = (device.effective_price * agreement.sla_credit_percent / 100).quantize(Decimal('0.01'))
+            items.append(InvoiceItem(
+                invoice=self,
+                device=device,
+                description=f"SLA credit: {device.name} at {percent:.2f}% uptime (target {agreement.sla_uptime_target}%)",
+                quantity=1,
+                unit_price=-credit,
+                total_price=-credit,
+            ))
+        InvoiceItem.objects.bulk_create(items)
+        
+        self.subtotal = sum(item.total_price for item in self.items.all())
+        self.save()
+        return items
 
 
 class InvoiceItem(models.Model):
@@ -221,3 +366,326 @@ class Payment(models.Model):
             invoice.status = 'sent'
             
         invoice.save()
+
+
+class DeviceUsageDayQuerySet(models.QuerySet):
+    """QuerySet with aggregation helpers for device usage metering."""
+
+    def prorated_totals(self, start_date, end_date):
+        """Return prorated device charges per client and device type.
+
+        Each row is a dict with ``client``, ``device_type``,
+        ``device_type__name``, ``device_days`` and ``amount``, where
+        ``amount`` is the sum of daily device prices over the period divided
+        by the number of days in it.
+        """
+        period_days = (end_date - start_date).days + 1
+        rows = list(
+            self.filter(date__range=(start_date, end_date))
+            .order_by()
+            .values('client', 'device_type', 'device_type__name')
+            .annotate(
+                device_days=Sum(F('closing_devices') + F('departed_devices')),
+                price_days=Sum(F('closing_amount') + F('departed_amount')),
+            )
+            .order_by('client', 'device_type__name')
+        )
+        for row in rows:
+            row['amount'] = round(row.pop('price_days') / period_days, 2)
+        return rows
+
+    def record_departure(self, device, date=None):
+        """Count a device that left the active state today as active for the day.
+
+        A device leaving after the day's snapshot was already counted among
+        the closing devices, so it is moved from those to the departures
+        instead of being counted twice. A device leaving again on the same
+        day, after being reactivated, is not counted again.
+        """
+        date = date or timezone.localdate()
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    DeviceDeparture.objects.create(device_id=device.pk, date=date)
+            except IntegrityError:
+                return  # Already counted today
+            self._count_departure(device, date)
+
+    def _count_departure(self, device, date):
+        price = Decimal(device.billing_price)
+        day = self.filter(client_id=device.client_id, device_type_id=device.device_type_id, date=date)
+        snapshot_taken = Q(closing_devices__gt=0)
+        changes = {
+            'closing_devices': Case(
+                When(snapshot_taken, then=F('closing_devices') - 1), default=F('closing_devices'),
+                output_field=models.PositiveIntegerField(),
+            ),
+            'closing_amount': Case(
+                When(snapshot_taken, then=Greatest(F('closing_amount') - price, Value(Decimal('0.00')))),
+                default=F('closing_amount'),
+                output_field=DecimalField(),
+            ),
+            'departed_devices': F('departed_devices') + 1,
+            'departed_amount': F('departed_amount') + price,
+        }
+        if day.update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                self.create(
+                    client_id=device.client_id,
+                    device_type_id=device.device_type_id,
+                    date=date,
+                    departed_devices=1,
+                    departed_amount=price,
+                )
+        except IntegrityError:
+            # Another departure created the day's row first
+            day.update(**changes)
+
+    @transaction.atomic
+    def snapshot(self, date=None):
+        """Record the devices active at the end of ``date``.
+
+        Safe to re-run for the same day: closing counts are overwritten while
+        departures recorded during the day are kept.
+        """
+        date = date or timezone.localdate()
+        # Only needed to tell repeated departures apart within a day
+        DeviceDeparture.objects.filter(date__lt=date).delete()
+        # Devices that left and came back today are already counted as departed
+        departed = DeviceDeparture.objects.filter(date=date).values('device_id')
+        totals = {
+            (row['client'], row['device_type']): row
+            for row in Device.objects.billable().exclude(id__in=departed).price_totals()
+        }
+        existing = {
+            (usage.client_id, usage.device_type_id): usage
+            for usage in self.filter(date=date)
+        }
+        
+        to_update = []
+        for key, usage in existing.items():
+            row = totals.pop(key, None)
+            usage.closing_devices = row['device_count'] if row else 0
+            usage.closing_amount = row['total_price'] if row else Decimal('0.00')
+            to_update.append(usage)
+        to_create = [
+            DeviceUsageDay(
+                client_id=client_id,
+                device_type_id=device_type_id,
+                date=date,
+                closing_devices=row['device_count'],
+                closing_amount=row['total_price'],
+            )
+            for (client_id, device_type_id), row in totals.items()
+        ]
+        
+        self.bulk_update(to_update, ['closing_devices', 'closing_amount'])
+        self.bulk_create(to_create)
+        return len(to_update) + len(to_create)
+
+
+class DeviceUsageDay(models.Model):
+    """Model metering active device-days per client and device type.
+
+    ``closing_*`` holds the devices active at the end of the day (written by
+    the daily snapshot) and ``departed_*`` the devices that left the active
+    state during the day (incremented on status transitions).
+    """
+    client = models.ForeignKey(Client, related_name='device_usage', on_delete=models.CASCADE)
+    device_type = models.ForeignKey(DeviceType, on_delete=models.SET_NULL, null=True, blank=True)
+    date = models.DateField()
+    
+    closing_devices = models.PositiveIntegerField(default=0)
+    closing_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    departed_devices = models.PositiveIntegerField(default=0)
+    departed_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    
+    objects = DeviceUsageDayQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'device_type', 'date'], name='unique_device_usage_day'),
+            # NULLs are distinct in the constraint above
+            models.UniqueConstraint(
+                fields=['client', 'date'], condition=Q(device_type__isnull=True),
+                name='unique_untyped_device_usage_day',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.client.name} usage on {self.date}"
+    
+    @property
+    def device_days(self):
+        return self.closing_devices + self.departed_devices
+
+
+class DeviceDeparture(models.Model):
+    """A device counted as departed on a day, so it is counted once."""
+    # No database constraint: departures of deleted devices are recorded
+    # after the device row is gone
+    device = models.ForeignKey(Device, related_name='+', on_delete=models.DO_NOTHING, db_constraint=False)
+    date = models.DateField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device', 'date'], name='unique_device_departure'),
+        ]
+
+
+class StripeSyncItemQuerySet(models.QuerySet):
+    """QuerySet for the Stripe sync outbox."""
+
+    def enqueue(self, model_name, object_id):
+        """Queue an object for syncing unless it is already waiting.
+
+        An item that was already tried is not reused: its retries must send
+        the same parameters under its idempotency key, so later changes get
+        an item and key of their own.
+        """
+        item, _ = self.get_or_create(model_name=model_name, object_id=object_id, status='pending', attempts=0)
+        return item
+
+    def enqueue_many(self, model_name, object_ids):
+        """Queue several objects of one model with a single lookup and insert."""
+        waiting = set(
+            self.filter(model_name=model_name, object_id__in=object_ids, status='pending', attempts=0)
+            .values_list('object_id', flat=True)
+        )
+        self.bulk_create([
+            StripeSyncItem(model_name=model_name, object_id=object_id)
+            for object_id in set(object_ids) - waiting
+        ])
+
+    def due(self):
+        return self.filter(status='pending', next_attempt_at__lte=timezone.now())
+
+    def release_stale(self, older_than=timedelta(minutes=10)):
+        """Return items left in processing by a crashed worker to the queue."""
+        return self.filter(
+            status='processing', updated_at__lt=timezone.now() - older_than
+        ).update(status='pending', updated_at=timezone.now())
+
+
+class StripeSyncItem(models.Model):
+    """Outbox entry for a local change that has to be sent to Stripe."""
+    MODEL_CHOICES = [
+        ('client', 'Client'),
+        ('invoice', 'Invoice'),
+        ('payment', 'Payment'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('synced', 'Synced'),
+        ('failed', 'Failed'),
+    ]
+    
+    model_name = models.CharField(max_length=20, choices=MODEL_CHOICES)
+    object_id = models.BigIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    
+    # Reused on every retry so Stripe applies each change only once
+    idempotency_key = models.UUIDField(default=uuid.uuid4, editable=False)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    synced_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = StripeSyncItemQuerySet.as_manager()
+    
+    class Meta:
+        ordering = ['next_attempt_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at']),
+            models.Index(fields=['model_name', 'object_id']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_model_name_display()} #{self.object_id} ({self.status})"
+
+
+class StripeEvent(models.Model):
+    """Model storing a raw Stripe webhook event until it is applied."""
+    STATUS_CHOICES = [
+        ('received', 'Received'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('failed', 'Failed'),
+    ]
+    
+    event_id = models.CharField(max_length=100, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='received')
+    error = models.TextField(blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-received_at']
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.type} ({self.event_id})"
+
+
+class ReceivableSummary(models.Model):
+    """Model holding a client's outstanding balance by aging bucket.
+
+    Kept current in the same transaction as invoice and payment changes and
+    re-aged nightly, so dashboards never have to scan invoices.
+    """
+    client = models.OneToOneField(Client, related_name='receivable_summary', on_delete=models.CASCADE)
+    current = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    days_1_30 = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    days_31_60 = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    days_61_90 = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    days_over_90 = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    total_due = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    open_invoices = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    # Aging bucket stored on Invoice -> field on this model
+    BUCKET_FIELDS = {
+        'current': 'current',
+        '1_30': 'days_1_30',
+        '31_60': 'days_31_60',
+        '61_90': 'days_61_90',
+        'over_90': 'days_over_90',
+    }
+    
+    class Meta:
+        ordering = ['-total_due']
+        verbose_name_plural = "Receivable summaries"
+    
+    def __str__(self):
+        return f"Receivables for {self.client.name}"
+
+
+class RevenueSummary(models.Model):
+    """Model holding invoiced and collected amounts per client and month."""
+    client = models.ForeignKey(Client, related_name='revenue_summaries', on_delete=models.CASCADE)
+    month = models.DateField(help_text="First day of the month")
+    invoiced = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    collected = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-month']
+        verbose_name_plural = "Revenue summaries"
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'month'], name='unique_revenue_summary_month'),
+        ]
+    
+    def __str__(self):
+        return f"Revenue for {self.client.name} in {self.month:%Y-%m}"
@@ -0,0 +1,215 @@
+"""
+PDF rendering of invoices and quotes.
+
+Documents are loaded in bulk into plain dicts, so rendering needs no
+database access and can run in a process pool. Each process compiles the
+layout template and loads the font and logo once. Output files are named
+after the document's ``updated_at``, so unchanged documents are never
+rendered twice.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connections
+from django.template.loader import get_template
+from PIL import Image, ImageDraw, ImageFont
+
+from .models import Invoice, Quote
+
+TEMPLATE_NAME = 'billing/document.txt'
+
+# A4 at 150 dpi
+DPI = 150
+PAGE_SIZE = (1240, 1754)
+MARGIN = 90
+FONT_SIZE = 20
+HEADING_SIZE = 36
+LINE_SPACING = 1.35
+LOGO_MAX_SIZE = (360, 120)
+
+
+@lru_cache(maxsize=None)
+def layout_template():
+    return get_template(TEMPLATE_NAME)
+
+
+@lru_cache(maxsize=None)
+def load_font(size):
+    try:
+        return ImageFont.truetype(settings.BILLING_PDF_FONT, size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+@lru_cache(maxsize=None)
+def load_logo():
+    """Return the logo scaled for the page header, or None if there is none."""
+    path = settings.BILLING_LOGO_PATH
+    if not path or not os.path.exists(path):
+        return None
+    with Image.open(path) as logo:
+        logo = logo.convert('RGBA')
+        logo.thumbnail(LOGO_MAX_SIZE)
+        background = Image.new('RGB', logo.size, 'white')
+        background.paste(logo, mask=logo)
+        return background
+
+
+def document_data(obj):
+    """Return a picklable snapshot of an invoice or quote for rendering."""
+    is_invoice = isinstance(obj, Invoice)
+    client = obj.client
+    data = {
+        'kind': 'invoice' if is_invoice else 'quote',
+        'heading': 'Invoice' if is_invoice else 'Quote',
+        'number': obj.invoice_number if is_invoice else obj.quote_number,
+        'title': obj.title,
+        'updated_at': obj.updated_at,
+        'client': {
+            'name': client.name,
+            'address': client.address,
+            'city': client.city,
+            'state': client.state,
+            'zip_code': client.zip_code,
+        },
+        'items': [
+            {
+                'description': item.description,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'total_price': item.total_price,
+            }
+            for item in obj.items.all()
+        ],
+        'subtotal': obj.subtotal,
+        'tax_label': f"Tax ({obj.tax_percent}%)",
+        'tax_amount': obj.tax_amount,
+        'total': obj.total,
+        'notes': obj.notes,
+        'payments': [],
+        'balance_due': None,
+    }
+    if is_invoice:
+        data['dates'] = [('Issued', obj.issue_date), ('Due', obj.due_date)]
+        data['terms'] = obj.payment_terms
+        data['balance_due'] = obj.balance_due
+        data['payments'] = [
+            {
+                'payment_date': payment.payment_date,
+                'method': payment.get_payment_method_display(),
+                'reference_number': payment.reference_number,
+                'amount': payment.amount,
+            }
+            for payment in obj.payments.all()
+        ]
+    else:
+        data['dates'] = [('Expires', obj.expiration_date)]
+        data['terms'] = obj.terms
+    return data
+
+
+def load_documents(model, ids):
+    """Load invoices or quotes with their lines in a fixed number of queries."""
+    queryset = model.objects.filter(id__in=ids).select_related('client').prefetch_related('items')
+    if model is Invoice:
+        queryset = queryset.prefetch_related('payments')
+    return [document_data(obj) for obj in queryset]
+
+
+def output_name(data):
+    """Return the storage path of a document relative to MEDIA_ROOT."""
+    # Microseconds, so a document saved twice within a second gets a new file
+    version = data['updated_at'].strftime('%Y%m%d%H%M%S%f')
+    return os.path.join('billing', f"{data['kind']}s", f"{data['number']}-{version}.pdf")
+
+
+def output_path(data):
+    return os.path.join(settings.MEDIA_ROOT, output_name(data))
+
+
+def draw_pages(lines):
+    """Lay out text lines on as many pages as needed."""
+    font = load_font(FONT_SIZE)
+    heading_font = load_font(HEADING_SIZE)
+    logo = load_logo()
+    line_height = int(FONT_SIZE * LINE_SPACING)
+
+    pages = []
+    page = draw = y = None
+    for line in lines:
+        is_heading = line.startswith('# ')
+        height = int(HEADING_SIZE * LINE_SPACING) if is_heading else line_height
+        if page is None or y + height > PAGE_SIZE[1] - MARGIN:
+            page = Image.new('RGB', PAGE_SIZE, 'white')
+            draw = ImageDraw.Draw(page)
+            y = MARGIN
+            if logo is not None and not pages:
+                page.paste(logo, (PAGE_SIZE[0] - MARGIN - logo.width, MARGIN))
+            pages.append(page)
+        if is_heading:
+            draw.text((MARGIN, y), line[2:], font=heading_font, fill='black')
+        else:
+            draw.text((MARGIN, y), line, font=font, fill='black')
+        y += height
+    return pages
+
+
+def render_document(data):
+    """Render one document to MEDIA_ROOT unless it is already there."""
+    path = output_path(data)
+    if os.path.exists(path):
+        return path
+
+    context = dict(data, rule='-' * 80)
+    lines = layout_template().render(context).splitlines()
+    pages = draw_pages(lines)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename so readers never see a partial file
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    pages[0].save(tmp_path, 'PDF', resolution=DPI, save_all=True, append_images=pages[1:])
+    os.replace(tmp_path, path)
+
+    # Remove renderings of earlier versions of the document
+    prefix = f"{data['number']}-"
+    directory = os.path.dirname(path)
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and name.endswith('.pdf') and name != os.path.basename(path):
+            os.remove(os.path.join(directory, name))
+    return path
+
+
+def render_documents(documents, processes=None, chunksize=20):
+    """Render documents that have no current PDF, in parallel when asked.
+
+    ``processes`` of 0 or 1 renders in the calling process, which is what
+    Celery workers need since their processes may not start children.
+    """
+    documents = [data for data in documents if not os.path.exists(output_path(data))]
+    if not documents:
+        return []
+    if processes is not None and processes <= 1:
+        return [render_document(data) for data in documents]
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(render_document, documents, chunksize=chunksize))
+
+
+def stale_ids(model, ids):
+    """Return the ids whose current version has not been rendered yet."""
+    number_field = 'invoice_number' if model is Invoice else 'quote_number'
+    kind = 'invoice' if model is Invoice else 'quote'
+    rows = model.objects.filter(id__in=ids).values_list('id', number_field, 'updated_at')
+    return [
+        pk for pk, number, updated_at in rows
+        if not os.path.exists(output_path({'kind': kind, 'number': number, 'updated_at': updated_at}))
+    ]
+
+
+def render_model(model, ids, processes=None):
+    """Render the given invoices or quotes, skipping unchanged ones."""
+    return render_documents(load_documents(model, stale_ids(model, ids)), processes=processes)
@@ -0,0 +1,197 @@
+"""
+Streaming import of bank and payment processor transactions.
+
+Transactions are read row by row from CSV or OFX statements, matched to
+invoices through an in-memory index of invoice numbers and Stripe ids, and
+applied in batches: one ``bulk_create`` of ``Payment`` rows and one UPDATE of
+the affected invoices' balances per batch. Rows that cannot be applied are
+collected with their line number and the reason instead of aborting the
+import.
+"""
+import csv
+import re
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from dateutil import parser as date_parser
+from django.conf import settings
+from django.db import transaction
+
+from core import audit
+from .models import Invoice, Payment, StripeSyncItem
+from .summaries import refresh_for_payments
+
+# Invoice numbers are generated as INV + YYYYMM + 4-digit sequence
+INVOICE_NUMBER_RE = re.compile(r'\bINV\d{10}\b', re.IGNORECASE)
+
+OFX_FIELD_RE = re.compile(r'<(\w+)>([^<\r\n]*)')
+
+
+def read_csv(stream):
+    """Yield transactions from a CSV file.
+
+    Expects a header row with ``date``, ``amount`` and ``reference`` columns
+    and optionally ``transaction_id``, ``payment_method`` and ``notes``.
+    """
+    reader = csv.DictReader(stream)
+    for row in reader:
+        # Columns missing from short rows are None
+        yield {
+            'line': reader.line_num,
+            'date': row.get('date') or '',
+            'amount': row.get('amount') or '',
+            'reference': row.get('reference') or '',
+            'transaction_id': row.get('transaction_id') or '',
+            'payment_method': row.get('payment_method') or '',
+            'notes': row.get('notes') or '',
+        }
+
+
+def read_ofx(stream):
+    """Yield transactions from an OFX (SGML or XML) statement."""
+    transaction_fields = None
+    for number, line in enumerate(stream, start=1):
+        for tag, value in OFX_FIELD_RE.findall(line):
+            tag = tag.upper()
+            if tag == 'STMTTRN':
+                transaction_fields = {}
+            elif transaction_fields is not None:
+                transaction_fields[tag] = value.strip()
+        if transaction_fields is not None and '</STMTTRN>' in line.upper():
+            yield {
+                'line': number,
+                'date': transaction_fields.get('DTPOSTED', '')[:8],
+                'amount': transaction_fields.get('TRNAMT', ''),
+                'reference': ' '.join(
+                    transaction_fields.get(tag, '') for tag in ('REFNUM', 'CHECKNUM', 'NAME', 'MEMO')
+                ),
+                'transaction_id': transaction_fields.get('FITID', ''),
+                'payment_method': 'check' if transaction_fields.get('CHECKNUM') else '',
+                'notes': transaction_fields.get('MEMO', ''),
+            }
+            transaction_fields = None
+
+
+PAYMENT_METHODS = {choice for choice, _ in Payment.PAYMENT_METHOD_CHOICES}
+REFERENCE_MAX_LENGTH = Payment._meta.get_field('reference_number').max_length
+
+READERS = {
+    'csv': read_csv,
+    'ofx': read_ofx,
+}
+
+
+class PaymentImporter:
+    """Match imported transactions to invoices and apply them as payments."""
+
+    def __init__(self, payment_method='ach', batch_size=1000):
+        self.payment_method = payment_method
+        self.batch_size = batch_size
+        self.invoice_index = {}
+        self.seen_references = set()
+        self.imported = 0
+        self.duplicates = 0
+        self.unmatched = []
+
+    def load_index(self):
+        """Load invoice numbers, Stripe ids and known payment references."""
+        invoices = Invoice.objects.exclude(status='canceled').values_list(
+            'id', 'invoice_number', 'stripe_invoice_id', 'stripe_payment_intent_id'
+        )
+        for invoice_id, *keys in invoices.iterator(chunk_size=5000):
+            for key in keys:
+                if key:
+                    self.invoice_index[key.upper()] = invoice_id
+
+        references = Payment.objects.exclude(reference_number='').values_list('reference_number', flat=True)
+        self.seen_references.update(references.iterator(chunk_size=5000))
+
+    def match(self, reference):
+        """Return the id of the invoice a transaction reference points to."""
+        reference = reference.strip().upper()
+        if reference in self.invoice_index:
+            return self.invoice_index[reference]
+        for candidate in INVOICE_NUMBER_RE.findall(reference):
+            if candidate in self.invoice_index:
+                return self.invoice_index[candidate]
+        for token in reference.split():
+            if token in self.invoice_index:
+                return self.invoice_index[token]
+        return None
+
+    def build_payment(self, row):
+        """Return an unsaved Payment for a transaction, or None to skip it."""
+        try:
+            amount = Decimal(row['amount'].replace(',', '').replace('$', ''))
+            payment_date = date_parser.parse(row['date']).date()
+            if not amount.is_finite():
+                raise InvalidOperation(row['amount'])
+        except (InvalidOperation, ValueError, OverflowError):
+            self.unmatched.append(dict(row, error='Invalid amount or date'))
+            return None
+
+        # Only incoming money can pay an invoice
+        if amount <= 0:
+            self.unmatched.append(dict(row, error='Amount is not positive'))
+            return None
+
+        payment_method = row['payment_method'].strip().lower() or self.payment_method
+        if payment_method not in PAYMENT_METHODS:
+            self.unmatched.append(dict(row, error=f"Unknown payment method '{row['payment_method']}'"))
+            return None
+
+        transaction_id = row['transaction_id'].strip()
+        if len(transaction_id) > REFERENCE_MAX_LENGTH:
+            self.unmatched.append(dict(row, error=f'Transaction id longer than {REFERENCE_MAX_LENGTH} characters'))
+            return None
+        if transaction_id and transaction_id in self.seen_references:
+            self.duplicates += 1
+            return None
+
+        invoice_id = self.match(row['reference'])
+        if invoice_id is None:
+            self.unmatched.append(dict(row, error='No matching invoice'))
+            return None
+
+        if transaction_id:
+            self.seen_references.add(transaction_id)
+        return Payment(
+            invoice_id=invoice_id,
+            amount=amount,
+            payment_date=payment_date,
+            payment_method=payment_method,
+            reference_number=transaction_id,
+            notes=row['notes'],
+        )
+
+    @transaction.atomic
+    def apply_batch(self, payments):
+        """Insert a batch of payments and recompute the affected invoices."""
+        Payment.objects.bulk_create(payments)
+        invoice_ids = {payment.invoice_id for payment in payments}
+        Invoice.objects.filter(id__in=invoice_ids).recompute_balances()
+        refresh_for_payments(payments)
+        if settings.STRIPE_SECRET_KEY:
+            StripeSyncItem.objects.enqueue_many('invoice', invoice_ids)
+        audit.record_batch('create', Payment, len(payments), {'source': 'payment import', 'invoices': len(invoice_ids)})
+        self.imported += len(payments)
+
+    def run(self, rows):
+        """Import an iterable of transaction rows and return a summary."""
+        if not self.invoice_index:
+            self.load_index()
+
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.batch_size))
+            if not chunk:
+                break
+            payments = [payment for payment in map(self.build_payment, chunk) if payment]
+            if payments:
+                self.apply_batch(payments)
+
+        return {
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'unmatched': len(self.unmatched),
+        }
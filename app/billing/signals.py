@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from clients.models import Client
+from monitoring.models import Device
+from .models import DeviceUsageDay, Invoice, Payment, StripeSyncItem
+from .summaries import refresh_receivables, refresh_revenue
+
+
+@receiver(post_save, sender=Device)
+def record_device_departure(sender, instance, created, **kwargs):
+    """Meter a device for today when it leaves the active state."""
+    if instance._loaded_status == 'active' and instance.status != 'active':
+        DeviceUsageDay.objects.record_departure(instance)
+
+
+def deleted_with_client(origin):
+    """Whether a delete cascades from deleting a client.
+
+    The client's usage and summary rows go with it, so they must not be
+    written to while it is being deleted.
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return origin_model is Client
+
+
+@receiver(post_delete, sender=Device)
+def record_device_deletion(sender, instance, origin=None, **kwargs):
+    """Meter an active device for today when it is deleted."""
+    if not deleted_with_client(origin) and instance._loaded_status == 'active':
+        DeviceUsageDay.objects.record_departure(instance)
+
+
+@receiver(post_save, sender=Client, dispatch_uid='stripe_sync_client')
+@receiver(post_save, sender=Invoice, dispatch_uid='stripe_sync_invoice')
+@receiver(post_save, sender=Payment, dispatch_uid='stripe_sync_payment')
+def queue_stripe_sync(sender, instance, raw=False, **kwargs):
+    """Queue a changed client, invoice or payment for the Stripe sync worker."""
+    if raw or not settings.STRIPE_SECRET_KEY:
+        return
+    StripeSyncItem.objects.enqueue(sender._meta.model_name, instance.pk)
+
+
+@receiver(post_save, sender=Invoice, dispatch_uid='summaries_invoice_saved')
+@receiver(post_delete, sender=Invoice, dispatch_uid='summaries_invoice_deleted')
+def refresh_invoice_summaries(sender, instance, origin=None, **kwargs):
+    """Keep the client's receivables and monthly revenue in step with an invoice."""
+    if deleted_with_client(origin):
+        return
+    client_ids = {instance.client_id}
+    client_months = {(instance.client_id, instance.issue_date)}
+    # An edit may have moved the invoice to another client or month
+    if instance._loaded_client_id is not None:
+        client_ids.add(instance._loaded_client_id)
+        client_months.add((instance._loaded_client_id, instance._loaded_issue_date))
+    refresh_receivables(client_ids)
+    refresh_revenue(client_months)
+
+
+@receiver(post_save, sender=Payment, dispatch_uid='summaries_payment_saved')
+@receiver(post_delete, sender=Payment, dispatch_uid='summaries_payment_deleted')
+def refresh_payment_summaries(sender, instance, origin=None, **kwargs):
+    """Keep the client's collected revenue in step with a payment."""
+    if deleted_with_client(origin):
+        return
+    client_id = Invoice.objects.filter(pk=instance.invoice_id).values_list('client_id', flat=True).first()
+    if client_id is not None:
+        refresh_revenue({(client_id, instance.payment_date)})
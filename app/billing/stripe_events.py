@@ -0,0 +1,172 @@
+"""
+Batch processing of stored Stripe webhook events.
+
+The webhook view only verifies and stores events. The functions here claim
+stored events in batches and apply them to invoices and payments: each
+batch loads its invoices and known payments in one query each, bulk-inserts
+new ``Payment`` rows and recomputes the affected invoice balances with a
+single UPDATE. If a batch raises, its events are applied again one by one,
+each in its own savepoint, and the ones that still raise are marked as
+failed with the error.
+"""
+import logging
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Invoice, Payment, StripeEvent
+from .summaries import refresh_for_payments
+
+logger = logging.getLogger(__name__)
+
+HANDLED_EVENT_TYPES = ('invoice.paid', 'payment_intent.succeeded')
+
+
+def event_payment(event):
+    """Return the payment described by an event as a dict, or None."""
+    obj = event.payload.get('data', {}).get('object', {})
+    if event.type == 'invoice.paid':
+        # Invoices we settled out of band already have their local payment
+        if obj.get('paid_out_of_band') or not obj.get('amount_paid'):
+            return None
+        return {
+            'payment_id': obj.get('payment_intent') or obj.get('charge') or obj.get('id'),
+            'stripe_invoice_id': obj.get('id'),
+            'payment_intent_id': obj.get('payment_intent') or '',
+            'invoice_id': obj.get('metadata', {}).get('invoice_id'),
+            'amount': obj['amount_paid'],
+        }
+    if event.type == 'payment_intent.succeeded':
+        return {
+            'payment_id': obj.get('id'),
+            'stripe_invoice_id': obj.get('invoice') or '',
+            'payment_intent_id': obj.get('id'),
+            'invoice_id': obj.get('metadata', {}).get('invoice_id'),
+            'amount': obj.get('amount_received') or obj.get('amount') or 0,
+        }
+    return None
+
+
+def match_invoices(payments):
+    """Map each payment dict to an invoice id with a single query."""
+    stripe_ids = {p['stripe_invoice_id'] for p in payments if p['stripe_invoice_id']}
+    intent_ids = {p['payment_intent_id'] for p in payments if p['payment_intent_id']}
+    local_ids = {int(p['invoice_id']) for p in payments if str(p['invoice_id'] or '').isdigit()}
+
+    invoices = Invoice.objects.filter(
+        Q(stripe_invoice_id__in=stripe_ids)
+        | Q(stripe_payment_intent_id__in=intent_ids)
+        | Q(id__in=local_ids)
+    ).values_list('id', 'stripe_invoice_id', 'stripe_payment_intent_id')
+
+    by_stripe_invoice, by_intent = {}, {}
+    known_ids = set()
+    for invoice_id, stripe_invoice_id, intent_id in invoices:
+        known_ids.add(invoice_id)
+        if stripe_invoice_id:
+            by_stripe_invoice[stripe_invoice_id] = invoice_id
+        if intent_id:
+            by_intent[intent_id] = invoice_id
+
+    for payment in payments:
+        local_id = int(payment['invoice_id']) if str(payment['invoice_id'] or '').isdigit() else None
+        payment['matched_invoice'] = (
+            by_stripe_invoice.get(payment['stripe_invoice_id'])
+            or by_intent.get(payment['payment_intent_id'])
+            or (local_id if local_id in known_ids else None)
+        )
+
+
+def apply_events(events):
+    """Apply a batch of claimed events and set their status."""
+    now = timezone.now()
+    pending = []
+    for event in events:
+        event.processed_at = now
+        if event.type not in HANDLED_EVENT_TYPES:
+            event.status = 'ignored'
+            continue
+        payment = event_payment(event)
+        if payment is None:
+            event.status = 'processed'
+            continue
+        payment['event'] = event
+        pending.append(payment)
+
+    if not pending:
+        return
+
+    match_invoices(pending)
+    known_payment_ids = set(
+        Payment.objects.filter(stripe_payment_id__in={p['payment_id'] for p in pending})
+        .values_list('stripe_payment_id', flat=True)
+    )
+
+    new_payments = []
+    for payment in pending:
+        event = payment['event']
+        if payment['matched_invoice'] is None:
+            event.status = 'failed'
+            event.error = 'No matching invoice'
+            logger.warning("Stripe event %s matches no invoice", event.event_id)
+            continue
+        event.status = 'processed'
+        # invoice.paid and payment_intent.succeeded describe the same payment
+        if payment['payment_id'] in known_payment_ids:
+            continue
+        known_payment_ids.add(payment['payment_id'])
+        created = event.payload.get('created')
+        new_payments.append(Payment(
+            invoice_id=payment['matched_invoice'],
+            amount=Decimal(payment['amount']) / 100,
+            payment_date=(
+                datetime.fromtimestamp(created, tz=dt_timezone.utc).date() if created else now.date()
+            ),
+            payment_method='credit_card',
+            reference_number=payment['payment_id'],
+            stripe_payment_id=payment['payment_id'],
+            notes=f"Stripe event {event.event_id}",
+        ))
+
+    if new_payments:
+        Payment.objects.bulk_create(new_payments)
+        Invoice.objects.filter(id__in={p.invoice_id for p in new_payments}).recompute_balances()
+        refresh_for_payments(new_payments)
+
+
+def apply_events_separately(events):
+    """Apply events one by one so that an event that raises fails alone."""
+    for event in events:
+        try:
+            with transaction.atomic():
+                apply_events([event])
+        except Exception as exc:
+            logger.exception("Stripe event %s could not be applied", event.event_id)
+            event.status = 'failed'
+            event.error = f"{type(exc).__name__}: {exc}"
+            event.processed_at = timezone.now()
+
+
+def process_pending_events(batch_size=500):
+    """Apply all received events in batches and return how many were handled."""
+    handled = 0
+    while True:
+        with transaction.atomic():
+            events = list(
+                StripeEvent.objects.filter(status='received')
+                .select_for_update(skip_locked=True)
+                .order_by('received_at')[:batch_size]
+            )
+            if not events:
+                break
+            try:
+                with transaction.atomic():
+                    apply_events(events)
+            except Exception:
+                apply_events_separately(events)
+            StripeEvent.objects.bulk_update(events, ['status', 'error', 'processed_at'])
+        handled += len(events)
+    return handled
@@ -0,0 +1,160 @@
+"""
+Local stand-in for the parts of the Stripe API used by the sync worker.
+
+Run it with ``python manage.py fake_stripe`` and point ``STRIPE_API_BASE`` at
+it to exercise the sync worker without network access or a Stripe account.
+It keeps objects in memory, replays responses for repeated idempotency keys,
+rejects a key reused for a different request like Stripe does and can answer
+with 429s to exercise rate limiting and retries.
+"""
+import json
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from core.ratelimit import TokenBucket
+
+RESOURCES = {
+    'customers': ('customer', 'cus'),
+    'invoices': ('invoice', 'in'),
+    'invoiceitems': ('invoiceitem', 'ii'),
+}
+
+PATH_RE = re.compile(r'^/v1/(?P<resource>\w+)(?:/(?P<id>[\w-]+))?(?:/(?P<action>\w+))?/?$')
+
+NESTED_KEY_RE = re.compile(r'\[([^\]]*)\]')
+
+
+def parse_form(body):
+    """Decode Stripe's bracketed form encoding into nested dicts."""
+    params = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        name, _, rest = key.partition('[')
+        path = [name] + NESTED_KEY_RE.findall('[' + rest) if rest else [name]
+        target = params
+        for part in path[:-1]:
+            target = target.setdefault(part, {})
+        target[path[-1]] = value
+    return params
+
+
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeStripe/1.0'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Request-Id', f'req_{uuid.uuid4().hex[:14]}')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def error(self, status, message, error_type='invalid_request_error'):
+        return status, {'error': {'type': error_type, 'message': message}}
+
+    def do_GET(self):
+        self.handle_request({})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.handle_request(parse_form(self.rfile.read(length).decode()))
+
+    def handle_request(self, params):
+        server = self.server
+        if server.bucket and not server.bucket.try_acquire():
+            self.send_json(*self.error(429, 'Too many requests', 'rate_limit_error'))
+            return
+
+        key = self.headers.get('Idempotency-Key')
+        if key and self.command == 'POST':
+            with server.lock:
+                stored = server.idempotent_responses.get(key)
+            if stored is not None:
+                (path, stored_params), response = stored
+                if (path, stored_params) != (self.path, params):
+                    response = self.error(
+                        400,
+                        "Keys for idempotent requests can only be used with the same parameters they were "
+                        f"first used with. Try using a key other than '{key}' if you meant to execute a "
+                        "different request.",
+                        'idempotency_error',
+                    )
+                self.send_json(*response)
+                return
+
+        status, payload = self.dispatch(params)
+
+        with server.lock:
+            server.requests.append((self.command, self.path, params))
+            if key and self.command == 'POST' and status < 500:
+                server.idempotent_responses[key] = ((self.path, params), (status, payload))
+        self.send_json(status, payload)
+
+    def dispatch(self, params):
+        match = PATH_RE.match(self.path.split('?')[0])
+        if not match or match['resource'] not in RESOURCES:
+            return self.error(404, f'Unrecognized request URL ({self.path})')
+
+        resource, object_id, action = match['resource'], match['id'], match['action']
+        store = self.server.objects[resource]
+        object_name, prefix = RESOURCES[resource]
+
+        with self.server.lock:
+            if object_id is None:
+                if self.command != 'POST':
+                    return 200, {'object': 'list', 'data': list(store.values()), 'has_more': False}
+                obj = dict(params, id=f'{prefix}_{uuid.uuid4().hex[:14]}', object=object_name)
+                if object_name == 'invoice':
+                    obj.update(status='draft', paid=False)
+                store[obj['id']] = obj
+                return 200, obj
+
+            obj = store.get(object_id)
+            if obj is None:
+                return self.error(404, f"No such {object_name}: '{object_id}'")
+            if self.command == 'GET':
+                return 200, obj
+            if action is None:
+                obj.update(params)
+            elif object_name == 'invoice' and action == 'finalize':
+                obj['status'] = 'open'
+            elif object_name == 'invoice' and action == 'pay':
+                if obj['status'] != 'open':
+                    return self.error(400, f"Invoice is {obj['status']}")
+                obj.update(status='paid', paid=True)
+            elif object_name == 'invoice' and action == 'void':
+                obj['status'] = 'void'
+            else:
+                return self.error(404, f'Unrecognized request URL ({self.path})')
+            return 200, obj
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """In-memory Stripe API stand-in, optionally rate limited."""
+    daemon_threads = True
+
+    def __init__(self, address=('127.0.0.1', 0), rate_limit=None, verbose=False):
+        super().__init__(address, FakeStripeHandler)
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.objects = {resource: {} for resource in RESOURCES}
+        self.idempotent_responses = {}
+        self.requests = []
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serve from a background thread and return the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
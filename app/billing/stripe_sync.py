@@ -0,0 +1,304 @@
+"""
+Outbox-based synchronisation of clients, invoices and payments to Stripe.
+
+Saves only queue a ``StripeSyncItem``; the worker below claims due items in
+batches and sends them through a single reused HTTP session, throttled by a
+token bucket. Every item carries an idempotency key that is reused on
+retries, so a request that timed out can be repeated safely; each API call
+an item makes is keyed on it with a suffix naming the step. Transient
+errors are retried with exponential backoff, permanent ones mark the item
+as failed.
+
+Before creating a customer or invoice, an item claims it by writing a
+``pending:<key>`` marker into the empty Stripe id with a conditional update,
+so items running at the same time cannot create it twice. The API calls are
+made outside any transaction and the id replaces the marker once they have
+succeeded. Other items retry later while a marker is in place; the marker
+stays across retries of its own item, which replay the calls by key, and is
+cleared when that item fails for good.
+"""
+import calendar
+import logging
+from datetime import timedelta
+
+import requests
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from stripe.http_client import RequestsClient
+
+from clients.models import Client, Contact
+from core.ratelimit import TokenBucket
+from .models import Invoice, Payment, StripeSyncItem
+
+logger = logging.getLogger(__name__)
+
+PENDING_PREFIX = 'pending:'
+
+
+class CreationPending(Exception):
+    """Another item is creating the Stripe object this item needs."""
+
+
+# Errors worth retrying later; anything else is a permanent failure
+RETRYABLE_ERRORS = (
+    stripe.error.RateLimitError,
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    CreationPending,
+)
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30  # seconds
+BACKOFF_MAX = 6 * 3600
+
+
+def to_cents(amount):
+    return int((amount * 100).quantize(1))
+
+
+def remote_id(value):
+    """A stored Stripe id, or '' while it is only claimed."""
+    return '' if value.startswith(PENDING_PREFIX) else value
+
+
+def claim_creation(model, pk, field, key):
+    """Claim the creation of an object's Stripe counterpart.
+
+    Returns '' when the caller should create it, or the Stripe id another
+    item stored meanwhile. Raises ``CreationPending`` while another item
+    holds the claim.
+    """
+    marker = f'{PENDING_PREFIX}{key}'
+    if model.objects.filter(pk=pk, **{field: ''}).update(**{field: marker}):
+        return ''
+    current = model.objects.values_list(field, flat=True).get(pk=pk)
+    if current == marker:
+        # Left by an earlier attempt of this item; its calls replay by key
+        return ''
+    if current.startswith(PENDING_PREFIX):
+        raise CreationPending(f"{model._meta.verbose_name} {pk} is being created by another item")
+    return current
+
+
+def store_created(model, pk, field, key, stripe_id):
+    # update() rather than save() so the change is not queued again
+    model.objects.filter(pk=pk, **{field: f'{PENDING_PREFIX}{key}'}).update(**{field: stripe_id})
+
+
+def release_claims(key):
+    """Clear the creation claims of an item that failed for good."""
+    for model, field in ((Client, 'stripe_customer_id'), (Invoice, 'stripe_invoice_id')):
+        model.objects.filter(**{f'{field}__startswith': f'{PENDING_PREFIX}{key}'}).update(**{field: ''})
+
+
+class StripeSyncWorker:
+    """Send queued client, invoice and payment changes to Stripe."""
+
+    def __init__(self, batch_size=None, rate=None, api_key=None, api_base=None):
+        self.batch_size = batch_size or settings.STRIPE_SYNC_BATCH_SIZE
+        self.bucket = TokenBucket(rate or settings.STRIPE_SYNC_RATE)
+        self.api_key = api_key or settings.STRIPE_SECRET_KEY
+        self.session = requests.Session()
+
+        stripe.api_base = api_base or settings.STRIPE_API_BASE
+        stripe.default_http_client = RequestsClient(session=self.session, timeout=30)
+        # Retries are scheduled through the outbox instead
+        stripe.max_network_retries = 0
+
+    def close(self):
+        self.session.close()
+
+    def call(self, method, *args, idempotency_key=None, **params):
+        """Make one rate-limited API call."""
+        self.bucket.acquire()
+        if idempotency_key:
+            params['idempotency_key'] = idempotency_key
+        return method(*args, api_key=self.api_key, **params)
+
+    def claim(self):
+        """Mark a batch of due items as processing and return them."""
+        with transaction.atomic():
+            ids = list(
+                StripeSyncItem.objects.due()
+                .select_for_update(skip_locked=True)
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            StripeSyncItem.objects.filter(id__in=ids).update(status='processing', updated_at=timezone.now())
+        return list(StripeSyncItem.objects.filter(id__in=ids))
+
+    def load_objects(self, items):
+        """Fetch the objects behind a batch of items, one query per model."""
+        ids = {'client': set(), 'invoice': set(), 'payment': set()}
+        for item in items:
+            ids[item.model_name].add(item.object_id)
+
+        primary_contacts = Prefetch(
+            'contacts', queryset=Contact.objects.filter(is_primary=True), to_attr='primary_contacts'
+        )
+        return {
+            'client': Client.objects.prefetch_related(primary_contacts).in_bulk(ids['client']),
+            'invoice': Invoice.objects.select_related('client').prefetch_related('items').in_bulk(ids['invoice']),
+            'payment': Payment.objects.select_related('invoice__client').in_bulk(ids['payment']),
+        }
+
+    def run(self, max_batches=None):
+        """Process due items until the queue is empty, returning counts."""
+        StripeSyncItem.objects.release_stale()
+        counts = {'synced': 0, 'retried': 0, 'failed': 0}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            items = self.claim()
+            if not items:
+                break
+            self.process_batch(items, counts)
+            batches += 1
+        return counts
+
+    def process_batch(self, items, counts):
+        objects = self.load_objects(items)
+        now = timezone.now()
+        for item in items:
+            obj = objects[item.model_name].get(item.object_id)
+            item.attempts += 1
+            try:
+                if obj is not None:
+                    getattr(self, f'sync_{item.model_name}')(obj, str(item.idempotency_key))
+            except RETRYABLE_ERRORS as e:
+                item.last_error = str(e)
+                if item.attempts >= MAX_ATTEMPTS:
+                    item.status = 'failed'
+                    counts['failed'] += 1
+                else:
+                    delay = min(BACKOFF_BASE * 2 ** (item.attempts - 1), BACKOFF_MAX)
+                    item.status = 'pending'
+                    item.next_attempt_at = now + timedelta(seconds=delay)
+                    counts['retried'] += 1
+            except stripe.error.StripeError as e:
+                logger.warning("Stripe sync of %s failed: %s", item, e)
+                item.last_error = str(e)
+                item.status = 'failed'
+                counts['failed'] += 1
+            except Exception as e:
+                # A bug or bad data fails this item, not the rest of the batch
+                logger.exception("Stripe sync of %s failed", item)
+                item.last_error = str(e) or type(e).__name__
+                item.status = 'failed'
+                counts['failed'] += 1
+            else:
+                item.status = 'synced'
+                item.synced_at = now
+                item.last_error = ''
+                counts['synced'] += 1
+            item.updated_at = now
+            if item.status == 'failed':
+                release_claims(item.idempotency_key)
+
+        StripeSyncItem.objects.bulk_update(
+            items, ['status', 'attempts', 'next_attempt_at', 'last_error', 'synced_at', 'updated_at']
+        )
+
+    def sync_client(self, client, key):
+        """Create or update the Stripe customer for a client."""
+        contact = client.primary_contacts[0] if getattr(client, 'primary_contacts', None) else None
+        params = {
+            'name': client.name,
+            'phone': client.phone,
+            'address': {
+                'line1': client.address,
+                'city': client.city,
+                'state': client.state,
+                'postal_code': client.zip_code,
+            },
+            'metadata': {'client_id': client.pk},
+        }
+        if contact:
+            params['email'] = contact.email
+
+        if not remote_id(client.stripe_customer_id):
+            # Another item may have created the customer meanwhile
+            client.stripe_customer_id = claim_creation(Client, client.pk, 'stripe_customer_id', key)
+            if not client.stripe_customer_id:
+                customer = self.call(stripe.Customer.create, idempotency_key=f'{key}-create', **params)
+                store_created(Client, client.pk, 'stripe_customer_id', key, customer.id)
+                client.stripe_customer_id = customer.id
+                return
+        self.call(stripe.Customer.modify, client.stripe_customer_id, idempotency_key=f'{key}-modify', **params)
+
+    def sync_invoice(self, invoice, key):
+        """Create, finalize, pay or void the Stripe invoice for an invoice."""
+        # Drafts stay local until they are sent
+        if invoice.status == 'draft':
+            return
+
+        if not remote_id(invoice.stripe_invoice_id):
+            if invoice.status == 'canceled':
+                return
+            self.create_invoice(invoice, key)
+
+        if invoice.status in ('paid', 'canceled'):
+            remote = self.call(stripe.Invoice.retrieve, invoice.stripe_invoice_id)
+            if invoice.status == 'paid' and remote.status == 'open':
+                self.call(
+                    stripe.Invoice.pay,
+                    invoice.stripe_invoice_id,
+                    idempotency_key=f'{key}-pay',
+                    paid_out_of_band=True,
+                )
+            elif invoice.status == 'canceled' and remote.status == 'open':
+                self.call(stripe.Invoice.void_invoice, invoice.stripe_invoice_id, idempotency_key=f'{key}-void')
+
+    def create_invoice(self, invoice, key):
+        # Another item may have created the invoice meanwhile
+        invoice.stripe_invoice_id = claim_creation(Invoice, invoice.pk, 'stripe_invoice_id', key)
+        if not invoice.stripe_invoice_id:
+            self.create_remote_invoice(invoice, key)
+
+    def create_remote_invoice(self, invoice, key):
+        if not remote_id(invoice.client.stripe_customer_id):
+            self.sync_client(invoice.client, f'{key}-client')
+        customer = invoice.client.stripe_customer_id
+        remote = self.call(
+            stripe.Invoice.create,
+            idempotency_key=f'{key}-create',
+            customer=customer,
+            collection_method='send_invoice',
+            due_date=calendar.timegm(invoice.due_date.timetuple()),
+            pending_invoice_items_behavior='exclude',
+            metadata={'invoice_id': invoice.pk, 'invoice_number': invoice.invoice_number},
+        )
+        for index, item in enumerate(invoice.items.all()):
+            self.call(
+                stripe.InvoiceItem.create,
+                idempotency_key=f'{key}-item-{index}',
+                customer=customer,
+                invoice=remote.id,
+                amount=to_cents(item.total_price),
+                currency=settings.STRIPE_CURRENCY,
+                description=item.description,
+            )
+        if invoice.tax_amount:
+            self.call(
+                stripe.InvoiceItem.create,
+                idempotency_key=f'{key}-tax',
+                customer=customer,
+                invoice=remote.id,
+                amount=to_cents(invoice.tax_amount),
+                currency=settings.STRIPE_CURRENCY,
+                description=f"Tax ({invoice.tax_percent}%)",
+            )
+        self.call(stripe.Invoice.finalize_invoice, remote.id, idempotency_key=f'{key}-finalize')
+
+        # Stored only once complete; a retry replays the steps above by key
+        store_created(Invoice, invoice.pk, 'stripe_invoice_id', key, remote.id)
+        invoice.stripe_invoice_id = remote.id
+
+    def sync_payment(self, payment, key):
+        """Reflect a locally recorded payment on the Stripe invoice."""
+        # Payments that came from Stripe are already known there
+        if payment.stripe_payment_id:
+            return
+        # Settling the invoice marks it paid out of band on Stripe
+        self.sync_invoice(payment.invoice, key)
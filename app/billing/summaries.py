@@ -0,0 +1,174 @@
+"""
+Maintenance of the receivables aging and monthly revenue summary tables.
+
+Every refresh is scoped to the clients (and months) a change touched, so its
+cost depends on one client's invoices rather than on the size of the
+``Invoice`` and ``Payment`` tables. Callers run the refreshes inside the
+transaction that changed the invoices or payments.
+
+Each refresh first makes sure the summary rows exist and locks them, and only
+then aggregates. Concurrent refreshes of the same client therefore run one
+after the other, the later one seeing the earlier one's committed changes,
+instead of both writing totals computed from the same stale snapshot.
+"""
+from datetime import datetime
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from clients.summary import invalidate_client_summaries
+from .models import (
+    Invoice,
+    Payment,
+    ReceivableSummary,
+    RevenueSummary,
+    aging_bucket_case,
+)
+
+ZERO = Decimal('0.00')
+
+
+def month_start(day):
+    # Unsaved instances may still hold the timezone.now() default
+    if isinstance(day, datetime):
+        day = timezone.localdate(day) if timezone.is_aware(day) else day.date()
+    return day.replace(day=1)
+
+
+def lock_summaries(rows, queryset, key):
+    """Create the missing summary rows and lock all of them.
+
+    Rows another transaction created first are left alone, so the first
+    refresh of a client never fails on the unique constraint. Rows are
+    inserted in ``key`` order and locked in the queryset's (matching) order,
+    which keeps concurrent refreshes from deadlocking. Returns the locked rows
+    by ``key``.
+    """
+    queryset.model.objects.bulk_create(sorted(rows, key=key), ignore_conflicts=True)
+    return {key(summary): summary for summary in queryset.select_for_update()}
+
+
+def refresh_receivables(client_ids):
+    """Recompute the receivables summaries of the given clients."""
+    client_ids = set(client_ids)
+    if not client_ids:
+        return
+
+    with transaction.atomic():
+        summaries = lock_summaries(
+            [ReceivableSummary(client_id=client_id) for client_id in client_ids],
+            ReceivableSummary.objects.filter(client_id__in=client_ids).order_by('client_id'),
+            key=lambda summary: summary.client_id,
+        )
+
+        totals = {client_id: {} for client_id in client_ids}
+        rows = (
+            Invoice.objects.open()
+            .filter(client_id__in=client_ids)
+            .order_by()
+            .values('client_id', 'aging_bucket')
+            .annotate(amount=Sum('balance_due'), count=Count('id'))
+        )
+        for row in rows:
+            totals[row['client_id']][row['aging_bucket']] = (row['amount'], row['count'])
+
+        for client_id, buckets in totals.items():
+            summary = summaries[client_id]
+            for bucket, field in ReceivableSummary.BUCKET_FIELDS.items():
+                setattr(summary, field, buckets.get(bucket, (ZERO, 0))[0])
+            summary.total_due = sum((amount for amount, _ in buckets.values()), ZERO)
+            summary.open_invoices = sum(count for _, count in buckets.values())
+            summary.updated_at = timezone.now()
+
+        fields = list(ReceivableSummary.BUCKET_FIELDS.values()) + ['total_due', 'open_invoices', 'updated_at']
+        ReceivableSummary.objects.bulk_update(list(summaries.values()), fields)
+
+    # Balances changed by bulk updates never reach the invoice signals
+    invalidate_client_summaries(client_ids)
+
+
+def refresh_revenue(client_months):
+    """Recompute the revenue summaries for (client id, month start) pairs."""
+    client_months = {(client_id, month_start(month)) for client_id, month in client_months}
+    if not client_months:
+        return
+
+    client_ids = {client_id for client_id, _ in client_months}
+    first_month = min(month for _, month in client_months)
+
+    with transaction.atomic():
+        summaries = lock_summaries(
+            [RevenueSummary(client_id=client_id, month=month) for client_id, month in client_months],
+            RevenueSummary.objects.filter(
+                client_id__in=client_ids, month__in={month for _, month in client_months}
+            ).order_by('client_id', 'month'),
+            key=lambda summary: (summary.client_id, summary.month),
+        )
+
+        totals = {key: {'invoiced': ZERO, 'collected': ZERO} for key in client_months}
+        invoiced = (
+            Invoice.objects.filter(client_id__in=client_ids, issue_date__gte=first_month)
+            .exclude(status__in=('draft', 'canceled'))
+            .annotate(month=TruncMonth('issue_date'))
+            .order_by()
+            .values('client_id', 'month')
+            .annotate(amount=Sum('total'))
+        )
+        collected = (
+            Payment.objects.filter(invoice__client_id__in=client_ids, payment_date__gte=first_month)
+            .annotate(month=TruncMonth('payment_date'), client_id=F('invoice__client_id'))
+            .order_by()
+            .values('client_id', 'month')
+            .annotate(amount=Sum('amount'))
+        )
+        for field, rows in (('invoiced', invoiced), ('collected', collected)):
+            for row in rows:
+                key = (row['client_id'], row['month'])
+                if key in totals:
+                    totals[key][field] = row['amount']
+
+        to_update = []
+        for key, amounts in totals.items():
+            summary = summaries[key]
+            summary.invoiced = amounts['invoiced']
+            summary.collected = amounts['collected']
+            summary.updated_at = timezone.now()
+            to_update.append(summary)
+        RevenueSummary.objects.bulk_update(to_update, ['invoiced', 'collected', 'updated_at'])
+
+
+def refresh_for_payments(payments):
+    """Refresh summaries after payments were added in bulk."""
+    invoice_clients = dict(
+        Invoice.objects.filter(id__in={payment.invoice_id for payment in payments})
+        .values_list('id', 'client_id')
+    )
+    refresh_receivables(invoice_clients.values())
+    refresh_revenue(
+        (invoice_clients[payment.invoice_id], payment.payment_date)
+        for payment in payments
+        if payment.invoice_id in invoice_clients
+    )
+
+
+def age_receivables(today=None):
+    """Move open invoices to their current aging bucket.
+
+    Returns the number of invoices that changed bucket; only the clients
+    owning them have their summaries refreshed.
+    """
+    moved = (
+        Invoice.objects.open()
+        .annotate(new_bucket=aging_bucket_case(today))
+        .exclude(aging_bucket=F('new_bucket'))
+        .values_list('id', 'client_id')
+    )
+    moved = list(moved)
+    for start in range(0, len(moved), 1000):
+        ids = [pk for pk, _ in moved[start:start + 1000]]
+        Invoice.objects.filter(id__in=ids).update(aging_bucket=aging_bucket_case(today))
+    refresh_receivables(client_id for _, client_id in moved)
+    return len(moved)
@@ -0,0 +1,72 @@
+from datetime import date
+
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import DeviceUsageDay
+
+
+@shared_task
+def snapshot_device_usage(day=None):
+    """Task to record the active devices at the end of the day."""
+    day = date.fromisoformat(day) if day else None
+    rows = DeviceUsageDay.objects.snapshot(day)
+    return f"Recorded device usage for {rows} client/device type pairs"
+
+
+@shared_task
+def sync_stripe_outbox(max_batches=None):
+    """Task to send queued client, invoice and payment changes to Stripe."""
+    from .stripe_sync import StripeSyncWorker
+
+    if not settings.STRIPE_SECRET_KEY:
+        return "Stripe is not configured"
+    worker = StripeSyncWorker()
+    try:
+        counts = worker.run(max_batches=max_batches)
+    finally:
+        worker.close()
+    return f"Stripe sync: {counts['synced']} synced, {counts['retried']} retried, {counts['failed']} failed"
+
+
+# Cache key held while a processing run is queued, so a webhook burst
+# queues one task instead of one per event
+STRIPE_EVENTS_SCHEDULED_KEY = 'billing:stripe-events-scheduled'
+
+
+def schedule_stripe_event_processing(delay=1):
+    """Queue a processing run unless one is already waiting."""
+    if cache.add(STRIPE_EVENTS_SCHEDULED_KEY, 1, timeout=60):
+        process_stripe_events.apply_async(countdown=delay)
+
+
+@shared_task
+def process_stripe_events():
+    """Task to apply stored Stripe webhook events in batches."""
+    from .stripe_events import process_pending_events
+
+    # Events stored from now on need a new run
+    cache.delete(STRIPE_EVENTS_SCHEDULED_KEY)
+    handled = process_pending_events()
+    return f"Processed {handled} Stripe events"
+
+
+@shared_task
+def render_billing_documents(model_name, ids):
+    """Task to render invoice or quote PDFs in this worker process."""
+    from .models import Invoice, Quote
+    from .pdf import render_model
+
+    model = Invoice if model_name == 'invoice' else Quote
+    paths = render_model(model, ids, processes=1)
+    return f"Rendered {len(paths)} {model_name} PDFs"
+
+
+@shared_task
+def age_receivables():
+    """Task to move open invoices between aging buckets as they get older."""
+    from .summaries import age_receivables as move_invoices
+
+    moved = move_invoices()
+    return f"Moved {moved} invoices to a new aging bucket"
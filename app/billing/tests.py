@@ -0,0 +1,317 @@
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from clients.models import Client
+from monitoring.models import Device
+from .models import (
+    DeviceUsageDay,
+    Invoice,
+    InvoiceItem,
+    Payment,
+    ReceivableSummary,
+    RevenueSummary,
+    StripeEvent,
+    StripeSyncItem,
+)
+from .stripe_events import process_pending_events
+from .stripe_fake import FakeStripeServer
+from .stripe_sync import StripeSyncWorker
+from .summaries import month_start, refresh_receivables, refresh_revenue
+
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_fake')
+class StripeSyncWorkerTests(TestCase):
+    """Drive the sync worker against the local fake Stripe server."""
+
+    def start_server(self, rate_limit=None):
+        server = FakeStripeServer(rate_limit=rate_limit).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return server
+
+    def make_worker(self, server):
+        worker = StripeSyncWorker(batch_size=10, rate=1000, api_key='sk_test_fake', api_base=server.url)
+        self.addCleanup(worker.close)
+        return worker
+
+    def make_due(self):
+        StripeSyncItem.objects.filter(status='pending').update(next_attempt_at=timezone.now())
+
+    def test_syncs_client_and_invoice(self):
+        server = self.start_server()
+        client = Client.objects.create(name='Acme', slug='acme')
+        invoice = Invoice.objects.create(
+            client=client, title='March', status='sent', due_date=timezone.now().date() + timedelta(days=30),
+            subtotal=Decimal('0'), tax_percent=Decimal('10'),
+        )
+        InvoiceItem.objects.create(invoice=invoice, description='Support', quantity=Decimal('2'), unit_price=Decimal('50'))
+
+        counts = self.make_worker(server).run()
+
+        self.assertEqual(counts, {'synced': 2, 'retried': 0, 'failed': 0})
+        client.refresh_from_db()
+        invoice.refresh_from_db()
+        self.assertEqual(list(server.objects['customers']), [client.stripe_customer_id])
+        remote = server.objects['invoices'][invoice.stripe_invoice_id]
+        self.assertEqual(remote['status'], 'open')
+        amounts = sorted(int(item['amount']) for item in server.objects['invoiceitems'].values())
+        self.assertEqual(amounts, [1000, 10000])
+
+        invoice.status = 'paid'
+        invoice.save()
+        self.assertEqual(self.make_worker(server).run()['synced'], 1)
+        self.assertEqual(remote['status'], 'paid')
+
+    def test_rate_limited_items_are_retried_later(self):
+        server = self.start_server(rate_limit=2)
+        for index in range(5):
+            Client.objects.create(name=f'Client {index}', slug=f'client-{index}')
+
+        counts = self.make_worker(server).run()
+
+        self.assertEqual(counts, {'synced': 2, 'retried': 3, 'failed': 0})
+        retried = StripeSyncItem.objects.filter(status='pending')
+        self.assertEqual(retried.count(), 3)
+        for item in retried:
+            self.assertEqual(item.attempts, 1)
+            self.assertGreater(item.next_attempt_at, timezone.now())
+            self.assertIn('Too many requests', item.last_error)
+
+        # Not due yet
+        self.assertEqual(self.make_worker(server).run()['synced'], 0)
+
+        server.bucket = None
+        self.make_due()
+        self.assertEqual(self.make_worker(server).run(), {'synced': 3, 'retried': 0, 'failed': 0})
+        self.assertEqual(len(server.objects['customers']), 5)
+        self.assertFalse(Client.objects.filter(stripe_customer_id='').exists())
+
+    def test_retry_replays_requests_by_item_key(self):
+        server = self.start_server()
+        client = Client.objects.create(name='Acme', slug='acme')
+        self.make_worker(server).run()
+        item = StripeSyncItem.objects.get()
+        customer_id = Client.objects.values_list('stripe_customer_id', flat=True).get()
+
+        # As if the response had been lost and the item retried
+        Client.objects.filter(pk=client.pk).update(stripe_customer_id='')
+        StripeSyncItem.objects.filter(pk=item.pk).update(status='pending')
+        counts = self.make_worker(server).run()
+
+        self.assertEqual(counts['synced'], 1)
+        self.assertEqual(list(server.objects['customers']), [customer_id])
+        self.assertEqual(Client.objects.values_list('stripe_customer_id', flat=True).get(), customer_id)
+        self.assertEqual(len(server.requests), 1)
+
+    def test_item_keys_are_not_shared_between_items(self):
+        server = self.start_server()
+        client = Client.objects.create(name='Acme', slug='acme')
+        self.make_worker(server).run()
+
+        client.refresh_from_db()
+        client.name = 'Acme Corp'
+        client.save()
+        self.assertEqual(self.make_worker(server).run()['synced'], 1)
+
+        keys = {str(key) for key in StripeSyncItem.objects.values_list('idempotency_key', flat=True)}
+        self.assertEqual(len(keys), 2)
+        self.assertEqual(len(server.idempotent_responses), 2)
+        self.assertTrue(all(key.rsplit('-', 1)[0] in keys for key in server.idempotent_responses))
+        self.assertEqual(server.objects['customers'][client.stripe_customer_id]['name'], 'Acme Corp')
+
+    def test_reused_key_with_other_parameters_fails_permanently(self):
+        server = self.start_server()
+        client = Client.objects.create(name='Acme', slug='acme')
+        self.make_worker(server).run()
+        item = StripeSyncItem.objects.get()
+
+        # Retrying the same item with different parameters
+        Client.objects.filter(pk=client.pk).update(stripe_customer_id='', name='Other')
+        StripeSyncItem.objects.filter(pk=item.pk).update(status='pending')
+        counts = self.make_worker(server).run()
+
+        self.assertEqual(counts, {'synced': 0, 'retried': 0, 'failed': 1})
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'failed')
+        self.assertIn('same parameters', item.last_error)
+        self.assertEqual(len(server.objects['customers']), 1)
+        # The claim is released for later items
+        self.assertEqual(Client.objects.values_list('stripe_customer_id', flat=True).get(), '')
+
+    def test_items_wait_for_a_creation_claimed_by_another_item(self):
+        server = self.start_server()
+        client = Client.objects.create(name='Acme', slug='acme')
+        Client.objects.filter(pk=client.pk).update(stripe_customer_id='pending:other-item')
+
+        counts = self.make_worker(server).run()
+
+        self.assertEqual(counts, {'synced': 0, 'retried': 1, 'failed': 0})
+        self.assertEqual(server.requests, [])
+        self.assertIn('being created', StripeSyncItem.objects.get().last_error)
+
+        # The other item stored its customer meanwhile
+        server.objects['customers']['cus_other'] = {'id': 'cus_other', 'object': 'customer'}
+        Client.objects.filter(pk=client.pk).update(stripe_customer_id='cus_other')
+        self.make_due()
+        self.assertEqual(self.make_worker(server).run()['synced'], 1)
+        self.assertEqual(list(server.objects['customers']), ['cus_other'])
+        self.assertEqual(server.objects['customers']['cus_other']['name'], 'Acme')
+
+    def test_unexpected_errors_fail_only_their_item(self):
+        server = self.start_server()
+        Client.objects.create(name='Acme', slug='acme')
+        broken = Client.objects.create(name='Broken', slug='broken')
+        sync_client = StripeSyncWorker.sync_client
+
+        def fake_sync_client(worker, client, key):
+            if client.pk == broken.pk:
+                raise ValueError('bad address')
+            return sync_client(worker, client, key)
+
+        with mock.patch.object(StripeSyncWorker, 'sync_client', fake_sync_client):
+            counts = self.make_worker(server).run()
+
+        self.assertEqual(counts, {'synced': 1, 'retried': 0, 'failed': 1})
+        failed = StripeSyncItem.objects.get(status='failed')
+        self.assertEqual((failed.object_id, failed.last_error), (broken.pk, 'bad address'))
+
+    def test_changes_after_an_attempt_get_a_new_item(self):
+        client = Client.objects.create(name='Acme', slug='acme')
+        first = StripeSyncItem.objects.get()
+        client.save()
+        self.assertEqual(StripeSyncItem.objects.count(), 1)
+
+        StripeSyncItem.objects.filter(pk=first.pk).update(attempts=1)
+        client.save()
+        second = StripeSyncItem.objects.exclude(pk=first.pk).get()
+        self.assertNotEqual(second.idempotency_key, first.idempotency_key)
+
+
+class StripeEventTests(TestCase):
+
+    def make_event(self, event_id, invoice, amount):
+        return StripeEvent.objects.create(
+            event_id=event_id, type='invoice.paid',
+            payload={'data': {'object': {'id': f'in_{event_id}', 'amount_paid': amount, 'metadata': {'invoice_id': invoice.pk}}}},
+        )
+
+    def test_event_that_raises_fails_alone(self):
+        client = Client.objects.create(name='Acme', slug='acme')
+        invoice = Invoice.objects.create(
+            client=client, title='March', status='sent', due_date=timezone.now().date(),
+            subtotal=Decimal('100'), tax_percent=Decimal('0'),
+        )
+        good = self.make_event('evt_good', invoice, 10000)
+        bad = self.make_event('evt_bad', invoice, 'not a number')
+
+        self.assertEqual(process_pending_events(), 2)
+
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual(good.status, 'processed')
+        self.assertEqual(bad.status, 'failed')
+        self.assertTrue(bad.error)
+        self.assertIsNotNone(bad.processed_at)
+        self.assertEqual(Payment.objects.get().stripe_payment_id, 'in_evt_good')
+
+    @override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+    def test_webhook_rejects_undecodable_body(self):
+        response = self.client.post(
+            reverse('billing:stripe_webhook'), data=b'\xff\xfe', content_type='application/json',
+            HTTP_HOST='localhost',
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class SummaryTests(TestCase):
+
+    def setUp(self):
+        self.client_obj = Client.objects.create(name='Acme', slug='acme')
+        self.invoice = Invoice.objects.create(
+            client=self.client_obj, title='March', status='sent', due_date=timezone.now().date(),
+            subtotal=Decimal('100'), tax_percent=Decimal('0'),
+        )
+        self.month = month_start(self.invoice.issue_date)
+
+    def test_first_refresh_creates_the_summaries(self):
+        ReceivableSummary.objects.all().delete()
+        RevenueSummary.objects.all().delete()
+
+        refresh_receivables([self.client_obj.pk])
+        refresh_revenue([(self.client_obj.pk, self.month)])
+
+        receivables = ReceivableSummary.objects.get()
+        self.assertEqual((receivables.total_due, receivables.open_invoices), (Decimal('100.00'), 1))
+        self.assertEqual(RevenueSummary.objects.get(month=self.month).invoiced, Decimal('100.00'))
+
+    def test_rows_created_by_another_refresh_are_reused(self):
+        # As if a concurrent refresh had inserted the rows first
+        ReceivableSummary.objects.all().delete()
+        RevenueSummary.objects.all().delete()
+        ReceivableSummary.objects.create(client=self.client_obj, total_due=Decimal('5'), open_invoices=7)
+        RevenueSummary.objects.create(client=self.client_obj, month=self.month, invoiced=Decimal('5'))
+
+        refresh_receivables([self.client_obj.pk])
+        refresh_revenue([(self.client_obj.pk, self.month)])
+
+        receivables = ReceivableSummary.objects.get()
+        self.assertEqual((receivables.total_due, receivables.open_invoices), (Decimal('100.00'), 1))
+        self.assertEqual(RevenueSummary.objects.get().invoiced, Decimal('100.00'))
+
+
+class DeviceUsageDayTests(TestCase):
+
+    def set_status(self, device, status):
+        device = Device.objects.get(pk=device.pk)
+        device.status = status
+        device.save()
+
+    def deactivate(self, device):
+        self.set_status(device, 'inactive')
+
+    def test_departures_are_counted_once(self):
+        client = Client.objects.create(name='Acme', slug='acme')
+        devices = [
+            Device.objects.create(
+                client=client, name=f'Device {index}', ip_address=f'10.0.0.{index}', status='active',
+                custom_price=Decimal('3'),
+            )
+            for index in range(3)
+        ]
+
+        self.deactivate(devices[0])
+        DeviceUsageDay.objects.snapshot()
+        # Leaves between the snapshot and midnight
+        self.deactivate(devices[1])
+
+        usage = DeviceUsageDay.objects.get()
+        self.assertEqual((usage.closing_devices, usage.departed_devices), (1, 2))
+        self.assertEqual(usage.closing_amount + usage.departed_amount, Decimal('9.00'))
+
+        DeviceUsageDay.objects.snapshot()
+        usage.refresh_from_db()
+        self.assertEqual(usage.device_days, 3)
+
+    def test_devices_leaving_twice_a_day_are_counted_once(self):
+        client = Client.objects.create(name='Acme', slug='acme')
+        device = Device.objects.create(
+            client=client, name='Router', ip_address='10.0.0.1', status='active', custom_price=Decimal('3'),
+        )
+
+        self.deactivate(device)
+        self.set_status(device, 'active')
+        self.deactivate(device)
+        usage = DeviceUsageDay.objects.get()
+        self.assertEqual((usage.departed_devices, usage.departed_amount), (1, Decimal('3.00')))
+
+        # Back again by the end of the day
+        self.set_status(device, 'active')
+        DeviceUsageDay.objects.snapshot()
+        usage.refresh_from_db()
+        self.assertEqual(usage.device_days, 1)
+        self.assertEqual(usage.closing_amount + usage.departed_amount, Decimal('3.00'))
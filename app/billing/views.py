@@ -0,0 +1,40 @@
+import json
+
+import stripe
+from django.conf import settings
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotFound
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from .models import StripeEvent
+from .tasks import schedule_stripe_event_processing
+
+# Reject signatures older than this many seconds (replay protection)
+WEBHOOK_TOLERANCE = 300
+
+
+@csrf_exempt
+@require_POST
+def stripe_webhook(request):
+    """Verify and store a Stripe event, leaving the processing to a worker."""
+    secret = settings.STRIPE_WEBHOOK_SECRET
+    if not secret:
+        return HttpResponseNotFound()
+
+    try:
+        payload = request.body.decode('utf-8')
+        stripe.WebhookSignature.verify_header(
+            payload, request.headers.get('Stripe-Signature', ''), secret, tolerance=WEBHOOK_TOLERANCE
+        )
+        event = json.loads(payload)
+        event_id, event_type = event['id'], event['type']
+    except (stripe.error.SignatureVerificationError, ValueError, KeyError, TypeError):
+        return HttpResponseBadRequest()
+
+    # Stripe redelivers events, the unique event id drops repeats
+    StripeEvent.objects.bulk_create(
+        [StripeEvent(event_id=event_id, type=event_type, payload=event)], ignore_conflicts=True
+    )
+    transaction.on_commit(schedule_stripe_event_processing)
+    return HttpResponse(status=200)
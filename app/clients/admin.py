@@ -1,5 +1,20 @@
-from django.contrib import admin
+import io
+
+from django import forms
+from django.contrib import admin, messages
+from django.core.exceptions import PermissionDenied
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from core.search import IndexedSearchAdminMixin
+from .importer import IMPORTERS, read_csv
 from .models import Client, Contact, ServiceAgreement
+from .summary import get_client_summary, with_summary_counts
+
+
+class BulkImportForm(forms.Form):
+    kind = forms.ChoiceField(choices=[(kind, kind.title()) for kind in IMPORTERS])
+    file = forms.FileField(help_text="CSV with a header row; contacts and devices name their client in a 'client' column")
 
 
 class ContactInline(admin.TabularInline):
@@ -14,8 +29,8 @@ class ServiceAgreementInline(admin.TabularInline):
 
 
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin):
-    list_display = ('name', 'city', 'state', 'phone', 'is_active', 'created_at')
+class ClientAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'city', 'state', 'phone', 'is_active', 'device_count', 'open_alert_count', 'balance_due', 'created_at')
     list_filter = ('is_active', 'state', 'industry')
     search_fields = ('name', 'address', 'city', 'notes')
     prepopulated_fields = {'slug': ('name',)}
@@ -32,9 +47,74 @@ class ClientAdmin(admin.ModelAdmin):
         }),
     )
 
+    change_list_template = 'admin/clients/client/change_list.html'
+    change_form_template = 'admin/clients/client/change_form.html'
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        # Only the list shows the counts; the change, delete and autocomplete
+        # views would run the subqueries for nothing
+        match = request.resolver_match
+        if match is not None and match.url_name == f'{self.opts.app_label}_{self.opts.model_name}_changelist':
+            queryset = with_summary_counts(queryset)
+        return queryset
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = extra_context or {}
+        if object_id.isdigit():
+            extra_context['client_summary'] = get_client_summary(int(object_id))
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def get_urls(self):
+        urls = [
+            path('import/', self.admin_site.admin_view(self.import_csv), name='clients_client_import'),
+        ]
+        return urls + super().get_urls()
+
+    def import_csv(self, request):
+        """Bulk import clients, contacts or devices from an uploaded CSV."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+
+        form = BulkImportForm(request.POST or None, request.FILES or None)
+        importer = summary = None
+        if request.method == 'POST' and form.is_valid():
+            importer = IMPORTERS[form.cleaned_data['kind']]()
+            stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', errors='replace', newline='')
+            summary = importer.run(read_csv(stream))
+            self.message_user(
+                request,
+                f"Created {summary['created']} {form.cleaned_data['kind']}, "
+                f"skipped {summary['duplicates']} already on file, {summary['errors']} rows with errors",
+                messages.WARNING if summary['errors'] else messages.SUCCESS,
+            )
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import from CSV',
+            'form': form,
+            'summary': summary,
+            # The first errors are enough to fix a file; the command writes full reports
+            'errors': importer.errors[:100] if importer else [],
+        }
+        return TemplateResponse(request, 'admin/clients/client/import_csv.html', context)
+
+    @admin.display(description='Devices', ordering='device_count')
+    def device_count(self, obj):
+        return obj.device_count
+
+    @admin.display(description='Open alerts', ordering='open_alert_count')
+    def open_alert_count(self, obj):
+        return obj.open_alert_count
+
+    @admin.display(description='Balance due', ordering='balance_due')
+    def balance_due(self, obj):
+        return obj.balance_due
+
 
 @admin.register(Contact)
-class ContactAdmin(admin.ModelAdmin):
+class ContactAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'client', 'email', 'phone', 'is_primary')
     list_filter = ('is_primary', 'client')
     search_fields = ('first_name', 'last_name', 'email', 'job_title')
@@ -58,6 +138,9 @@ class ServiceAgreementAdmin(admin.ModelAdmin):
         ('Billing Information', {
             'fields': ('billing_frequency', 'billing_day', 'per_device_pricing', 'stripe_subscription_id')
         }),
+        ('Service Level', {
+            'fields': ('sla_uptime_target', 'sla_credit_percent')
+        }),
         ('Additional Information', {
             'fields': ('notes',)
         }),
@@ -0,0 +1,22 @@
+from django.apps import AppConfig
+
+
+class ClientsConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'clients'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from core import audit, search
+        from .models import Client, Contact, ServiceAgreement
+
+        search.register(Client, 'name', ['name', 'slug', 'city', 'state', 'industry', 'phone', 'website', 'notes'])
+        search.register(
+            Contact, lambda contact: f"{contact.first_name} {contact.last_name}",
+            ['first_name', 'last_name', 'email', 'phone', 'job_title', 'client.name'],
+            select_related=['client'],
+        )
+        audit.register(Client, 'name')
+        audit.register(Contact, lambda contact: f"{contact.first_name} {contact.last_name}")
+        audit.register(ServiceAgreement, 'name')
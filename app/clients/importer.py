@@ -0,0 +1,298 @@
+"""
+Streaming bulk import of clients, contacts and devices from CSV.
+
+Rows are read lazily and handled in chunks. Each chunk resolves the clients
+and device types it refers to with one query, validates its rows without
+touching the database, and inserts the valid ones with a single
+``bulk_create``. Client slugs are made unique against a set of existing
+slugs loaded once up front. Rows that fail are collected with their line
+number and error instead of aborting the import.
+"""
+import csv
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
+from django.db import IntegrityError, models, transaction
+from django.db.models import Q
+
+from billing.models import StripeSyncItem
+from core import audit, search
+from monitoring.models import Device, DeviceType
+from .models import Client, Contact, unique_slug
+from .summary import invalidate_client_summaries
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n'}
+
+# Marks a client reference matching several clients by name
+AMBIGUOUS = object()
+
+
+def read_csv(stream):
+    """Yield rows from a CSV file with stripped header names."""
+    reader = csv.DictReader(stream)
+    if reader.fieldnames:
+        reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+    yield from reader
+
+
+def error_text(exc):
+    """Flatten a ValidationError into one line for the error report."""
+    if not hasattr(exc, 'error_dict'):
+        return '; '.join(exc.messages)
+    return '; '.join(
+        ' '.join(messages) if field == NON_FIELD_ERRORS else f"{field}: {' '.join(messages)}"
+        for field, messages in exc.message_dict.items()
+    )
+
+
+class BulkImporter:
+    """Base for chunked CSV importers; subclasses build one object per row."""
+    model = None
+    # CSV columns copied onto model fields of the same name
+    fields = ()
+    # Fields validated by the importer itself rather than clean_fields()
+    exclude_from_validation = ()
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.created = 0
+        self.duplicates = 0
+        self.errors = []
+
+    def instance_from_row(self, row, **values):
+        """Return an unsaved, field-validated instance from a row's columns."""
+        errors = {}
+        for name in self.fields:
+            raw = (row.get(name) or '').strip()
+            if raw == '':
+                continue  # Use the field's default
+            field = self.model._meta.get_field(name)
+            try:
+                if isinstance(field, models.BooleanField):
+                    if raw.lower() not in TRUE_VALUES | FALSE_VALUES:
+                        raise ValidationError(f"'{raw}' is not a yes/no value.")
+                    values[name] = raw.lower() in TRUE_VALUES
+                else:
+                    values[name] = field.to_python(raw)
+            except ValidationError as exc:
+                errors[name] = exc.messages
+        if errors:
+            raise ValidationError(errors)
+
+        obj = self.model(**values)
+        obj.clean_fields(exclude=self.exclude_from_validation)
+        return obj
+
+    def prepare_chunk(self, rows):
+        """Load whatever a chunk of rows refers to, in as few queries as possible."""
+
+    def build(self, row):
+        """Return an unsaved object for a row, or None if it already exists.
+
+        Raises ValidationError for rows that cannot be imported.
+        """
+        raise NotImplementedError
+
+    def after_create(self, objects):
+        """Update what signals would have for objects created in bulk."""
+        search.index_objects(self.model, [obj.pk for obj in objects])
+        audit.record_batch('create', self.model, len(objects), {'source': 'csv import'})
+
+    def save_chunk(self, pending):
+        """Insert a chunk of (line, row, object) and return the saved objects."""
+        objects = [obj for _, _, obj in pending]
+        try:
+            with transaction.atomic():
+                self.model.objects.bulk_create(objects)
+        except IntegrityError:
+            # Conflicts with rows written since the chunk was prepared;
+            # retry one by one to find the failing rows
+            objects = []
+            for line, row, obj in pending:
+                try:
+                    with transaction.atomic():
+                        self.model.objects.bulk_create([obj])
+                except IntegrityError as exc:
+                    self.errors.append(dict(row, line=line, error=str(exc)))
+                else:
+                    objects.append(obj)
+        return objects
+
+    def run(self, rows):
+        """Import an iterable of CSV rows and return a summary."""
+        rows = enumerate(rows, start=2)  # Line 1 is the header
+        while chunk := list(islice(rows, self.batch_size)):
+            self.prepare_chunk([row for _, row in chunk])
+            pending = []
+            for line, row in chunk:
+                try:
+                    obj = self.build(row)
+                except ValidationError as exc:
+                    self.errors.append(dict(row, line=line, error=error_text(exc)))
+                    continue
+                if obj is None:
+                    self.duplicates += 1
+                    continue
+                pending.append((line, row, obj))
+
+            if pending:
+                objects = self.save_chunk(pending)
+                self.created += len(objects)
+                if objects:
+                    self.after_create(objects)
+
+        return {
+            'created': self.created,
+            'duplicates': self.duplicates,
+            'errors': len(self.errors),
+        }
+
+    def write_error_report(self, stream):
+        """Write the rows that failed as CSV, with their line and error first."""
+        fieldnames = ['line', 'error']
+        for row in self.errors:
+            fieldnames.extend(key for key in row if key not in fieldnames)
+        writer = csv.DictWriter(stream, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(self.errors)
+
+
+class ClientImporter(BulkImporter):
+    """Import clients; columns ``name`` and optionally ``slug`` and contact details."""
+    model = Client
+    fields = ('name', 'slug', 'address', 'city', 'state', 'zip_code', 'phone', 'website', 'industry', 'notes', 'is_active')
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.taken_slugs = None
+
+    def prepare_chunk(self, rows):
+        if self.taken_slugs is None:
+            self.taken_slugs = set(Client.objects.values_list('slug', flat=True).iterator(chunk_size=5000))
+
+    def build(self, row):
+        client = self.instance_from_row(row)
+        if client.slug:
+            # An explicit slug identifies the client, so re-imports skip it
+            if client.slug in self.taken_slugs:
+                return None
+        else:
+            client.slug = unique_slug(client.name, self.taken_slugs)
+        self.taken_slugs.add(client.slug)
+        return client
+
+    def after_create(self, objects):
+        super().after_create(objects)
+        if settings.STRIPE_SECRET_KEY:
+            StripeSyncItem.objects.enqueue_many('client', [client.pk for client in objects])
+
+
+class ClientRowImporter(BulkImporter):
+    """Base for rows belonging to a client named by slug or name in a ``client`` column."""
+    # Foreign keys are resolved in bulk; validating them would query per row
+    exclude_from_validation = ('client',)
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.clients = {}
+
+    def resolve_clients(self, rows):
+        """Look up the clients referenced by a chunk that are not known yet."""
+        keys = {(row.get('client') or '').strip() for row in rows} - set(self.clients) - {''}
+        if not keys:
+            return
+        by_slug, by_name = {}, {}
+        for client_id, slug, name in Client.objects.filter(Q(slug__in=keys) | Q(name__in=keys)).values_list('id', 'slug', 'name'):
+            by_slug[slug] = client_id
+            by_name[name] = AMBIGUOUS if name in by_name else client_id
+        for key in keys:
+            self.clients[key] = by_slug.get(key) or by_name.get(key)
+
+    def client_id(self, row):
+        key = (row.get('client') or '').strip()
+        if not key:
+            raise ValidationError({'client': ['This field cannot be blank.']})
+        client_id = self.clients.get(key)
+        if client_id is None:
+            raise ValidationError({'client': [f"No client with slug or name '{key}'."]})
+        if client_id is AMBIGUOUS:
+            raise ValidationError({'client': [f"Several clients are named '{key}', use the slug."]})
+        return client_id
+
+    def after_create(self, objects):
+        super().after_create(objects)
+        invalidate_client_summaries({obj.client_id for obj in objects})
+
+
+class ContactImporter(ClientRowImporter):
+    """Import contacts; contacts already on file with the same email are skipped."""
+    model = Contact
+    fields = ('first_name', 'last_name', 'email', 'phone', 'job_title', 'is_primary', 'notes')
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.known = set()
+
+    def prepare_chunk(self, rows):
+        self.resolve_clients(rows)
+        client_ids = {client_id for client_id in self.clients.values() if isinstance(client_id, int)}
+        existing = Contact.objects.filter(client_id__in=client_ids).values_list('client_id', 'email')
+        self.known.update((client_id, email.lower()) for client_id, email in existing)
+
+    def build(self, row):
+        contact = self.instance_from_row(row, client_id=self.client_id(row))
+        key = (contact.client_id, contact.email.lower())
+        if key in self.known:
+            return None
+        self.known.add(key)
+        return contact
+
+
+class DeviceImporter(ClientRowImporter):
+    """Import devices; ``device_type`` is a device type name.
+
+    Devices already on file with the same client, name and IP address are
+    skipped.
+    """
+    model = Device
+    fields = (
+        'name', 'ip_address', 'mac_address', 'hostname', 'status', 'custom_price',
+        'monitoring_enabled', 'ping_check_enabled', 'snmp_check_enabled', 'snmp_community', 'snmp_port', 'notes',
+    )
+    exclude_from_validation = ('client', 'device_type')
+
+    def __init__(self, batch_size=1000):
+        super().__init__(batch_size)
+        self.device_types = None
+        self.known = set()
+
+    def prepare_chunk(self, rows):
+        if self.device_types is None:
+            self.device_types = {name.lower(): pk for pk, name in DeviceType.objects.values_list('id', 'name')}
+        self.resolve_clients(rows)
+        client_ids = {client_id for client_id in self.clients.values() if isinstance(client_id, int)}
+        self.known.update(Device.objects.filter(client_id__in=client_ids).values_list('client_id', 'name', 'ip_address'))
+
+    def build(self, row):
+        values = {'client_id': self.client_id(row)}
+        type_name = (row.get('device_type') or '').strip()
+        if type_name:
+            if type_name.lower() not in self.device_types:
+                raise ValidationError({'device_type': [f"No device type named '{type_name}'."]})
+            values['device_type_id'] = self.device_types[type_name.lower()]
+
+        device = self.instance_from_row(row, **values)
+        key = (device.client_id, device.name, device.ip_address)
+        if key in self.known:
+            return None
+        self.known.add(key)
+        return device
+
+
+IMPORTERS = {
+    'clients': ClientImporter,
+    'contacts': ContactImporter,
+    'devices': DeviceImporter,
+}
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from clients.importer import IMPORTERS, read_csv
+
+
+class Command(BaseCommand):
+    help = "Import clients, contacts or devices from a CSV file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(IMPORTERS), help="What the file contains")
+        parser.add_argument('path', help="CSV file with a header row")
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--error-report', help="Write rows that could not be imported to this CSV file")
+
+    def handle(self, *args, **options):
+        importer = IMPORTERS[options['kind']](batch_size=options['batch_size'])
+        with open(options['path'], newline='', encoding='utf-8-sig', errors='replace') as stream:
+            summary = importer.run(read_csv(stream))
+
+        if options['error_report'] and importer.errors:
+            with open(options['error_report'], 'w', newline='') as report:
+                importer.write_error_report(report)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {summary['created']} {options['kind']}, "
+            f"skipped {summary['duplicates']} already on file, "
+            f"{summary['errors']} rows with errors"
+        ))
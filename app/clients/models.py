@@ -2,6 +2,22 @@ from django.db import models
 from django.utils.text import slugify
 
 
+def slug_base(value, max_length=200):
+    """Slugify ``value``, falling back to 'client' for names without slug characters."""
+    return slugify(value)[:max_length] or 'client'
+
+
+def unique_slug(value, taken, max_length=200):
+    """Slugify ``value``, adding a numeric suffix until it is not in ``taken``."""
+    base = slug_base(value, max_length)
+    slug, number = base, 2
+    while slug in taken:
+        suffix = f'-{number}'
+        slug = base[:max_length - len(suffix)] + suffix
+        number += 1
+    return slug
+
+
 class Client(models.Model):
     """Model representing a client organization."""
     name = models.CharField(max_length=200)
@@ -29,7 +45,8 @@ class Client(models.Model):
     
     def save(self, *args, **kwargs):
         if not self.slug:
-            self.slug = slugify(self.name)
+            taken = Client.objects.filter(slug__startswith=slug_base(self.name)).exclude(pk=self.pk)
+            self.slug = unique_slug(self.name, set(taken.values_list('slug', flat=True)))
         super().save(*args, **kwargs)
 
 
@@ -78,6 +95,16 @@ class ServiceAgreement(models.Model):
     # For device-based billing
     per_device_pricing = models.BooleanField(default=True)
     
+    # Service level; devices below the target earn a credit on the invoice
+    sla_uptime_target = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True, blank=True,
+        help_text="Guaranteed uptime percentage per device over a billing period"
+    )
+    sla_credit_percent = models.DecimalField(
+        max_digits=5, decimal_places=2, default=0,
+        help_text="Percentage of a device's price credited when it misses the uptime target"
+    )
+    
     # For Stripe recurring billing
     stripe_subscription_id = models.CharField(max_length=100, blank=True)
     
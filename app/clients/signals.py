@@ -0,0 +1,45 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from billing.models import Invoice, Payment
+from monitoring.models import Alert, Device
+from .models import Client, Contact, ServiceAgreement
+from .summary import invalidate_client_summaries
+
+
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+def invalidate_client(sender, instance, **kwargs):
+    invalidate_client_summaries([instance.id])
+
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+@receiver(post_save, sender=ServiceAgreement)
+@receiver(post_delete, sender=ServiceAgreement)
+@receiver(post_save, sender=Device)
+@receiver(post_delete, sender=Device)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+def invalidate_related_client(sender, instance, **kwargs):
+    """Drop the summary of the client a related object belongs to."""
+    # Objects moved to another client change both summaries
+    previous = getattr(instance, '_loaded_client_id', None)
+    invalidate_client_summaries([instance.client_id, previous])
+
+
+@receiver(post_save, sender=Alert)
+@receiver(post_delete, sender=Alert)
+def invalidate_alert_client(sender, instance, **kwargs):
+    if Alert.device.is_cached(instance):
+        client_id = instance.device.client_id
+    else:
+        client_id = Device.objects.filter(id=instance.device_id).values_list('client_id', flat=True).first()
+    invalidate_client_summaries([client_id])
+
+
+@receiver(post_delete, sender=Payment)
+def invalidate_payment_client(sender, instance, **kwargs):
+    # Saved payments re-save their invoice, which invalidates the client
+    client_id = Invoice.objects.filter(id=instance.invoice_id).values_list('client_id', flat=True).first()
+    invalidate_client_summaries([client_id])
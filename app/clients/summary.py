@@ -0,0 +1,174 @@
+"""
+Client overview: related counts, open items and balance in one place.
+
+Counts and the outstanding balance are correlated subqueries, so they can
+be annotated on any client queryset (a 500-row list included) without a
+query per client or join fan-out between the related tables. Full
+summaries add prefetched contacts, agreements, open alerts and outstanding
+invoices and are cached per client; signals on the related models delete
+the cached entry when anything in it changes.
+"""
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, DecimalField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from billing.models import Invoice
+from monitoring.models import Alert, Device
+from .models import Client, Contact, ServiceAgreement
+
+CACHE_KEY = 'clients:summary:{}'
+CACHE_TIMEOUT = 60 * 60
+
+OPEN_ALERT_STATUSES = ('new', 'acknowledged')
+
+
+def subquery_count(queryset, client_field='client'):
+    """Count rows of ``queryset`` belonging to the outer client."""
+    counts = (
+        queryset.filter(**{client_field: OuterRef('pk')})
+        .order_by()
+        .values(client_field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def subquery_sum(queryset, field, client_field='client'):
+    """Sum ``field`` over rows of ``queryset`` belonging to the outer client."""
+    totals = (
+        queryset.filter(**{client_field: OuterRef('pk')})
+        .order_by()
+        .values(client_field)
+        .annotate(total=Sum(field))
+        .values('total')
+    )
+    return Coalesce(
+        Subquery(totals, output_field=DecimalField(max_digits=12, decimal_places=2)),
+        Value(Decimal('0.00')),
+        output_field=DecimalField(max_digits=12, decimal_places=2),
+    )
+
+
+def with_summary_counts(queryset=None):
+    """Annotate clients with the counts and balance shown in their summary."""
+    if queryset is None:
+        queryset = Client.objects.all()
+    return queryset.annotate(
+        contact_count=subquery_count(Contact.objects.all()),
+        agreement_count=subquery_count(ServiceAgreement.objects.filter(is_active=True)),
+        device_count=subquery_count(Device.objects.filter(status='active')),
+        open_alert_count=subquery_count(
+            Alert.objects.filter(status__in=OPEN_ALERT_STATUSES), 'device__client'
+        ),
+        open_invoice_count=subquery_count(Invoice.objects.open()),
+        balance_due=subquery_sum(Invoice.objects.open(), 'balance_due'),
+    )
+
+
+def build_summaries(client_ids):
+    """Build summaries for the given clients in a fixed number of queries."""
+    clients = with_summary_counts(Client.objects.filter(id__in=client_ids)).prefetch_related(
+        'contacts',
+        Prefetch(
+            'service_agreements',
+            queryset=ServiceAgreement.objects.filter(is_active=True),
+            to_attr='active_agreements',
+        ),
+        Prefetch(
+            'invoices',
+            queryset=Invoice.objects.open().order_by('due_date'),
+            to_attr='open_invoices',
+        ),
+    )
+    clients = list(clients)
+
+    # Alerts hang off devices, so they are fetched for all clients at once
+    alerts = {}
+    open_alerts = (
+        Alert.objects.filter(device__client__in=clients, status__in=OPEN_ALERT_STATUSES)
+        .values('id', 'device__client_id', 'device__name', 'title', 'severity', 'status', 'created_at')
+    )
+    for alert in open_alerts:
+        alerts.setdefault(alert.pop('device__client_id'), []).append(alert)
+
+    summaries = {}
+    for client in clients:
+        summaries[client.id] = {
+            'id': client.id,
+            'name': client.name,
+            'slug': client.slug,
+            'is_active': client.is_active,
+            'contact_count': client.contact_count,
+            'agreement_count': client.agreement_count,
+            'device_count': client.device_count,
+            'open_alert_count': client.open_alert_count,
+            'open_invoice_count': client.open_invoice_count,
+            'balance_due': client.balance_due,
+            'contacts': [
+                {
+                    'name': f"{contact.first_name} {contact.last_name}",
+                    'email': contact.email,
+                    'phone': contact.phone,
+                    'job_title': contact.job_title,
+                    'is_primary': contact.is_primary,
+                }
+                for contact in client.contacts.all()
+            ],
+            'agreements': [
+                {
+                    'id': agreement.id,
+                    'name': agreement.name,
+                    'billing_frequency': agreement.billing_frequency,
+                    'start_date': agreement.start_date,
+                    'end_date': agreement.end_date,
+                }
+                for agreement in client.active_agreements
+            ],
+            'open_alerts': alerts.get(client.id, []),
+            'open_invoices': [
+                {
+                    'id': invoice.id,
+                    'invoice_number': invoice.invoice_number,
+                    'status': invoice.status,
+                    'due_date': invoice.due_date,
+                    'balance_due': invoice.balance_due,
+                }
+                for invoice in client.open_invoices
+            ],
+        }
+    return summaries
+
+
+def get_client_summaries(client_ids):
+    """Return cached summaries, building the missing ones in one batch."""
+    client_ids = list(client_ids)
+    keys = {CACHE_KEY.format(client_id): client_id for client_id in client_ids}
+    cached = cache.get_many(keys)
+    summaries = {keys[key]: summary for key, summary in cached.items()}
+
+    missing = [client_id for client_id in client_ids if client_id not in summaries]
+    if missing:
+        built = build_summaries(missing)
+        cache.set_many({CACHE_KEY.format(client_id): summary for client_id, summary in built.items()}, CACHE_TIMEOUT)
+        summaries.update(built)
+    return summaries
+
+
+def get_client_summary(client_id):
+    """Return the summary of one client, or None if it does not exist."""
+    return get_client_summaries([client_id]).get(client_id)
+
+
+def invalidate_client_summaries(client_ids):
+    """Drop cached summaries so the next read rebuilds them.
+
+    Deferred until the current transaction commits; dropped earlier, a
+    concurrent read could cache the pre-commit values again.
+    """
+    keys = [CACHE_KEY.format(client_id) for client_id in set(client_ids) if client_id is not None]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,44 @@
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import User
+from django.test import RequestFactory, TestCase
+from django.urls import resolve, reverse
+
+from monitoring.models import Alert, Device
+from .models import Client
+
+
+class ClientAdminTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.acme = Client.objects.create(name='Acme', slug='acme')
+        device = Device.objects.create(client=self.acme, name='router', ip_address='10.0.0.1', status='active')
+        Alert.objects.create(device=device, title='Router down', message='Down', severity='critical')
+
+    def queryset_for(self, url):
+        request = RequestFactory().get(url)
+        request.user = self.user
+        request.resolver_match = resolve(url)
+        return site._registry[Client].get_queryset(request)
+
+    def test_counts_are_annotated_on_the_changelist_only(self):
+        changelist = reverse('admin:clients_client_changelist')
+        self.assertIn('device_count', self.queryset_for(changelist).query.annotations)
+        for url in (
+            reverse('admin:clients_client_change', args=[self.acme.pk]),
+            reverse('admin:clients_client_delete', args=[self.acme.pk]),
+            reverse('admin:autocomplete'),
+        ):
+            self.assertEqual(self.queryset_for(url).query.annotations, {})
+
+        response = self.client.get(changelist, HTTP_HOST='localhost')
+        self.assertEqual(response.context['cl'].result_list[0].device_count, 1)
+
+    def test_change_form_shows_the_summary(self):
+        response = self.client.get(reverse('admin:clients_client_change', args=[self.acme.pk]), HTTP_HOST='localhost')
+
+        self.assertEqual(response.status_code, 200)
+        summary = response.context['client_summary']
+        self.assertEqual((summary['device_count'], summary['open_alert_count']), (1, 1))
+        self.assertContains(response, 'Router down')
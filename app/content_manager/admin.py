@@ -1,4 +1,6 @@
 from django.contrib import admin
+
+from core.search import IndexedSearchAdminMixin
 from .models import (
     SocialMediaPlatform, 
     ContentCategory, 
@@ -11,7 +13,7 @@ from .models import (
 
 @admin.register(SocialMediaPlatform)
 class SocialMediaPlatformAdmin(admin.ModelAdmin):
-    list_display = ('name', 'is_active')
+    list_display = ('name', 'adapter', 'rate_limit', 'is_active')
     list_filter = ('is_active',)
 
 
@@ -34,9 +36,10 @@ class WebsitePageInline(admin.StackedInline):
 
 
 @admin.register(ContentItem)
-class ContentItemAdmin(admin.ModelAdmin):
+class ContentItemAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'content_type', 'status', 'author', 'created_at', 'scheduled_for')
     list_filter = ('status', 'content_type', 'categories', 'author')
+    list_select_related = ('author',)
     search_fields = ('title', 'content', 'summary')
     prepopulated_fields = {'slug': ('title',)}
     readonly_fields = ('created_at', 'updated_at', 'published_at')
@@ -70,7 +73,10 @@ class SocialMediaPostAdmin(admin.ModelAdmin):
     list_display = ('content_item', 'platform', 'status', 'scheduled_time', 'posted_time')
     list_filter = ('status', 'platform', 'scheduled_time')
     search_fields = ('content_item__title', 'custom_message')
-    readonly_fields = ('posted_time', 'platform_post_id', 'platform_post_url', 'likes', 'shares', 'comments', 'impressions', 'last_analytics_update')
+    readonly_fields = (
+        'posted_time', 'publish_attempts', 'last_error', 'platform_post_id', 'platform_post_url',
+        'likes', 'shares', 'comments', 'impressions', 'last_analytics_update',
+    )
     date_hierarchy = 'scheduled_time'
     
     fieldsets = (
@@ -78,7 +84,7 @@ class SocialMediaPostAdmin(admin.ModelAdmin):
             'fields': ('content_item', 'platform', 'custom_message')
         }),
         ('Scheduling', {
-            'fields': ('status', 'scheduled_time', 'posted_time')
+            'fields': ('status', 'scheduled_time', 'posted_time', 'publish_attempts', 'last_error')
         }),
         ('Platform Data', {
             'fields': ('platform_post_id', 'platform_post_url', 'platform_specific_data'),
@@ -95,6 +101,7 @@ class SocialMediaPostAdmin(admin.ModelAdmin):
 class WebsiteSectionAdmin(admin.ModelAdmin):
     list_display = ('name', 'slug', 'parent', 'order')
     list_filter = ('parent',)
+    list_select_related = ('parent',)
     search_fields = ('name', 'description')
     prepopulated_fields = {'slug': ('name',)}
 
@@ -103,4 +110,5 @@ class WebsiteSectionAdmin(admin.ModelAdmin):
 class WebsitePageAdmin(admin.ModelAdmin):
     list_display = ('content_item', 'section', 'order', 'is_published')
     list_filter = ('is_published', 'section')
+    list_select_related = ('content_item', 'section')
     search_fields = ('content_item__title',)
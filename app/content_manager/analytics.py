@@ -0,0 +1,149 @@
+"""
+Incremental refresh of social media post analytics.
+
+How often a post's numbers are refreshed depends on its age: engagement
+moves quickly in the first day and barely at all after a month, so recent
+posts are refreshed hourly and older ones daily or weekly, until they are
+left alone. Due posts are fetched per platform in the adapter's batch
+size, sharing the platform's rate limit with publishing. Only posts whose
+numbers changed are written back, with one ``bulk_update`` per batch.
+Posts a platform returned no numbers for, e.g. because they were deleted
+there, are marked as checked like unchanged ones, so they wait for their
+next refresh instead of being fetched again on every run.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+
+from django.db.models import Q
+from django.utils import timezone
+
+from core.ratelimit import TokenBucket
+from .models import SocialMediaPost
+from .publishing import PublishError, get_adapter, reserve_quota
+
+logger = logging.getLogger(__name__)
+
+METRIC_FIELDS = ('likes', 'shares', 'comments', 'impressions')
+
+# (posts younger than, refresh at most every); older posts are not refreshed
+REFRESH_SCHEDULE = [
+    (timedelta(days=1), timedelta(hours=1)),
+    (timedelta(days=7), timedelta(hours=6)),
+    (timedelta(days=30), timedelta(days=1)),
+    (timedelta(days=180), timedelta(days=7)),
+]
+
+
+def due_for_refresh(now=None):
+    """Published posts whose analytics are older than their age allows."""
+    now = now or timezone.now()
+    due = Q()
+    newer_than = None
+    for age, interval in REFRESH_SCHEDULE:
+        tier = Q(posted_time__gt=now - age)
+        if newer_than is not None:
+            tier &= Q(posted_time__lte=now - newer_than)
+        stale = Q(last_analytics_update__isnull=True) | Q(last_analytics_update__lte=now - interval)
+        due |= tier & stale
+        newer_than = age
+    return SocialMediaPost.objects.filter(due, status='posted', platform__is_active=True).exclude(platform_post_id='')
+
+
+class AnalyticsRefresher:
+    """Refresh the analytics of due posts, newest first."""
+
+    def __init__(self, max_posts=5000):
+        self.max_posts = max_posts
+        self.buckets = {}
+
+    def bucket(self, platform):
+        if platform.pk not in self.buckets:
+            self.buckets[platform.pk] = TokenBucket(platform.rate_limit, capacity=max(1.0, platform.rate_limit))
+        return self.buckets[platform.pk]
+
+    async def fetch_platform(self, platform, posts, results):
+        """Fetch metrics for one platform's posts in the adapter's batch size."""
+        try:
+            adapter = get_adapter(platform)
+            await adapter.open()
+        except (PublishError, OSError) as e:
+            logger.warning("Cannot refresh analytics for %s: %s", platform, e)
+            return
+        except Exception:
+            # The other platforms are still refreshed
+            logger.exception("Could not open the %s adapter", platform.name)
+            return
+        try:
+            size = adapter.metrics_batch_size
+            for start in range(0, len(posts), size):
+                # Each request counts against the quota shared with publishing
+                if not reserve_quota(platform, 1):
+                    break
+                delay = self.bucket(platform).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                batch = posts[start:start + size]
+                try:
+                    results.append((batch, await adapter.fetch_metrics(batch)))
+                except NotImplementedError:
+                    break
+                except (PublishError, OSError, asyncio.TimeoutError) as e:
+                    logger.warning("Analytics refresh failed for %s: %s", platform, e)
+        finally:
+            await adapter.close()
+
+    async def fetch(self, posts):
+        by_platform = {}
+        for post in posts:
+            by_platform.setdefault(post.platform_id, (post.platform, []))[1].append(post)
+        results = []
+        await asyncio.gather(*(
+            self.fetch_platform(platform, platform_posts, results)
+            for platform, platform_posts in by_platform.values()
+        ))
+        return results
+
+    def apply(self, posts, metrics, now):
+        """Write back one fetched batch and return how many posts changed."""
+        changed = []
+        unchanged = []
+        for post in posts:
+            values = metrics.get(post.pk)
+            if values is None:
+                logger.debug("No analytics returned for %s post %s", post.platform, post.platform_post_id)
+                unchanged.append(post.pk)
+                continue
+            post.last_analytics_update = now
+            if all(getattr(post, field) == values.get(field, getattr(post, field)) for field in METRIC_FIELDS):
+                unchanged.append(post.pk)
+                continue
+            for field in METRIC_FIELDS:
+                if field in values:
+                    setattr(post, field, int(values[field]))
+            changed.append(post)
+
+        SocialMediaPost.objects.bulk_update(changed, METRIC_FIELDS + ('last_analytics_update',))
+        # Unchanged and missing posts only need to be marked as checked
+        SocialMediaPost.objects.filter(id__in=unchanged).update(last_analytics_update=now)
+        return len(changed)
+
+    def run(self):
+        """Refresh due posts and return counts of refreshed, changed and missing posts."""
+        now = timezone.now()
+        posts = list(
+            due_for_refresh(now)
+            .select_related('platform')
+            .only('id', 'platform', 'platform_post_id', 'posted_time', 'last_analytics_update', *METRIC_FIELDS)
+            .order_by('-posted_time')[:self.max_posts]
+        )
+        counts = {'refreshed': 0, 'changed': 0, 'missing': 0}
+        if not posts:
+            return counts
+
+        for batch, metrics in asyncio.run(self.fetch(posts)):
+            refreshed = sum(1 for post in batch if post.pk in metrics)
+            counts['refreshed'] += refreshed
+            counts['missing'] += len(batch) - refreshed
+            counts['changed'] += self.apply(batch, metrics, now)
+        return counts
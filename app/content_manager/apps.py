@@ -0,0 +1,20 @@
+from django.apps import AppConfig
+
+
+class ContentManagerConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'content_manager'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from core import audit, images, search
+        from .models import ContentItem, SocialMediaPlatform, WebsitePage, WebsiteSection
+
+        search.register(ContentItem, 'title', ['title', 'summary', 'meta_keywords', 'content'])
+        images.register(ContentItem, 'featured_image')
+        images.register(SocialMediaPlatform, 'icon')
+        audit.register(ContentItem, 'title')
+        audit.register(SocialMediaPlatform, 'name')
+        audit.register(WebsiteSection, 'name')
+        audit.register(WebsitePage, 'content_item_id')
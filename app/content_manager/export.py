@@ -0,0 +1,142 @@
+"""
+Incremental static export of the public website.
+
+Published pages and section pages are rendered to ``index.html`` files
+under ``SITE_EXPORT_ROOT/public``, laid out by URL, with gzip (and brotli,
+if installed) variants next to them. ``StaticSiteMiddleware`` serves them
+through WhiteNoise before a request reaches a view.
+
+A manifest records a fingerprint for every exported URL, so a build only
+rewrites the files whose content item, section or navigation changed and
+deletes the files of pages that are no longer published. Every page embeds
+the navigation, so a change to the section tree rewrites all of them.
+After each build ``EXPORT_VERSION_KEY`` holds a fingerprint of the exported
+URLs, which tells the middleware when to index the export again.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.urls import reverse
+from whitenoise.compress import Compressor
+
+from .models import WebsitePage
+from .site import load_section_tree, page_context, section_context
+
+EXPORT_LOCK_KEY = 'content:export-lock'
+EXPORT_VERSION_KEY = 'content:export-version'
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+
+def fingerprint(*parts):
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class SiteExporter:
+    """Write the published website to static files, skipping unchanged pages."""
+
+    def __init__(self, root=None):
+        self.root = root or settings.SITE_EXPORT_ROOT
+        self.public_root = os.path.join(self.root, 'public')
+        self.manifest_path = os.path.join(self.root, 'manifest.json')
+        self.compressor = Compressor(quiet=True)
+
+    def load_manifest(self):
+        try:
+            with open(self.manifest_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_manifest(self, manifest):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = f'{self.manifest_path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def path_for(self, url):
+        return os.path.join(self.public_root, *url.strip('/').split('/'), 'index.html')
+
+    def documents(self):
+        """Return ``{url: (fingerprint, template, context factory)}`` for everything to export."""
+        tree = load_section_tree()
+        navigation = fingerprint(tree['roots'])
+        documents = {}
+        for section in tree['by_slug'].values():
+            url = reverse('content_manager:section_detail', args=[section['slug']])
+            documents[url] = (
+                navigation, 'content_manager/section.html',
+                lambda section=section: section_context(tree, section),
+            )
+
+        pages = WebsitePage.objects.filter(
+            is_published=True, content_item__status='published'
+        ).select_related('content_item')
+        for page in pages:
+            item = page.content_item
+            url = reverse('content_manager:page_detail', args=[item.slug])
+            documents[url] = (
+                fingerprint(navigation, item.pk, item.updated_at, page.section_id),
+                'content_manager/page.html',
+                lambda page=page: page_context(tree, page),
+            )
+        return documents
+
+    def write(self, path, html):
+        """Write a file and its compressed variants, replacing each atomically."""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            f.write(html)
+        written = {filename[len(tmp):] for filename in self.compressor.compress(tmp)}
+        for suffix in COMPRESSED_SUFFIXES:
+            if suffix in written:
+                os.replace(tmp + suffix, path + suffix)
+            elif os.path.exists(path + suffix):
+                # Left from an earlier version that compressed better
+                os.remove(path + suffix)
+        os.replace(tmp, path)
+
+    def remove(self, path):
+        for filename in (path, *(path + suffix for suffix in COMPRESSED_SUFFIXES)):
+            if os.path.exists(filename):
+                os.remove(filename)
+        try:
+            os.removedirs(os.path.dirname(path))
+        except OSError:
+            pass  # Directory still has other pages in it
+
+    def build(self, full=False):
+        """Export changed pages and return counts, or None if a build is already running.
+
+        ``full`` ignores the manifest and rewrites every page.
+        """
+        if not cache.add(EXPORT_LOCK_KEY, 1, timeout=600):
+            return None
+        try:
+            previous = {} if full else self.load_manifest()
+            manifest = {}
+            counts = {'written': 0, 'unchanged': 0, 'removed': 0}
+
+            for url, (key, template, context) in self.documents().items():
+                path = self.path_for(url)
+                manifest[url] = key
+                if previous.get(url) == key and os.path.exists(path):
+                    counts['unchanged'] += 1
+                    continue
+                self.write(path, render_to_string(template, context()))
+                counts['written'] += 1
+
+            for url in set(previous) - set(manifest):
+                self.remove(self.path_for(url))
+                counts['removed'] += 1
+
+            self.save_manifest(manifest)
+            cache.set(EXPORT_VERSION_KEY, fingerprint(sorted(manifest)), timeout=None)
+        finally:
+            cache.delete(EXPORT_LOCK_KEY)
+        return counts
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from content_manager.export import SiteExporter
+
+
+class Command(BaseCommand):
+    help = "Write changed website pages to the static export"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rewrite every page, ignoring the manifest")
+
+    def handle(self, *args, **options):
+        exporter = SiteExporter()
+        counts = exporter.build(full=options['full'])
+        if counts is None:
+            raise CommandError("Another export is running")
+        self.stdout.write(
+            f"{counts['written']} written, {counts['unchanged']} unchanged, {counts['removed']} removed "
+            f"in {exporter.public_root}"
+        )
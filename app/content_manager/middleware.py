@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from whitenoise.base import WhiteNoise
+from whitenoise.middleware import WhiteNoiseMiddleware
+from whitenoise.responders import MissingFileError
+
+from .export import EXPORT_VERSION_KEY
+
+# Seconds between checks whether a build changed the exported pages
+VERSION_CHECK_INTERVAL = 10
+
+
+class StaticSiteMiddleware:
+    """Serve exported website pages before they reach a view.
+
+    The export is indexed at startup and again when a build has changed the
+    set of exported pages (``EXPORT_VERSION_KEY``), so requests for other
+    URLs never touch the filesystem. Pages are read fresh when served, as
+    builds rewrite them in place. Pages not indexed yet fall through to the
+    regular views.
+    """
+
+    def __init__(self, get_response):
+        if not settings.SITE_EXPORT_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.root = os.path.join(settings.SITE_EXPORT_ROOT, 'public')
+        self.files = WhiteNoise(None, index_file=True)
+        self.version, self.pages = self.index()
+        self.checked_at = time.monotonic()
+
+    def index(self):
+        """Return the export's version and ``{url: path}`` of its pages."""
+        version = cache.get(EXPORT_VERSION_KEY)
+        pages = {}
+        for directory, _, filenames in os.walk(self.root):
+            if 'index.html' in filenames:
+                relative = os.path.relpath(directory, self.root).replace(os.sep, '/')
+                url = '/' if relative == '.' else f'/{relative}/'
+                pages[url] = os.path.join(directory, 'index.html')
+        return version, pages
+
+    def current_pages(self):
+        now = time.monotonic()
+        if now - self.checked_at >= VERSION_CHECK_INTERVAL:
+            self.checked_at = now
+            if cache.get(EXPORT_VERSION_KEY) != self.version:
+                self.version, self.pages = self.index()
+        return self.pages
+
+    def __call__(self, request):
+        if request.method in ('GET', 'HEAD'):
+            path = self.current_pages().get(request.path_info)
+            if path is not None:
+                try:
+                    static_file = self.files.get_static_file(path, request.path_info)
+                except (MissingFileError, FileNotFoundError):
+                    pass  # Removed since the export was indexed
+                else:
+                    return WhiteNoiseMiddleware.serve(static_file, request)
+        return self.get_response(request)
@@ -10,6 +10,10 @@ class SocialMediaPlatform(models.Model):
     api_credentials = models.JSONField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
     
+    # Publishing
+    adapter = models.CharField(max_length=50, blank=True, help_text="Publishing adapter name from SOCIAL_PUBLISHING_ADAPTERS")
+    rate_limit = models.FloatField(default=1.0, help_text="Maximum posts per second across all workers")
+    
     def __str__(self):
         return self.name
 
@@ -87,6 +91,7 @@ class SocialMediaPost(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Draft'),
         ('scheduled', 'Scheduled'),
+        ('publishing', 'Publishing'),
         ('posted', 'Posted'),
         ('failed', 'Failed'),
     ]
@@ -104,6 +109,9 @@ class SocialMediaPost(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
     scheduled_time = models.DateTimeField(blank=True, null=True)
     posted_time = models.DateTimeField(blank=True, null=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    publish_attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
     
     # Analytics
     likes = models.IntegerField(default=0)
@@ -114,6 +122,10 @@ class SocialMediaPost(models.Model):
     
     class Meta:
         ordering = ['-scheduled_time', '-posted_time']
+        indexes = [
+            models.Index(fields=['status', 'scheduled_time']),
+            models.Index(fields=['status', 'posted_time']),
+        ]
     
     def __str__(self):
         return f"{self.platform.name} post - {self.content_item.title}"
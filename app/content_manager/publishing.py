@@ -0,0 +1,321 @@
+"""
+Dispatch of scheduled social media posts.
+
+Due posts are claimed in batches with ``SELECT ... FOR UPDATE SKIP LOCKED``
+and moved to ``publishing``, so concurrent workers never claim the same
+post. Each batch is published concurrently on an asyncio event loop through
+the platform's adapter and the results are written back with one
+``bulk_update``.
+
+Platforms are rate limited twice: a per-minute quota shared by all workers
+through the cache decides how many posts a worker may claim, and a token
+bucket per platform paces the requests within a batch.
+
+Adapters are configured by name in ``SOCIAL_PUBLISHING_ADAPTERS``; they
+subclass ``PlatformAdapter`` and implement ``publish()`` as a coroutine.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.ratelimit import TokenBucket
+from .models import ContentItem, SocialMediaPlatform, SocialMediaPost
+from .site import site_changed
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 60  # seconds
+PUBLISH_TIMEOUT = 30  # seconds
+
+# Posts left in publishing this long were interrupted mid-request
+STALE_AFTER = timedelta(minutes=15)
+
+
+class PublishError(Exception):
+    """A platform rejected a post; ``retryable`` errors are tried again later."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class PlatformAdapter:
+    """Publishes posts to one social media platform.
+
+    Adapters are created once per batch and platform. ``open()`` and
+    ``close()`` bracket the batch, e.g. to share one HTTP session.
+    """
+
+    def __init__(self, platform):
+        self.platform = platform
+        self.credentials = platform.api_credentials or {}
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, post, message):
+        """Publish a post and return a dict with ``id`` and optionally ``url`` and ``data``."""
+        raise NotImplementedError
+
+    # Posts per metrics request; platforms with a batch endpoint raise this
+    metrics_batch_size = 1
+
+    async def fetch_metrics(self, posts):
+        """Return ``{post pk: {'likes': ..., 'shares': ..., 'comments': ..., 'impressions': ...}}``.
+
+        Called with at most ``metrics_batch_size`` published posts. Posts
+        missing from the result keep their numbers and are marked as checked.
+        """
+        raise NotImplementedError
+
+
+class FakeAdapter(PlatformAdapter):
+    """Local stand-in platform for development and tests.
+
+    Accepts every post after ``latency`` seconds (from the platform's
+    credentials). Messages containing ``fail_marker`` are rejected, and
+    those containing ``retry_marker`` fail with a retryable error.
+    Published posts are recorded in ``FakeAdapter.published``. Metrics are
+    served in batches and grow with each post's age.
+    """
+    published = []
+
+    async def publish(self, post, message):
+        await asyncio.sleep(float(self.credentials.get('latency', 0.05)))
+        if self.credentials.get('fail_marker') and self.credentials['fail_marker'] in message:
+            raise PublishError("Rejected by fake platform")
+        if self.credentials.get('retry_marker') and self.credentials['retry_marker'] in message:
+            raise PublishError("Fake platform is busy", retryable=True)
+        post_id = f'fake-{post.pk}'
+        self.published.append((self.platform.pk, post.pk, message))
+        return {'id': post_id, 'url': f'https://social.invalid/{self.platform.pk}/{post_id}'}
+
+    metrics_batch_size = 100
+
+    async def fetch_metrics(self, posts):
+        await asyncio.sleep(float(self.credentials.get('latency', 0.05)))
+        metrics = {}
+        for post in posts:
+            # Grows with the post's age so repeated refreshes see changes
+            hours = int((timezone.now() - post.posted_time).total_seconds() // 3600)
+            metrics[post.pk] = {'likes': hours, 'shares': hours // 4, 'comments': hours // 8, 'impressions': hours * 10}
+        return metrics
+
+
+def get_adapter(platform):
+    path = settings.SOCIAL_PUBLISHING_ADAPTERS.get(platform.adapter)
+    if path is None:
+        raise PublishError(f"No publishing adapter named '{platform.adapter}'")
+    return import_string(path)(platform)
+
+
+def quota_key(platform_id):
+    return f'social:quota:{platform_id}:{int(time.time() // 60)}'
+
+
+def reserve_quota(platform, wanted):
+    """Reserve up to ``wanted`` posts from the platform's per-minute quota.
+
+    The quota is shared by every worker, so the platform's rate limit holds
+    however many workers run. Returns the number of posts granted.
+    """
+    key = quota_key(platform.pk)
+    limit = max(1, int(platform.rate_limit * 60))
+    cache.add(key, 0, timeout=120)
+    used = cache.incr(key, wanted)
+    granted = max(0, min(wanted, limit - (used - wanted)))
+    if granted < wanted:
+        cache.decr(key, wanted - granted)
+    return granted
+
+
+def due_posts(now):
+    """Scheduled posts whose own or content item's time has come."""
+    return SocialMediaPost.objects.filter(
+        Q(scheduled_time__lte=now) | Q(scheduled_time__isnull=True, content_item__scheduled_for__lte=now),
+        status='scheduled',
+        platform__is_active=True,
+    )
+
+
+def post_message(post):
+    return post.custom_message or post.content_item.content
+
+
+class SocialDispatcher:
+    """Claim due posts and publish them concurrently."""
+
+    def __init__(self, batch_size=None, concurrency=None):
+        self.batch_size = batch_size or settings.SOCIAL_DISPATCH_BATCH_SIZE
+        self.concurrency = concurrency or settings.SOCIAL_DISPATCH_CONCURRENCY
+        self.buckets = {}
+
+    def release_stale(self):
+        """Fail posts a crashed worker left publishing.
+
+        They may or may not have reached the platform, so they are not
+        retried automatically; that would risk posting twice.
+        """
+        return SocialMediaPost.objects.filter(
+            status='publishing', claimed_at__lt=timezone.now() - STALE_AFTER
+        ).update(status='failed', last_error="Interrupted while publishing; check the platform before rescheduling")
+
+    def claim(self):
+        """Move a batch of due posts to publishing and return them."""
+        now = timezone.now()
+        counts = dict(
+            due_posts(now).order_by().values_list('platform').annotate(count=Count('id'))
+        )
+        if not counts:
+            return []
+
+        claimed = []
+        platforms = SocialMediaPlatform.objects.in_bulk(counts)
+        for platform_id, count in counts.items():
+            wanted = min(count, self.batch_size - len(claimed))
+            if wanted <= 0:
+                break
+            granted = reserve_quota(platforms[platform_id], wanted)
+            if not granted:
+                continue
+            with transaction.atomic():
+                ids = list(
+                    due_posts(now).filter(platform_id=platform_id)
+                    .select_for_update(skip_locked=True, of=('self',))
+                    .order_by('scheduled_time')
+                    .values_list('id', flat=True)[:granted]
+                )
+                SocialMediaPost.objects.filter(id__in=ids).update(status='publishing', claimed_at=now)
+            claimed.extend(ids)
+            if len(ids) < granted:
+                # Other workers got there first; hand back the unused quota
+                cache.decr(quota_key(platform_id), granted - len(ids))
+
+        return list(SocialMediaPost.objects.filter(id__in=claimed).select_related('content_item', 'platform'))
+
+    def bucket(self, platform):
+        if platform.pk not in self.buckets:
+            # Allow at least one post at once for limits below one per second
+            self.buckets[platform.pk] = TokenBucket(platform.rate_limit, capacity=max(1.0, platform.rate_limit))
+        return self.buckets[platform.pk]
+
+    async def publish_batch(self, posts):
+        """Publish posts concurrently, recording each outcome on the post."""
+        platforms = {post.platform_id: post.platform for post in posts}
+        adapters = {}
+        for platform_id, platform in platforms.items():
+            try:
+                adapters[platform_id] = get_adapter(platform)
+                await adapters[platform_id].open()
+            except PublishError as e:
+                adapters[platform_id] = e
+            except Exception as e:
+                logger.exception("Could not open the %s adapter", platform.name)
+                adapters[platform_id] = PublishError(f"Could not connect to the platform: {e}")
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def publish(post):
+            adapter = adapters[post.platform_id]
+            if isinstance(adapter, PublishError):
+                self.record_failure(post, adapter)
+                return
+            async with semaphore:
+                delay = self.bucket(post.platform).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+                try:
+                    result = await asyncio.wait_for(adapter.publish(post, post_message(post)), PUBLISH_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # The post may have gone through; retrying could post it twice
+                    self.record_failure(post, PublishError("Timed out waiting for the platform"))
+                except (PublishError, OSError) as e:
+                    self.record_failure(post, e)
+                except Exception as e:
+                    # Unexpected adapter error, e.g. a malformed response: the
+                    # post may have gone through, so it is not retried
+                    logger.exception("Publishing social post %s failed", post.pk)
+                    self.record_failure(post, PublishError(f"Unexpected error: {e!r}"))
+                else:
+                    self.record_success(post, result)
+
+        try:
+            await asyncio.gather(*(publish(post) for post in posts))
+        finally:
+            for adapter in adapters.values():
+                if isinstance(adapter, PlatformAdapter):
+                    try:
+                        await adapter.close()
+                    except Exception:
+                        logger.exception("Could not close the %s adapter", type(adapter).__name__)
+
+    def record_success(self, post, result):
+        post.status = 'posted'
+        post.posted_time = timezone.now()
+        post.platform_post_id = str(result['id'])
+        post.platform_post_url = result.get('url', '')
+        if result.get('data') is not None:
+            post.platform_specific_data = result['data']
+        post.publish_attempts += 1
+        post.last_error = ''
+
+    def record_failure(self, post, error):
+        post.publish_attempts += 1
+        post.last_error = str(error)
+        # Connection errors happen before the platform accepted anything
+        retryable = getattr(error, 'retryable', isinstance(error, OSError))
+        if retryable and post.publish_attempts < MAX_ATTEMPTS:
+            post.status = 'scheduled'
+            post.scheduled_time = timezone.now() + timedelta(seconds=BACKOFF_BASE * 2 ** (post.publish_attempts - 1))
+        else:
+            post.status = 'failed'
+            logger.warning("Social post %s failed: %s", post.pk, error)
+
+    def save_batch(self, posts):
+        SocialMediaPost.objects.bulk_update(posts, [
+            'status', 'scheduled_time', 'posted_time', 'platform_post_id', 'platform_post_url',
+            'platform_specific_data', 'publish_attempts', 'last_error',
+        ])
+        # Content items are published once none of their posts is pending
+        pending = SocialMediaPost.objects.filter(
+            content_item=OuterRef('pk'), status__in=('scheduled', 'publishing')
+        )
+        published = ContentItem.objects.filter(
+            id__in={post.content_item_id for post in posts if post.status == 'posted'}, status='scheduled'
+        ).exclude(Exists(pending)).update(status='published', published_at=Coalesce('published_at', Value(timezone.now())))
+        if published:
+            # Updated without signals; their website pages may now be public
+            site_changed()
+
+    def run(self, max_batches=None):
+        """Publish due posts until none are left or quotas run out, returning counts."""
+        self.release_stale()
+        counts = {'posted': 0, 'retried': 0, 'failed': 0}
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            posts = self.claim()
+            if not posts:
+                break
+            try:
+                asyncio.run(self.publish_batch(posts))
+            finally:
+                # Keep the outcomes recorded so far, whatever stopped the batch;
+                # posts without one stay publishing for release_stale()
+                self.save_batch(posts)
+            for post in posts:
+                key = {'posted': 'posted', 'scheduled': 'retried'}.get(post.status, 'failed')
+                counts[key] += 1
+            batches += 1
+        return counts
@@ -0,0 +1,24 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ContentItem, WebsitePage, WebsiteSection
+from .site import render_html, site_changed
+
+
+@receiver(post_save, sender=WebsiteSection)
+@receiver(post_delete, sender=WebsiteSection)
+@receiver(post_save, sender=WebsitePage)
+@receiver(post_delete, sender=WebsitePage)
+@receiver(post_delete, sender=ContentItem)
+def refresh_section_tree(sender, instance, **kwargs):
+    site_changed()
+
+
+@receiver(post_save, sender=ContentItem)
+def render_content_item(sender, instance, raw=False, **kwargs):
+    """Render a saved content item so pages never render Markdown when served."""
+    if raw:
+        return
+    render_html(instance)
+    # Titles, slugs and status all show up in the navigation
+    site_changed()
@@ -0,0 +1,116 @@
+"""
+Cached website structure and rendered page content.
+
+The section tree, with each section's published pages, is built from two
+queries and cached as plain dicts, so navigation never walks
+``WebsiteSection.parent`` one level at a time. Markdown is rendered when a
+content item is saved and cached under its ``updated_at``, so serving a
+page only reads the cache. Signals drop the tree and re-render content
+whenever sections, pages or content items change, and queue a static
+export (see ``export``) when one is enabled.
+"""
+import markdown
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import WebsitePage, WebsiteSection
+
+SECTION_TREE_KEY = 'content:section-tree'
+SECTION_TREE_TIMEOUT = 24 * 60 * 60
+HTML_TIMEOUT = 7 * 24 * 60 * 60
+
+MARKDOWN_EXTENSIONS = ['extra', 'sane_lists']
+
+
+def build_section_tree():
+    """Build the section hierarchy with the published pages of each section.
+
+    Returns a dict with ``roots`` (top-level sections, each with nested
+    ``children`` and ``pages``) and ``by_slug``.
+    """
+    sections = {
+        row['id']: dict(row, children=[], pages=[])
+        for row in WebsiteSection.objects.order_by('order', 'name').values('id', 'name', 'slug', 'description', 'parent_id')
+    }
+    pages = (
+        WebsitePage.objects.filter(is_published=True, content_item__status='published', section__isnull=False)
+        .order_by('order', 'content_item__title')
+        .values('section_id', 'content_item__title', 'content_item__slug')
+    )
+    for page in pages:
+        sections[page['section_id']]['pages'].append({
+            'title': page['content_item__title'],
+            'slug': page['content_item__slug'],
+        })
+
+    roots = []
+    for section in sections.values():
+        parent = sections.get(section['parent_id'])
+        if parent is None:
+            roots.append(section)
+        else:
+            parent['children'].append(section)
+    return {
+        'roots': roots,
+        'by_slug': {section['slug']: section for section in sections.values()},
+    }
+
+
+def load_section_tree():
+    """Return the cached section tree, building it on a miss."""
+    tree = cache.get(SECTION_TREE_KEY)
+    if tree is None:
+        tree = build_section_tree()
+        cache.set(SECTION_TREE_KEY, tree, SECTION_TREE_TIMEOUT)
+    return tree
+
+
+def invalidate_section_tree():
+    cache.delete(SECTION_TREE_KEY)
+
+
+def site_changed():
+    """Drop the cached section tree and queue a static export of the changes.
+
+    Both wait for the current transaction to commit, so a concurrent read
+    cannot cache the tree as it was before the change.
+    """
+    transaction.on_commit(invalidate_section_tree)
+    if settings.SITE_EXPORT_ENABLED:
+        from .tasks import schedule_site_export
+        transaction.on_commit(schedule_site_export)
+
+
+def html_key(content_item):
+    return f'content:html:{content_item.pk}:{content_item.updated_at.timestamp():.6f}'
+
+
+def render_html(content_item):
+    """Render a content item's Markdown and cache it under its current version."""
+    html = markdown.markdown(content_item.content, extensions=MARKDOWN_EXTENSIONS)
+    cache.set(html_key(content_item), html, HTML_TIMEOUT)
+    return html
+
+
+def rendered_html(content_item):
+    """Return a content item's HTML, rendering only if the cache lost it."""
+    html = cache.get(html_key(content_item))
+    if html is None:
+        html = render_html(content_item)
+    return html
+
+
+def section_context(tree, section):
+    """Template context for a section page, shared by the view and the static export."""
+    return {'navigation': tree['roots'], 'section': section}
+
+
+def page_context(tree, page):
+    """Template context for a website page; ``page`` needs its content item loaded."""
+    return {
+        'navigation': tree['roots'],
+        'page': page,
+        'content_item': page.content_item,
+        'content_html': rendered_html(page.content_item),
+    }
@@ -0,0 +1,45 @@
+from celery import shared_task
+from django.core.cache import cache
+
+from .analytics import AnalyticsRefresher
+from .publishing import SocialDispatcher
+
+
+@shared_task
+def dispatch_social_posts(max_batches=None):
+    """Task to publish social media posts that are due."""
+    counts = SocialDispatcher().run(max_batches=max_batches)
+    return f"Social posts: {counts['posted']} posted, {counts['retried']} retried, {counts['failed']} failed"
+
+
+@shared_task
+def refresh_social_analytics(max_posts=5000):
+    """Task to refresh the engagement numbers of recently published posts."""
+    counts = AnalyticsRefresher(max_posts=max_posts).run()
+    return f"Social analytics: {counts['refreshed']} refreshed, {counts['changed']} changed, {counts['missing']} missing"
+
+
+# Cache key held while an export is queued, so a burst of edits queues one
+# build instead of one per save
+SITE_EXPORT_SCHEDULED_KEY = 'content:export-scheduled'
+
+
+def schedule_site_export(delay=5):
+    """Queue a static export unless one is already waiting."""
+    if cache.add(SITE_EXPORT_SCHEDULED_KEY, 1, timeout=60):
+        export_static_site.apply_async(countdown=delay)
+
+
+@shared_task
+def export_static_site(full=False):
+    """Task to write changed website pages to the static export."""
+    from .export import SiteExporter
+
+    # Changes from now on need a new build
+    cache.delete(SITE_EXPORT_SCHEDULED_KEY)
+    counts = SiteExporter().build(full=full)
+    if counts is None:
+        # Another build is running and may have missed the latest changes
+        schedule_site_export(delay=60)
+        return "Static export already running"
+    return f"Static export: {counts['written']} written, {counts['unchanged']} unchanged, {counts['removed']} removed"
@@ -0,0 +1,142 @@
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .analytics import AnalyticsRefresher
+from .models import ContentItem, SocialMediaPlatform, SocialMediaPost
+from .publishing import FakeAdapter, SocialDispatcher, reserve_quota
+
+
+class UnreachableAdapter(FakeAdapter):
+
+    async def open(self):
+        raise ConnectionRefusedError("Connection refused")
+
+
+class SocialDispatcherTests(TestCase):
+    """Publish through the fake platform adapter."""
+
+    def setUp(self):
+        cache.clear()
+        FakeAdapter.published = []
+        self.platform = SocialMediaPlatform.objects.create(
+            name='Fake', adapter='fake', rate_limit=10,
+            api_credentials={'latency': 0, 'fail_marker': 'FAIL', 'retry_marker': 'RETRY'},
+        )
+        self.item = ContentItem.objects.create(
+            title='Launch', content='We launched', content_type='social', status='scheduled',
+        )
+
+    def make_posts(self, count, message='', status='scheduled', when=None):
+        when = when or timezone.now() - timedelta(minutes=1)
+        return [
+            SocialMediaPost.objects.create(
+                content_item=self.item, platform=self.platform, custom_message=message,
+                status=status, scheduled_time=when,
+            )
+            for _ in range(count)
+        ]
+
+    def test_due_posts_are_published(self):
+        posts = self.make_posts(3)
+        later = self.make_posts(1, when=timezone.now() + timedelta(hours=1))
+
+        counts = SocialDispatcher().run()
+
+        self.assertEqual(counts, {'posted': 3, 'retried': 0, 'failed': 0})
+        self.assertEqual(sorted(post_id for _, post_id, _ in FakeAdapter.published), [post.pk for post in posts])
+        posted = SocialMediaPost.objects.get(pk=posts[0].pk)
+        self.assertEqual((posted.status, posted.platform_post_id), ('posted', f'fake-{posted.pk}'))
+        self.assertEqual(SocialMediaPost.objects.get(pk=later[0].pk).status, 'scheduled')
+        # A post is still scheduled, so the item is not published yet
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.status, 'scheduled')
+
+    def test_claimed_posts_are_not_claimed_again(self):
+        self.make_posts(3)
+
+        first = SocialDispatcher(batch_size=2).claim()
+        second = SocialDispatcher(batch_size=2).claim()
+
+        self.assertEqual((len(first), len(second)), (2, 1))
+        self.assertFalse({post.pk for post in first} & {post.pk for post in second})
+        self.assertEqual(SocialMediaPost.objects.filter(status='publishing', claimed_at__isnull=False).count(), 3)
+        self.assertEqual(SocialDispatcher().claim(), [])
+
+    def test_quota_is_shared_by_dispatchers(self):
+        # Three posts a minute
+        self.platform.rate_limit = 0.05
+        self.platform.save()
+        self.assertEqual(reserve_quota(self.platform, 2), 2)
+        self.assertEqual(reserve_quota(self.platform, 2), 1)
+        self.assertEqual(reserve_quota(self.platform, 1), 0)
+
+        cache.clear()
+        self.make_posts(5)
+        self.assertEqual(len(SocialDispatcher().claim()), 3)
+        self.assertEqual(SocialDispatcher().claim(), [])
+        self.assertEqual(SocialMediaPost.objects.filter(status='scheduled').count(), 2)
+
+    def test_rejected_posts_fail_and_busy_platforms_are_retried(self):
+        [rejected] = self.make_posts(1, message='FAIL')
+        [busy] = self.make_posts(1, message='RETRY')
+        self.make_posts(1)
+
+        counts = SocialDispatcher().run()
+
+        self.assertEqual(counts, {'posted': 1, 'retried': 1, 'failed': 1})
+        rejected.refresh_from_db()
+        self.assertEqual((rejected.status, rejected.last_error), ('failed', 'Rejected by fake platform'))
+        busy.refresh_from_db()
+        self.assertEqual((busy.status, busy.publish_attempts), ('scheduled', 1))
+        self.assertGreater(busy.scheduled_time, timezone.now())
+        self.assertEqual(busy.last_error, 'Fake platform is busy')
+
+    def test_stale_publishing_posts_are_failed_not_retried(self):
+        [stale] = self.make_posts(1, status='publishing')
+        [recent] = self.make_posts(1, status='publishing')
+        SocialMediaPost.objects.filter(pk=stale.pk).update(claimed_at=timezone.now() - timedelta(hours=1))
+        SocialMediaPost.objects.filter(pk=recent.pk).update(claimed_at=timezone.now())
+
+        counts = SocialDispatcher().run()
+
+        self.assertEqual(counts, {'posted': 0, 'retried': 0, 'failed': 0})
+        self.assertEqual(FakeAdapter.published, [])
+        stale.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertIn('Interrupted', stale.last_error)
+        self.assertEqual(SocialMediaPost.objects.get(pk=recent.pk).status, 'publishing')
+
+
+@override_settings(SOCIAL_PUBLISHING_ADAPTERS={
+    'fake': 'content_manager.publishing.FakeAdapter',
+    'unreachable': 'content_manager.tests.UnreachableAdapter',
+})
+class AnalyticsRefresherTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        item = ContentItem.objects.create(title='Launch', content='We launched', content_type='social')
+        posted_time = timezone.now() - timedelta(hours=5)
+        for adapter in ('fake', 'unreachable', 'missing'):
+            platform = SocialMediaPlatform.objects.create(
+                name=adapter.title(), adapter=adapter, rate_limit=10, api_credentials={'latency': 0},
+            )
+            SocialMediaPost.objects.create(
+                content_item=item, platform=platform, status='posted', posted_time=posted_time,
+                platform_post_id=f'{adapter}-1',
+            )
+
+    def test_platforms_that_cannot_be_reached_are_skipped(self):
+        with self.assertLogs('content_manager.analytics', 'WARNING') as logs:
+            counts = AnalyticsRefresher().run()
+
+        self.assertEqual(counts, {'refreshed': 1, 'changed': 1, 'missing': 0})
+        self.assertEqual(SocialMediaPost.objects.get(platform__adapter='fake').likes, 5)
+        self.assertFalse(SocialMediaPost.objects.exclude(platform__adapter='fake').filter(
+            last_analytics_update__isnull=False,
+        ).exists())
+        self.assertEqual(len(logs.output), 2)
+        self.assertIn('Connection refused', '\n'.join(logs.output))
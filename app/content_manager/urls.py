@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import views
+
+app_name = 'content_manager'
+
+urlpatterns = [
+    path('sections/<slug:slug>/', views.section_detail, name='section_detail'),
+    path('<slug:slug>/', views.page_detail, name='page_detail'),
+]
@@ -0,0 +1,25 @@
+from django.http import Http404
+from django.shortcuts import render
+
+from .models import WebsitePage
+from .site import load_section_tree, page_context, section_context
+
+
+def section_detail(request, slug):
+    """List a section's subsections and pages, straight from the cached tree."""
+    tree = load_section_tree()
+    section = tree['by_slug'].get(slug)
+    if section is None:
+        raise Http404("No such section")
+    return render(request, 'content_manager/section.html', section_context(tree, section))
+
+
+def page_detail(request, slug):
+    """Show a published page using its pre-rendered HTML."""
+    try:
+        page = WebsitePage.objects.select_related('content_item').get(
+            content_item__slug=slug, is_published=True, content_item__status='published'
+        )
+    except WebsitePage.DoesNotExist:
+        raise Http404("No such page")
+    return render(request, 'content_manager/page.html', page_context(load_section_tree(), page))
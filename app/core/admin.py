@@ -2,7 +2,9 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from .models import UserProfile, Notification, AuditLog, EmailTemplate, SystemSetting
+from . import notifications
+from .changelists import AutocompleteFilter, LargeTableAdminMixin
+from .models import UserProfile, Notification, AuditLog, EmailTemplate, SystemSetting, ImageAsset
 
 
 class UserProfileInline(admin.StackedInline):
@@ -21,19 +23,27 @@ admin.site.register(User, UserAdmin)
 
 
 @admin.register(Notification)
-class NotificationAdmin(admin.ModelAdmin):
+class NotificationAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'user', 'type', 'is_read', 'created_at')
-    list_filter = ('type', 'is_read', 'created_at')
+    list_filter = ('type', 'is_read', 'created_at', ('user', AutocompleteFilter))
     search_fields = ('title', 'message', 'user__username')
-    date_hierarchy = 'created_at'
+    list_select_related = ('user',)
+    keyset = ('created_at', 'id')
+    actions = ['mark_read']
+    
+    @admin.action(description="Mark selected notifications as read")
+    def mark_read(self, request, queryset):
+        count = notifications.mark_read_in_bulk(queryset)
+        self.message_user(request, f"{count} notifications marked as read.")
 
 
 @admin.register(AuditLog)
-class AuditLogAdmin(admin.ModelAdmin):
+class AuditLogAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('action', 'user', 'model_name', 'object_repr', 'ip_address', 'timestamp')
-    list_filter = ('action', 'timestamp', 'user')
+    list_filter = ('action', 'timestamp', ('user', AutocompleteFilter))
     search_fields = ('model_name', 'object_repr', 'user__username')
-    date_hierarchy = 'timestamp'
+    list_select_related = ('user',)
+    keyset = ('timestamp', 'id')
     readonly_fields = ('action', 'user', 'model_name', 'object_id', 'object_repr', 'action_details', 'ip_address', 'timestamp')
     
     def has_add_permission(self, request):
@@ -59,3 +69,22 @@ class SystemSettingAdmin(admin.ModelAdmin):
     list_display = ('key', 'value', 'is_public')
     list_filter = ('is_public',)
     search_fields = ('key', 'value', 'description')
+
+
+@admin.register(ImageAsset)
+class ImageAssetAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'width', 'height', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('name', 'source_hash')
+    readonly_fields = ('name', 'source_hash', 'status', 'width', 'height', 'variants', 'error', 'created_at', 'updated_at')
+    actions = ['retry']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.action(description="Process selected images again")
+    def retry(self, request, queryset):
+        from .tasks import schedule_image_processing
+        count = queryset.update(status='pending', error='')
+        schedule_image_processing()
+        self.message_user(request, f"{count} images queued for processing.")
@@ -0,0 +1,24 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'core'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from django.contrib.auth.models import User
+        from . import audit, images, queries
+        from .models import EmailTemplate, SystemSetting, UserProfile
+        from .search import install_postgres_search
+
+        post_migrate.connect(install_postgres_search, sender=self)
+        images.register(UserProfile, 'profile_image')
+        audit.connect_signals()
+        queries.connect_signals()
+        # Logins are logged as such
+        audit.register(User, 'username', ignore_fields={'last_login'})
+        audit.register(SystemSetting, 'key')
+        audit.register(EmailTemplate, 'name')
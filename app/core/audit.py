@@ -0,0 +1,275 @@
+"""
+Buffered audit logging.
+
+Audit entries are collected in a buffer per request (``AuditMiddleware``)
+or Celery task and written with ``bulk_create`` when the request or task
+ends, or earlier once ``AUDIT_BUFFER_SIZE`` entries or
+``AUDIT_FLUSH_INTERVAL`` seconds have accumulated. Code running outside a
+request or task shares a process-wide buffer flushed the same way and at
+exit. Entries recorded inside a transaction only enter the buffer once it
+commits, so rolled back changes are never logged.
+
+Flushed buffers go to a background writer thread, so requests do not wait
+for the inserts; with ``AUDIT_ASYNC`` off they are written in the flushing
+thread instead.
+
+Models registered with ``register()`` are logged on every save and delete.
+Bulk operations log one summary entry with ``record_batch()``, and
+``suppressed()`` turns off per-object entries for code that saves objects
+one by one but is summarized as a whole.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import AuditLog
+
+logger = logging.getLogger(__name__)
+
+registry = {}
+
+
+class AuditBuffer:
+    """Entries waiting to be written, flushed by size or age."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.started = None
+
+    def add(self, entry):
+        with self.lock:
+            if not self.entries:
+                self.started = time.monotonic()
+            self.entries.append(entry)
+            due = (
+                len(self.entries) >= settings.AUDIT_BUFFER_SIZE
+                or time.monotonic() - self.started >= settings.AUDIT_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            entries, self.entries = self.entries, []
+        if entries:
+            writer.submit(entries)
+
+
+class AuditWriter:
+    """Writes flushed entries from a background thread."""
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def submit(self, entries):
+        if not settings.AUDIT_ASYNC:
+            self.write(entries)
+            return
+        self.ensure_thread()
+        self.queue.put(entries)
+
+    def ensure_thread(self):
+        # Forked processes (e.g. Celery workers) need their own thread
+        if self.pid == os.getpid() and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pid != os.getpid() or not self.thread.is_alive():
+                self.queue = queue.Queue()
+                self.thread = threading.Thread(target=self.run, name='audit-writer', daemon=True)
+                self.thread.start()
+                self.pid = os.getpid()
+
+    def run(self):
+        while True:
+            entries = self.queue.get()
+            # Coalesce whatever else is waiting into one insert
+            done = 1
+            while len(entries) < 1000:
+                try:
+                    entries = entries + self.queue.get_nowait()
+                    done += 1
+                except queue.Empty:
+                    break
+            close_old_connections()
+            self.write(entries)
+            for _ in range(done):
+                self.queue.task_done()
+
+    def write(self, entries):
+        try:
+            AuditLog.objects.bulk_create(entries, batch_size=500)
+        except Exception:
+            # Auditing must never break the code being audited
+            logger.exception("Could not write %d audit log entries", len(entries))
+
+    def wait(self):
+        """Block until everything submitted so far is written."""
+        if self.thread is not None and self.pid == os.getpid() and self.thread.is_alive():
+            self.queue.join()
+
+
+writer = AuditWriter()
+process_buffer = AuditBuffer()
+
+# {'buffer', 'request', 'suppressed'} for the current request or task
+_context = ContextVar('audit_context', default=None)
+
+
+@contextmanager
+def buffered(request=None):
+    """Collect the entries recorded inside the block and flush them at its end."""
+    token = _context.set({'buffer': AuditBuffer(), 'request': request, 'suppressed': False})
+    try:
+        yield
+    finally:
+        context = _context.get()
+        _context.reset(token)
+        context['buffer'].flush()
+
+
+@contextmanager
+def suppressed():
+    """Skip the per-object entries of registered models inside the block."""
+    context = _context.get()
+    if context is None:
+        token = _context.set({'buffer': process_buffer, 'request': None, 'suppressed': True})
+    else:
+        token = _context.set(dict(context, suppressed=True))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def request_user_and_ip(context):
+    request = context and context['request']
+    if request is None:
+        return None, None
+    user = getattr(request, 'user', None)
+    return (user if user is not None and user.is_authenticated else None), request.META.get('REMOTE_ADDR')
+
+
+def record(action, model_name='', object_id='', object_repr='', details=None, user=None):
+    """Log an action, after commit when inside a transaction."""
+    context = _context.get()
+    request_user, ip_address = request_user_and_ip(context)
+    entry = AuditLog(
+        user=user or request_user,
+        action=action,
+        model_name=model_name,
+        object_id=str(object_id),
+        object_repr=str(object_repr)[:200],
+        action_details=details,
+        ip_address=ip_address,
+    )
+    buffer = context['buffer'] if context else process_buffer
+    transaction.on_commit(lambda: buffer.add(entry))
+
+
+def record_batch(action, model, count, details=None, user=None):
+    """Log one entry summarizing a bulk operation on ``count`` objects."""
+    if not count:
+        return
+    record(
+        action,
+        model_name=model._meta.label,
+        object_repr=f"{count} {model._meta.verbose_name_plural}",
+        details=dict(details or {}, count=count),
+        user=user,
+    )
+
+
+def register(model, repr=str, ignore_fields=()):
+    """Log saves and deletes of a model.
+
+    ``repr`` is an attribute name or a callable giving the logged object
+    description; avoid ones that load related objects. Saves updating only
+    ``ignore_fields`` are not logged.
+    """
+    registry[model] = (
+        (lambda obj: getattr(obj, repr)) if isinstance(repr, str) else repr,
+        frozenset(ignore_fields),
+    )
+    uid = f'audit-{model._meta.label_lower}'
+    post_save.connect(log_save, sender=model, dispatch_uid=uid)
+    post_delete.connect(log_delete, sender=model, dispatch_uid=uid)
+
+
+def is_suppressed():
+    context = _context.get()
+    return bool(context and context['suppressed'])
+
+
+def log_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    describe, ignore_fields = registry[sender]
+    if raw or is_suppressed() or (update_fields and update_fields <= ignore_fields):
+        return
+    record(
+        'create' if created else 'update',
+        model_name=sender._meta.label,
+        object_id=instance.pk,
+        object_repr=describe(instance),
+        details={'fields': sorted(update_fields)} if update_fields else None,
+    )
+
+
+def log_delete(sender, instance, **kwargs):
+    if is_suppressed():
+        return
+    record('delete', model_name=sender._meta.label, object_id=instance.pk, object_repr=registry[sender][0](instance))
+
+
+def log_login(sender, request, user, **kwargs):
+    record('login', model_name='auth.User', object_id=user.pk, object_repr=user.get_username(), user=user)
+
+
+def log_logout(sender, request, user, **kwargs):
+    if user is not None:
+        record('logout', model_name='auth.User', object_id=user.pk, object_repr=user.get_username(), user=user)
+
+
+# Celery runs each task start to end in one thread, so the buffer can live
+# in a contextvar token kept per task id
+_task_tokens = {}
+
+
+def start_task_buffer(task_id=None, **kwargs):
+    _task_tokens[task_id] = _context.set({'buffer': AuditBuffer(), 'request': None, 'suppressed': False})
+
+
+def flush_task_buffer(task_id=None, **kwargs):
+    token = _task_tokens.pop(task_id, None)
+    if token is None:
+        return
+    buffer = _context.get()['buffer']
+    _context.reset(token)
+    buffer.flush()
+
+
+def flush_at_exit():
+    process_buffer.flush()
+    writer.wait()
+
+
+def connect_signals():
+    user_logged_in.connect(log_login, dispatch_uid='audit-login')
+    user_logged_out.connect(log_logout, dispatch_uid='audit-logout')
+    task_prerun.connect(start_task_buffer, dispatch_uid='audit-task-start', weak=False)
+    task_postrun.connect(flush_task_buffer, dispatch_uid='audit-task-end', weak=False)
+    atexit.register(flush_at_exit)
+
@@ -0,0 +1,173 @@
+"""
+Admin changelists for very large tables.
+
+``LargeTableAdminMixin`` keeps a changelist's cost independent of the size
+of its table:
+
+* counts are exact only up to ``COUNT_LIMIT`` rows; an unfiltered table
+  larger than that is counted from PostgreSQL's planner statistics, and a
+  filtered one is shown as "more than" the limit;
+* with ``keyset`` set, e.g. ``('check_time', 'id')``, the default ordering
+  is paged by that key (see ``core.keyset``) instead of OFFSET; sorting by
+  a column falls back to numbered pages;
+* ``AutocompleteFilter`` filters by a foreign key picked with the admin's
+  autocomplete widget instead of listing every related object.
+
+Use a date ``list_filter`` rather than ``date_hierarchy``, which scans the
+table for distinct dates on every page.
+
+    class MonitoringResultAdmin(LargeTableAdminMixin, admin.ModelAdmin):
+        keyset = ('check_time', 'id')
+        list_filter = ('check_time', ('device', AutocompleteFilter))
+"""
+from functools import cached_property
+
+from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.views.main import ORDER_VAR, ChangeList
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.translation import gettext_lazy as _
+
+from .keyset import decode_cursor, encode_cursor, keyset_page
+
+CURSOR_VAR = 'cursor'
+# Rows counted exactly before a changelist settles for an estimate
+COUNT_LIMIT = 10000
+
+
+def estimated_count(queryset, limit=COUNT_LIMIT):
+    """Count a queryset exactly up to ``limit`` rows.
+
+    Larger unfiltered tables are counted from planner statistics on
+    PostgreSQL; otherwise ``limit + 1`` stands for "more than ``limit``".
+    """
+    connection = connections[queryset.db]
+    if not queryset.query.where and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 (or 0) until the table was first analyzed
+        if row and row[0] > limit:
+            return row[0]
+    return queryset.order_by()[:limit + 1].count()
+
+
+def count_label(count, limit=COUNT_LIMIT):
+    if count <= limit:
+        return f"{count:,}"
+    if count == limit + 1:
+        return _("more than %s") % f"{limit:,}"
+    return _("about %s") % f"{count:,}"
+
+
+class EstimatedCountPaginator(Paginator):
+    @cached_property
+    def count(self):
+        return estimated_count(self.object_list)
+
+
+class LargeTableChangeList(ChangeList):
+    """Changelist with estimated counts, keyset paged in its default order."""
+
+    def __init__(self, request, *args, **kwargs):
+        self.cursor = request.GET.get(CURSOR_VAR)
+        super().__init__(request, *args, **kwargs)
+        # Like the page number, filter and sort links start over
+        self.params.pop(CURSOR_VAR, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_results(self, request):
+        self.next_url = self.first_url = None
+        keyset = self.model_admin.keyset
+        if not keyset or ORDER_VAR in self.params:
+            super().get_results(request)
+            self.page_range = (
+                list(self.paginator.get_elided_page_range(self.page_num)) if self.multi_page else []
+            )
+            self.count_label = count_label(self.result_count)
+            return
+
+        position = None
+        if self.cursor:
+            try:
+                position = decode_cursor(self.cursor, self.model, keyset)
+            except ValueError:
+                raise IncorrectLookupParameters
+        self.result_list, next_position = keyset_page(self.queryset, keyset, position, self.list_per_page)
+        if next_position is not None:
+            self.next_url = self.get_query_string({CURSOR_VAR: encode_cursor(next_position)})
+        if position is not None:
+            self.first_url = self.get_query_string(remove=[CURSOR_VAR])
+
+        self.paginator = self.model_admin.get_paginator(request, self.queryset, self.list_per_page)
+        self.result_count = self.paginator.count
+        self.count_label = count_label(self.result_count)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = self.next_url is not None or position is not None
+        self.page_range = []
+
+
+class AutocompleteFilter(admin.FieldListFilter):
+    """Filter by one related object chosen with the autocomplete widget.
+
+    Only the selected object is loaded. The related model's admin needs
+    ``search_fields``.
+    """
+    template = 'admin/autocomplete_filter.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.lookup_kwarg = f'{field_path}__{field.target_field.name}__exact'
+        self.lookup_val = params.get(self.lookup_kwarg)
+        self.admin_site = model_admin.admin_site
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def expected_parameters(self):
+        return [self.lookup_kwarg]
+
+    def choices(self, changelist):
+        # The template posts the chosen id onto this query string
+        self.query_string = changelist.get_query_string(remove=[self.lookup_kwarg])
+        yield {
+            'selected': self.lookup_val is None,
+            'query_string': self.query_string,
+            'display': _('All'),
+        }
+
+    def widget(self):
+        formfield = self.field.formfield(widget=AutocompleteSelect(self.field, self.admin_site), required=False)
+        return formfield.widget.render(
+            self.lookup_kwarg, self.lookup_val, attrs={'id': f'filter-{self.lookup_kwarg}', 'style': 'width: 100%'},
+        )
+
+
+class LargeTableAdminMixin:
+    """ModelAdmin mixin for tables too large to count, OFFSET or list in full."""
+    keyset = None
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    change_list_template = 'admin/large_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return LargeTableChangeList
+
+    @property
+    def media(self):
+        media = super().media
+        for list_filter in self.list_filter:
+            if isinstance(list_filter, (tuple, list)) and issubclass(list_filter[1], AutocompleteFilter):
+                field = get_fields_from_path(self.model, list_filter[0])[-1]
+                return media + AutocompleteSelect(field, self.admin_site).media
+        return media
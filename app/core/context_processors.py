@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .notifications import unread_count
+
+
+def notifications(request):
+    """Add the user's unread notification count, looked up only if a template uses it."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return {}
+    return {'unread_notification_count': SimpleLazyObject(lambda: unread_count(user))}
@@ -0,0 +1,272 @@
+"""
+Resized variants of uploaded images.
+
+Image fields are registered with ``register()``. Saving an instance with a
+new upload records a pending ``ImageAsset`` and queues processing, so the
+request never waits for Pillow. Processing runs in a process pool (or in
+the Celery worker's own process) and writes a WebP and a JPEG variant for
+each width in ``IMAGE_VARIANT_WIDTHS`` up to the original's width; images
+with transparency get a PNG fallback instead of JPEG. Variants are
+re-encoded from pixel data, which drops EXIF and other metadata after the
+orientation has been applied.
+
+Variant names are derived from the hash of the original's content, so an
+image uploaded several times is only processed once: variants that already
+exist in storage are reused.
+
+Templates pick a variant with the ``picture`` and ``image_variant`` tags
+from the ``images`` tag library.
+"""
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageAsset
+
+FORMATS = {
+    'WEBP': ('webp', 'image/webp'),
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+}
+INFO_TIMEOUT = 24 * 60 * 60
+# Images still being processed are looked up again after this long
+PENDING_TIMEOUT = 60
+# Claimed images not finished after this long were left by a crashed worker
+STALE_AFTER = timedelta(minutes=30)
+
+registry = {}
+
+
+def register(model, *fields):
+    """Generate variants for the given image fields of a model whenever it is saved."""
+    registry[model] = fields
+    post_save.connect(queue_instance_images, sender=model, dispatch_uid=f'images-{model._meta.label_lower}')
+
+
+def queue_instance_images(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    queue_images([getattr(instance, field).name for field in registry[sender] if getattr(instance, field)])
+
+
+def queue_images(names):
+    """Record images without variants yet and queue their processing."""
+    known = set(ImageAsset.objects.filter(name__in=names).values_list('name', flat=True))
+    new = [ImageAsset(name=name) for name in dict.fromkeys(names) if name not in known]
+    if not new:
+        return 0
+    ImageAsset.objects.bulk_create(new, ignore_conflicts=True)
+    from .tasks import schedule_image_processing
+    transaction.on_commit(schedule_image_processing)
+    return len(new)
+
+
+def variant_name(source_hash, width, extension):
+    return f'{settings.IMAGE_VARIANTS_DIR}/{source_hash[:2]}/{source_hash[:24]}-{width}.{extension}'
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def variant_widths(width):
+    """Widths to generate for an original of the given width, never upscaling."""
+    widths = [w for w in settings.IMAGE_VARIANT_WIDTHS if w < width]
+    widths.append(min(width, max(settings.IMAGE_VARIANT_WIDTHS)))
+    return sorted(set(widths))
+
+
+def encode(image, image_format):
+    buffer = BytesIO()
+    options = {'quality': settings.IMAGE_VARIANT_QUALITY} if image_format in ('WEBP', 'JPEG') else {'optimize': True}
+    if image_format == 'JPEG':
+        options['progressive'] = True
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def process_image(job):
+    """Generate the variants of one original.
+
+    Takes and returns plain dicts, so it can run in a process pool without
+    database access.
+    """
+    result = {'id': job['id'], 'status': 'failed', 'source_hash': '', 'width': None, 'height': None, 'variants': [], 'error': ''}
+    try:
+        with default_storage.open(job['name'], 'rb') as f:
+            data = f.read()
+        result['source_hash'] = source_hash = hashlib.sha256(data).hexdigest()
+
+        with Image.open(BytesIO(data)) as original:
+            image = ImageOps.exif_transpose(original)
+            fallback = 'PNG' if has_alpha(image) else 'JPEG'
+            image = image.convert('RGBA' if fallback == 'PNG' else 'RGB')
+        result['width'], result['height'] = width, height = image.size
+
+        for target in variant_widths(width):
+            resized = None
+            for image_format in ('WEBP', fallback):
+                extension, content_type = FORMATS[image_format]
+                name = variant_name(source_hash, target, extension)
+                # Named after the original's content, so an existing file is
+                # the same image uploaded before
+                if not default_storage.exists(name):
+                    if resized is None:
+                        resized = image if target == width else image.resize(
+                            (target, max(1, round(height * target / width))), Image.LANCZOS
+                        )
+                    name = default_storage.save(name, ContentFile(encode(resized, image_format)))
+                result['variants'].append({'width': target, 'type': content_type, 'name': name})
+        result['status'] = 'ready'
+    except Exception as exc:
+        # Corrupt files make Pillow raise nearly anything (SyntaxError,
+        # struct.error, IndexError...); only this image fails
+        result['error'] = str(exc) or type(exc).__name__
+    return result
+
+
+def process_images(jobs, processes=None, chunksize=4):
+    """Process images, in parallel when asked.
+
+    ``processes`` of 0 or 1 processes in the calling process, which is what
+    Celery workers need since their processes may not start children.
+    """
+    if processes is not None and processes <= 1:
+        return [process_image(job) for job in jobs]
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(process_image, jobs, chunksize=chunksize))
+
+
+def release_stale():
+    """Return images left processing by a crashed worker to the queue.
+
+    Processing again is safe: variants already written are reused.
+    """
+    return ImageAsset.objects.filter(
+        status='processing', updated_at__lt=timezone.now() - STALE_AFTER
+    ).update(status='pending', updated_at=timezone.now())
+
+
+def claim(batch_size):
+    """Mark a batch of pending images as processing and return their jobs."""
+    with transaction.atomic():
+        jobs = list(
+            ImageAsset.objects.filter(status='pending')
+            .select_for_update(skip_locked=True)
+            .order_by('id').values('id', 'name')[:batch_size]
+        )
+        ImageAsset.objects.filter(id__in=[job['id'] for job in jobs]).update(
+            status='processing', updated_at=timezone.now()
+        )
+    return jobs
+
+
+def process_pending(batch_size=50, processes=None):
+    """Process pending images in batches and return counts of ready and failed ones.
+
+    Batches are claimed, so several workers can run at once without
+    processing an image twice.
+    """
+    release_stale()
+    counts = {'ready': 0, 'failed': 0}
+    while True:
+        jobs = claim(batch_size)
+        if not jobs:
+            return counts
+
+        results = process_images(jobs, processes=processes)
+        assets = []
+        for result in results:
+            assets.append(ImageAsset(**result))
+            counts[result['status']] += 1
+        ImageAsset.objects.bulk_update(assets, ['status', 'source_hash', 'width', 'height', 'variants', 'error'])
+        cache.delete_many([info_key(job['name']) for job in jobs])
+
+
+def info_key(name):
+    return f"images:asset:{hashlib.sha1(name.encode()).hexdigest()}"
+
+
+def image_info(name):
+    """Return ``{'width', 'height', 'variants'}`` for an original, or None while it has no variants."""
+    key = info_key(name)
+    info = cache.get(key)
+    if info is None:
+        asset = ImageAsset.objects.filter(name=name, status='ready').values('width', 'height', 'variants').first()
+        info = asset or {}
+        cache.set(key, info, INFO_TIMEOUT if asset else PENDING_TIMEOUT)
+    return info or None
+
+
+def srcset(variants, content_type):
+    return ', '.join(
+        f"{default_storage.url(variant['name'])} {variant['width']}w"
+        for variant in variants if variant['type'] == content_type
+    )
+
+
+def best_variant(variants, width, content_type=None):
+    """The smallest variant at least ``width`` wide, or the largest there is."""
+    candidates = [v for v in variants if content_type is None or v['type'] == content_type]
+    if not candidates:
+        return None
+    wide_enough = [v for v in candidates if v['width'] >= width]
+    return min(wide_enough, key=lambda v: v['width']) if wide_enough else max(candidates, key=lambda v: v['width'])
+
+
+def fallback_type(variants):
+    types = {variant['type'] for variant in variants}
+    return 'image/png' if 'image/png' in types else 'image/jpeg'
+
+
+def variant_url(image, width):
+    """URL of the fallback-format variant best suited to ``width``, or of the original."""
+    if not image:
+        return ''
+    info = image_info(image.name)
+    if info:
+        variant = best_variant(info['variants'], width, fallback_type(info['variants']))
+        if variant:
+            return default_storage.url(variant['name'])
+    return image.url
+
+
+def picture_context(image, width=None):
+    """Context for rendering ``image`` as a ``<picture>`` element."""
+    if not image:
+        return {}
+    info = image_info(image.name)
+    if not info:
+        # Not processed yet; serve the original
+        return {'src': image.url}
+    variants = info['variants']
+    fallback = fallback_type(variants)
+    default = best_variant(variants, width or info['width'], fallback)
+    return {
+        'src': default_storage.url(default['name']),
+        'webp_srcset': srcset(variants, 'image/webp'),
+        'srcset': srcset(variants, fallback),
+        'width': info['width'],
+        'height': info['height'],
+    }
+
+
+def registered_images():
+    """Yield the storage names of every image in registered fields."""
+    for model, fields in registry.items():
+        for field in fields:
+            yield from model.objects.exclude(**{field: ''}).values_list(field, flat=True).iterator()
+
@@ -0,0 +1,54 @@
+"""
+Keyset pagination helpers shared by the API and the admin.
+
+Rows are paged newest first by a unique key such as ``(check_time, id)``;
+each page continues below the key of the previous page's last row, which
+an index on the key turns into a range scan however deep the page is.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def keyset_before(fields, position):
+    """Rows sorting after ``position`` when ordered by ``fields`` descending.
+
+    Written as ``a <= x AND (a < x OR b < y)`` rather than a plain OR, so
+    the database can seek the index on the leading column.
+    """
+    (field, *fields), (value, *values) = fields, position
+    if not fields:
+        return Q(**{f'{field}__lt': value})
+    return Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | keyset_before(fields, values))
+
+
+def keyset_page(queryset, fields, position, size):
+    """Return a page of ``size`` rows below ``position`` (None for the first page) and the next position."""
+    queryset = queryset.order_by(*[f'-{field}' for field in fields])
+    if position is not None:
+        queryset = queryset.filter(keyset_before(fields, position))
+    # One row more than the page tells whether there is a next page
+    rows = list(queryset[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    rows = rows[:size]
+    return rows, [getattr(rows[-1], field) for field in fields]
+
+
+def encode_cursor(position):
+    # str() keeps the microseconds DjangoJSONEncoder would round away
+    return base64.urlsafe_b64encode(json.dumps(position, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, model, fields):
+    """The position in a cursor; raises ValueError if it is not valid for ``fields``."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        # Key columns are not nullable, and a None would compare as NULL
+        if not isinstance(values, list) or len(values) != len(fields) or None in values:
+            raise ValueError(cursor)
+        return [model._meta.get_field(field).to_python(value) for field, value in zip(fields, values)]
+    except (TypeError, ValidationError, UnicodeError) as exc:
+        raise ValueError(cursor) from exc
@@ -0,0 +1,181 @@
+"""
+Bulk email from ``EmailTemplate``s.
+
+Templates are compiled once per process and version (their ``updated_at``)
+and rendered in batches with autoescaping off, since the messages are plain
+text. ``BulkMailer`` sends messages from a few threads sharing a pool of
+open SMTP connections, each reused for up to
+``EMAIL_MESSAGES_PER_CONNECTION`` messages, throttled to
+``EMAIL_SEND_RATE`` messages per second. A dropped connection is reopened
+and the message retried once. Every other failure is reported per message
+instead of aborting the batch.
+
+Run ``python manage.py fake_smtp`` and point ``EMAIL_HOST``/``EMAIL_PORT``
+at it to watch the messages go out.
+"""
+import logging
+import queue
+import smtplib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.template import Context, Template
+
+from .models import EmailTemplate
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+# Errors meaning the connection, not the message, is at fault
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+def compile_template(email_template):
+    """Return compiled ``(subject, body)`` templates, parsing each version once."""
+    key = (email_template.pk, email_template.updated_at)
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = (Template(email_template.subject), Template(email_template.content))
+        with _compiled_lock:
+            for stale in [k for k in _compiled if k[0] == email_template.pk]:
+                del _compiled[stale]
+            _compiled[key] = compiled
+    return compiled
+
+
+def get_email_template(name):
+    """Return the active EmailTemplate with this name; raises DoesNotExist if there is none."""
+    return EmailTemplate.objects.get(name=name, is_active=True)
+
+
+def render_message(compiled, to, context, **kwargs):
+    """Render one EmailMessage to ``to`` from compiled templates."""
+    subject, body = compiled
+    context = Context(context, autoescape=False)
+    return EmailMessage(
+        subject=' '.join(subject.render(context).split()),
+        body=body.render(context),
+        to=[to] if isinstance(to, str) else list(to),
+        **kwargs,
+    )
+
+
+def render_batches(compiled, recipients, batch_size=500, **kwargs):
+    """Yield lists of messages for an iterable of ``(to, context)`` pairs."""
+    recipients = iter(recipients)
+    while batch := list(islice(recipients, batch_size)):
+        yield [render_message(compiled, to, context, **kwargs) for to, context in batch]
+
+
+class BulkMailer:
+    """Send messages concurrently over a pool of reused SMTP connections."""
+
+    def __init__(self, connections=None, rate=None, messages_per_connection=None):
+        self.size = connections or settings.EMAIL_POOL_SIZE
+        rate = settings.EMAIL_SEND_RATE if rate is None else rate
+        self.bucket = TokenBucket(rate) if rate else None
+        self.messages_per_connection = messages_per_connection or settings.EMAIL_MESSAGES_PER_CONNECTION
+        self.idle = queue.LifoQueue()
+        self.sent_on = {}
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+            self.sent_on[connection] = 0
+            return connection
+
+    def checkin(self, connection):
+        if self.sent_on[connection] >= self.messages_per_connection:
+            # Servers limit messages per session; start a new one
+            self.discard(connection)
+        else:
+            self.idle.put(connection)
+
+    def discard(self, connection):
+        self.sent_on.pop(connection, None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def send_one(self, message):
+        """Send one message and return None, or the error that stopped it."""
+        if self.bucket:
+            self.bucket.acquire()
+        try:
+            connection = self.checkout()
+        except (smtplib.SMTPException, OSError) as exc:
+            return str(exc)
+        for attempt in (1, 2):
+            try:
+                connection.send_messages([message])
+            except CONNECTION_ERRORS as exc:
+                self.discard(connection)
+                if attempt == 2:
+                    return str(exc)
+                try:
+                    connection = self.checkout()
+                except (smtplib.SMTPException, OSError) as exc:
+                    return str(exc)
+            except (smtplib.SMTPException, OSError, ValueError) as exc:
+                self.sent_on[connection] += 1
+                self.checkin(connection)
+                return str(exc)
+            else:
+                self.sent_on[connection] += 1
+                self.checkin(connection)
+                return None
+
+    def send(self, messages):
+        """Send messages, returning ``{'sent': n, 'failures': [{'to': [...], 'error': ...}]}``."""
+        report = {'sent': 0, 'failures': []}
+        if not messages:
+            return report
+        with ThreadPoolExecutor(max_workers=min(self.size, len(messages))) as executor:
+            for message, error in zip(messages, executor.map(self.send_one, messages)):
+                if error is None:
+                    report['sent'] += 1
+                else:
+                    logger.warning("Could not send email to %s: %s", ', '.join(message.to), error)
+                    report['failures'].append({'to': message.to, 'error': error})
+        return report
+
+    def close(self):
+        while True:
+            try:
+                self.discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def send_template(email_template, recipients, batch_size=500, mailer=None, **kwargs):
+    """Render and send an EmailTemplate (or its name) to ``(to, context)`` pairs.
+
+    Messages are rendered and sent a batch at a time. Returns the combined
+    report of ``BulkMailer.send()``.
+    """
+    if isinstance(email_template, str):
+        email_template = get_email_template(email_template)
+    compiled = compile_template(email_template)
+    report = {'sent': 0, 'failures': []}
+    with (mailer or BulkMailer()) as mailer:
+        for messages in render_batches(compiled, recipients, batch_size, **kwargs):
+            batch = mailer.send(messages)
+            report['sent'] += batch['sent']
+            report['failures'].extend(batch['failures'])
+    return report
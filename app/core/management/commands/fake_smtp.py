@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from core.smtp_fake import FakeSMTPServer
+
+
+class Command(BaseCommand):
+    help = "Run a local SMTP stand-in that prints the messages it receives"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--reject', action='append', default=[], help="Refuse recipients containing this text")
+
+    def handle(self, *args, **options):
+        server = FakeSMTPServer((options['host'], options['port']), reject=options['reject'], verbose=True)
+        self.stdout.write(
+            f"Fake SMTP server listening on {server.host}:{server.port}, set EMAIL_HOST and EMAIL_PORT to use it"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core import images
+
+
+class Command(BaseCommand):
+    help = "Generate resized variants of uploaded images that have none yet"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None, help="Worker processes (default: one per CPU)")
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        # Images uploaded before variants were generated
+        names = list(images.registered_images())
+        queued = images.queue_images(names) if names else 0
+        counts = images.process_pending(batch_size=options['batch_size'], processes=options['processes'])
+        self.stdout.write(f"{queued} images queued, {counts['ready']} processed, {counts['failed']} failed")
@@ -0,0 +1,27 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = "Rebuild search documents for all or some registered models"
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help="Model labels such as clients.Client (default: all)")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        models = list(search.registry)
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as exc:
+                raise CommandError(exc)
+            unregistered = [model._meta.label for model in models if model not in search.registry]
+            if unregistered:
+                raise CommandError(f"Not searchable: {', '.join(unregistered)}")
+
+        for model in models:
+            count = search.reindex(model, batch_size=options['batch_size'])
+            self.stdout.write(f"{model._meta.label}: {count} documents")
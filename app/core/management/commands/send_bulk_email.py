@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from clients.models import Contact
+from core import mail
+from core.models import EmailTemplate
+
+
+class Command(BaseCommand):
+    help = "Send an email template to client contacts; the template sees 'contact' and 'client'"
+
+    def add_arguments(self, parser):
+        parser.add_argument('template', help="EmailTemplate name")
+        parser.add_argument('--client', action='append', default=[], help="Only contacts of clients with this slug")
+        parser.add_argument('--primary', action='store_true', help="Only primary contacts")
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            template = mail.get_email_template(options['template'])
+        except EmailTemplate.DoesNotExist:
+            raise CommandError(f"No active email template named '{options['template']}'")
+
+        contacts = Contact.objects.select_related('client').exclude(email='').filter(client__is_active=True)
+        if options['client']:
+            contacts = contacts.filter(client__slug__in=options['client'])
+        if options['primary']:
+            contacts = contacts.filter(is_primary=True)
+        recipients = (
+            (contact.email, {'contact': contact, 'client': contact.client})
+            for contact in contacts.order_by('pk').iterator(chunk_size=options['batch_size'])
+        )
+
+        report = mail.send_template(template, recipients, batch_size=options['batch_size'])
+        for failure in report['failures']:
+            self.stderr.write(f"{', '.join(failure['to'])}: {failure['error']}")
+        self.stdout.write(f"{report['sent']} sent, {len(report['failures'])} failed")
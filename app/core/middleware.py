@@ -0,0 +1,12 @@
+from .audit import buffered
+
+
+class AuditMiddleware:
+    """Buffer the audit entries of a request and write them when it ends."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with buffered(request):
+            return self.get_response(request)
@@ -1,5 +1,7 @@
-from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models
 
 
 class UserProfile(models.Model):
@@ -32,6 +34,11 @@ class Notification(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Serves both the unread count and a user's listing, newest first
+            models.Index(fields=['user', 'is_read', '-created_at']),
+            models.Index(fields=['created_at', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.title} ({self.user.username})"
@@ -59,6 +66,9 @@ class AuditLog(models.Model):
     
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['timestamp', 'id']),
+        ]
     
     def __str__(self):
         return f"{self.action} by {self.user} at {self.timestamp}"
@@ -86,3 +96,52 @@ class SystemSetting(models.Model):
     
     def __str__(self):
         return self.key
+
+
+class SearchDocument(models.Model):
+    """Searchable text of one registered object, maintained by core.search."""
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.BigIntegerField()
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    # Filled by a database trigger on PostgreSQL and unused elsewhere
+    search_vector = SearchVectorField(null=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='core_searchdocument_unique_object'),
+        ]
+    
+    def __str__(self):
+        return self.title
+
+
+class ImageAsset(models.Model):
+    """Resized variants of one uploaded image, generated by core.images."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    
+    # Storage name of the uploaded original
+    name = models.CharField(max_length=255, unique=True)
+    source_hash = models.CharField(max_length=64, blank=True, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    # [{'width': ..., 'type': 'image/webp', 'name': ...}, ...]
+    variants = models.JSONField(default=list, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'id']),
+        ]
+    
+    def __str__(self):
+        return self.name
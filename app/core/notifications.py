@@ -0,0 +1,148 @@
+"""
+Notification delivery and per-user unread counters.
+
+Notifications for many users are inserted with ``bulk_create`` and marked
+read with a single ``UPDATE``. Each user's unread count is kept in the
+cache (Redis in production) and adjusted with atomic increments when
+notifications are sent or read, so showing the unread badge needs no
+query. A missing counter is rebuilt from the database on the next read;
+counters also expire daily, which bounds any drift from races with a
+rebuild. Changes made outside this module (admin edits, deletes) drop the
+counter through signals.
+
+New notifications are also pushed to their users' browsers (``core.push``).
+"""
+from django.contrib.auth.models import User
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import transaction
+
+from . import push
+from .models import Notification
+
+COUNTER_TIMEOUT = 24 * 60 * 60
+# Counters adjusted per script call, so Redis is not blocked for long
+COUNTER_BATCH_SIZE = 1000
+
+# Increments the counters that exist by the matching delta and drops those
+# that went negative, i.e. out of step with the database
+ADJUST_COUNTERS_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    if redis.call('EXISTS', key) == 1 and redis.call('INCRBY', key, ARGV[i]) < 0 then
+        redis.call('DEL', key)
+    end
+end
+"""
+
+
+def counter_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def adjust_counters(deltas):
+    """Apply ``{user id: delta}`` to the counters that exist; missing ones are rebuilt on read.
+
+    On Redis all counters are adjusted in one pipelined round trip instead of
+    two per user. A script does each batch, since a plain INCRBY would
+    create the missing counters.
+    """
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    if isinstance(backend, RedisCache):
+        deltas = list(deltas.items())
+        client = backend._cache.get_client(write=True)
+        script = client.register_script(ADJUST_COUNTERS_SCRIPT)
+        pipeline = client.pipeline(transaction=False)
+        for start in range(0, len(deltas), COUNTER_BATCH_SIZE):
+            batch = deltas[start:start + COUNTER_BATCH_SIZE]
+            script(
+                keys=[backend.make_and_validate_key(counter_key(user_id)) for user_id, _ in batch],
+                args=[delta for _, delta in batch],
+                client=pipeline,
+            )
+        pipeline.execute()
+        return
+
+    for user_id, delta in deltas.items():
+        key = counter_key(user_id)
+        try:
+            value = cache.incr(key, delta)
+        except ValueError:
+            continue
+        if value < 0:
+            # Out of step with the database; rebuild on the next read
+            cache.delete(key)
+
+
+def invalidate_counters(user_ids):
+    cache.delete_many([counter_key(user_id) for user_id in user_ids])
+
+
+def unread_count(user):
+    """Return a user's number of unread notifications, from the cache when possible."""
+    user_id = getattr(user, 'pk', user)
+    key = counter_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        # add() so a counter adjusted meanwhile is not overwritten
+        if not cache.add(key, count, COUNTER_TIMEOUT):
+            count = cache.get(key, count)
+    return count
+
+
+def notify(users, title, message, type='info', link='', batch_size=1000):
+    """Send one notification to each of ``users`` (users or ids) and return how many were sent."""
+    user_ids = list(dict.fromkeys(getattr(user, 'pk', user) for user in users))
+    notifications = [
+        Notification(user_id=user_id, title=title, message=message, type=type, link=link)
+        for user_id in user_ids
+    ]
+    Notification.objects.bulk_create(notifications, batch_size=batch_size)
+    transaction.on_commit(lambda: adjust_counters(dict.fromkeys(user_ids, 1)))
+    push.publish_on_commit([
+        ([push.user_channel(user_id) for user_id in user_ids], 'notification', notification_event(notifications[0]))
+    ] if notifications else [])
+    return len(notifications)
+
+
+def notification_event(notification):
+    return {
+        'title': notification.title,
+        'message': notification.message,
+        'type': notification.type,
+        'link': notification.link,
+    }
+
+
+def notify_staff(title, message, type='info', link=''):
+    """Send a notification to every active staff user."""
+    user_ids = User.objects.filter(is_staff=True, is_active=True).values_list('id', flat=True)
+    return notify(user_ids, title, message, type=type, link=link)
+
+
+def unread_notifications(user):
+    """A user's unread notifications, newest first."""
+    return Notification.objects.filter(user=user, is_read=False).order_by('-created_at')
+
+
+def mark_read(user, ids=None):
+    """Mark a user's notifications read, all of them unless ``ids`` is given.
+
+    Returns the number of notifications that were unread.
+    """
+    notifications = Notification.objects.filter(user=user, is_read=False)
+    if ids is not None:
+        notifications = notifications.filter(id__in=ids)
+    count = notifications.update(is_read=True)
+    if count:
+        transaction.on_commit(lambda: adjust_counters({user.pk: -count}))
+    return count
+
+
+def mark_read_in_bulk(queryset):
+    """Mark the notifications in a queryset read, whatever their users, with one UPDATE."""
+    unread = queryset.filter(is_read=False)
+    user_ids = set(unread.values_list('user_id', flat=True).distinct())
+    count = unread.update(is_read=True)
+    transaction.on_commit(lambda: invalidate_counters(user_ids))
+    return count
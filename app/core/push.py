@@ -0,0 +1,274 @@
+"""
+Live updates pushed to browsers with server-sent events.
+
+Code that changes something a dashboard shows publishes an event to Redis
+pub/sub after commit: alert changes and device state changes go to the
+staff channel and the device's client channel, notifications to the
+recipient's user channel. Events are published already formatted as SSE,
+so serving them costs no work per connection.
+
+``PushApplication`` wraps the Django ASGI application and answers
+``PUSH_PATH`` itself, without going through Django's request handling. Each
+process keeps one Redis connection (``PushHub``) subscribed to the channels
+its browsers need and fans messages out to per-connection queues, so idle
+connections cost a queue and two tasks each. Staff receive every alert and
+device event, or only those of the clients given as ``?client=1,2``; every
+user receives their own notifications. Browsers that fall too far behind
+are disconnected and reconnect on their own.
+
+    const events = new EventSource('/events/');
+    events.addEventListener('alert', (e) => console.log(JSON.parse(e.data)));
+"""
+import asyncio
+import json
+import logging
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+import redis
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+STAFF_CHANNEL = 'push:staff'
+# Messages waiting for a slow browser before it is disconnected
+QUEUE_SIZE = 100
+
+_client = None
+
+
+def user_channel(user_id):
+    return f'push:user:{user_id}'
+
+
+def client_channel(client_id):
+    return f'push:client:{client_id}'
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def redis_client():
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.PUSH_REDIS_URL)
+    return _client
+
+
+def publish(messages):
+    """Publish ``(channels, event, data)`` messages; pushing is best effort."""
+    try:
+        pipeline = redis_client().pipeline(transaction=False)
+        for channels, event, data in messages:
+            payload = format_event(event, data)
+            for channel in channels:
+                pipeline.publish(channel, payload)
+        pipeline.execute()
+    except redis.RedisError as exc:
+        logger.warning("Could not publish push events: %s", exc)
+
+
+def publish_on_commit(messages):
+    if messages:
+        transaction.on_commit(lambda: publish(messages))
+
+
+class PushHub:
+    """One pub/sub connection per process, fanning messages out to subscribers."""
+
+    def __init__(self, url):
+        self.url = url
+        self.queues = {}
+        self.lock = asyncio.Lock()
+        self.redis = None
+        self.pubsub = None
+        self.task = None
+
+    async def connect(self):
+        # Reconnects would otherwise leak the lost connection and its pool
+        await self.disconnect()
+        self.redis = redis.asyncio.Redis.from_url(self.url)
+        self.pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+        if self.queues:
+            await self.pubsub.subscribe(*self.queues)
+
+    async def disconnect(self):
+        if self.pubsub is None:
+            return
+        try:
+            await self.pubsub.aclose()
+            await self.redis.aclose()
+        except (redis.RedisError, OSError):
+            pass  # Already broken
+        self.redis = self.pubsub = None
+
+    async def subscribe(self, channels):
+        queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        queue.overflowed = False
+        async with self.lock:
+            if self.pubsub is None:
+                await self.connect()
+            new = [channel for channel in channels if channel not in self.queues]
+            for channel in channels:
+                self.queues.setdefault(channel, set()).add(queue)
+            if new:
+                await self.pubsub.subscribe(*new)
+            if self.task is None or self.task.done():
+                self.task = asyncio.create_task(self.listen())
+        return queue
+
+    async def unsubscribe(self, channels, queue):
+        async with self.lock:
+            unused = []
+            for channel in channels:
+                subscribers = self.queues.get(channel)
+                if subscribers is None:
+                    continue
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self.queues[channel]
+                    unused.append(channel)
+            if unused and self.pubsub is not None:
+                try:
+                    await self.pubsub.unsubscribe(*unused)
+                except (redis.RedisError, OSError):
+                    pass  # Dropped anyway when the listener reconnects
+
+    def dispatch(self, channel, data):
+        for queue in self.queues.get(channel, ()):
+            try:
+                queue.put_nowait(data)
+            except asyncio.QueueFull:
+                queue.overflowed = True
+
+    async def listen(self):
+        delay = 1
+        while True:
+            try:
+                message = await self.pubsub.get_message(timeout=1.0)
+                delay = 1
+            except (redis.RedisError, OSError) as exc:
+                logger.warning("Push hub lost Redis, reconnecting in %ss: %s", delay, exc)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+                async with self.lock:
+                    try:
+                        await self.connect()
+                    except (redis.RedisError, OSError):
+                        continue
+                continue
+            if message is not None and message['type'] == 'message':
+                channel = message['channel']
+                self.dispatch(channel.decode() if isinstance(channel, bytes) else channel, message['data'])
+
+
+_hubs = {}
+
+
+def get_hub():
+    """The hub of the running event loop."""
+    loop = asyncio.get_running_loop()
+    if loop not in _hubs:
+        _hubs[loop] = PushHub(settings.PUSH_REDIS_URL)
+    return _hubs[loop]
+
+
+def load_user(session_key):
+    from importlib import import_module
+
+    from django.contrib.auth import get_user
+    from django.http import HttpRequest
+
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    # Runs outside Django's request cycle, which would otherwise close
+    # connections that broke or outlived CONN_MAX_AGE
+    close_old_connections()
+    try:
+        return get_user(request)
+    finally:
+        close_old_connections()
+
+
+def channels_for(user, query_string):
+    """The channels a user may and wants to follow."""
+    channels = [user_channel(user.pk)]
+    if user.is_staff:
+        client_ids = [
+            value for part in parse_qs(query_string).get('client', []) for value in part.split(',') if value.isdigit()
+        ]
+        if client_ids:
+            channels.extend(client_channel(client_id) for client_id in client_ids)
+        else:
+            channels.append(STAFF_CHANNEL)
+    return channels
+
+
+class PushApplication:
+    """ASGI application serving the event stream and passing everything else on."""
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == settings.PUSH_PATH:
+            await self.stream(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def stream(self, scope, receive, send):
+        headers = dict(scope['headers'])
+        cookie = SimpleCookie(headers.get(b'cookie', b'').decode('latin-1'))
+        session = cookie.get(settings.SESSION_COOKIE_NAME)
+        user = await sync_to_async(load_user)(session.value) if session else None
+        if user is None or not user.is_authenticated:
+            await send({'type': 'http.response.start', 'status': 403, 'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Forbidden'})
+            return
+
+        channels = channels_for(user, scope.get('query_string', b'').decode())
+        hub = get_hub()
+        queue = await hub.subscribe(channels)
+        disconnected = asyncio.create_task(self.wait_for_disconnect(receive))
+        getter = None
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            while not queue.overflowed:
+                getter = getter or asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait(
+                    {getter, disconnected}, timeout=settings.PUSH_KEEPALIVE, return_when=asyncio.FIRST_COMPLETED,
+                )
+                if disconnected in done:
+                    return
+                if getter in done:
+                    body, getter = getter.result(), None
+                else:
+                    # Keeps proxies from closing idle connections
+                    body = b': keepalive\n\n'
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        except OSError:
+            pass  # Browser went away mid-write
+        finally:
+            for task in (getter, disconnected):
+                if task is not None:
+                    task.cancel()
+            await hub.unsubscribe(channels, queue)
+
+    @staticmethod
+    async def wait_for_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
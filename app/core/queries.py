@@ -0,0 +1,187 @@
+"""
+Per-request and per-task query budgets.
+
+``QueryBudgetMiddleware`` and the Celery task hooks count every query a
+request or task runs, its total SQL time and how often each query shape
+(the SQL with literals and ``IN`` lists folded) repeats. A shape repeated
+``QUERY_REPEAT_THRESHOLD`` times is almost always an N+1, e.g. a
+changelist calling ``__str__`` on a foreign key per row.
+
+Requests and tasks over budget, or with repeated shapes, are logged as
+warnings with the numbers in the record's ``extra`` for log based metrics;
+everything else is logged at debug level. With ``QUERY_BUDGET_STRICT`` on
+(which ``core.test_runner`` does for the test suite) exceeding the budget
+raises ``QueryBudgetExceeded`` instead. Celery only logs exceptions raised by
+signal handlers, so a strict task is failed by refusing its first query over
+budget instead of at the end.
+Requests get ``QUERY_BUDGET`` queries unless their view is decorated with
+``@query_budget(n)``; tasks get ``QUERY_TASK_BUDGET`` unless declared with
+``@shared_task(query_budget=n)``. A budget of 0 means no limit.
+
+    with queries.max_queries(5):
+        render_dashboard()
+"""
+import functools
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+IN_LIST = re.compile(r'\((?:%s, )+%s\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=2048)
+def query_shape(sql):
+    """The SQL with literal numbers and parameter lists folded."""
+    return NUMBER.sub('?', IN_LIST.sub('(...)', sql))
+
+
+class QueryRecorder:
+    """Database execute wrapper counting and timing queries."""
+
+    def __init__(self, label, limit=None):
+        self.label = label
+        # Queries beyond this many raise QueryBudgetExceeded
+        self.limit = limit
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.limit and self.count >= self.limit:
+            raise QueryBudgetExceeded(describe(self, self.limit) + f"\n  refused: {sql[:300]}")
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self):
+        """``(shape, count)`` of query shapes run at least ``QUERY_REPEAT_THRESHOLD`` times."""
+        return [
+            (shape, count) for shape, count in self.shapes.most_common()
+            if count >= settings.QUERY_REPEAT_THRESHOLD
+        ]
+
+    @contextmanager
+    def installed(self):
+        """Record the queries of every database run in this thread inside the block."""
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(self))
+            yield self
+
+    def summary(self):
+        return f"{self.count} queries in {self.duration * 1000:.1f} ms"
+
+
+def describe(recorder, budget, over=True):
+    """The numbers of a recorder and its most repeated query shapes."""
+    lines = [f"{recorder.label}: {recorder.summary()}" + (f", over the budget of {budget}" if over else "")]
+    lines.extend(f"  {count} x {shape[:300]}" for shape, count in recorder.repeated()[:5])
+    return '\n'.join(lines)
+
+
+def report(recorder, budget, strict=None):
+    """Log a recorder's numbers and enforce ``budget`` (None or 0 for none)."""
+    over = bool(budget) and recorder.count > budget
+    repeated = recorder.repeated()
+    extra = {
+        'query_label': recorder.label,
+        'query_count': recorder.count,
+        'query_time_ms': round(recorder.duration * 1000, 1),
+        'query_repeated': sum(count for _, count in repeated),
+    }
+    if over or repeated:
+        message = describe(recorder, budget, over)
+        if over and (settings.QUERY_BUDGET_STRICT if strict is None else strict):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message, extra=extra)
+    else:
+        logger.debug("%s: %s", recorder.label, recorder.summary(), extra=extra)
+
+
+def query_budget(count):
+    """Give a view its own query budget."""
+    def decorator(view):
+        view.query_budget = count
+        return view
+    return decorator
+
+
+@contextmanager
+def max_queries(count, label='block'):
+    """Fail with QueryBudgetExceeded if the block runs more than ``count`` queries."""
+    recorder = QueryRecorder(label)
+    with recorder.installed():
+        yield recorder
+    report(recorder, count, strict=True)
+
+
+class QueryBudgetMiddleware:
+    """Record the queries of each request and report them against its budget."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(f"{request.method} {request.path}")
+        request.query_budget = settings.QUERY_BUDGET
+        with recorder.installed():
+            response = self.get_response(request)
+        if request.resolver_match is not None:
+            recorder.label = f"{request.method} {request.resolver_match.view_name}"
+        if settings.QUERY_SERVER_TIMING:
+            response['Server-Timing'] = (
+                f'db;dur={recorder.duration * 1000:.1f};desc="{recorder.count} queries"'
+            )
+        report(recorder, request.query_budget)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        budget = getattr(view_func, 'query_budget', None)
+        if budget is not None:
+            request.query_budget = budget
+
+
+# Like the audit buffers, a task's recorder is kept per task id from
+# start to end, which run in the same thread
+_task_recorders = {}
+
+
+def start_task_recorder(task_id=None, task=None, **kwargs):
+    budget = getattr(task, 'query_budget', settings.QUERY_TASK_BUDGET)
+    recorder = QueryRecorder(f"task {task.name}", limit=budget if settings.QUERY_BUDGET_STRICT else None)
+    stack = ExitStack()
+    stack.enter_context(recorder.installed())
+    _task_recorders[task_id] = (recorder, stack, budget)
+
+
+def finish_task_recorder(task_id=None, **kwargs):
+    entry = _task_recorders.pop(task_id, None)
+    if entry is None:
+        return
+    recorder, stack, budget = entry
+    stack.close()
+    # Raising here would only be logged by Celery; strict budgets are
+    # enforced by the recorder's limit
+    report(recorder, budget, strict=False)
+
+
+def connect_signals():
+    task_prerun.connect(start_task_recorder, dispatch_uid='query-budget-task-start', weak=False)
+    task_postrun.connect(finish_task_recorder, dispatch_uid='query-budget-task-end', weak=False)
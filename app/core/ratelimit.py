@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens are added at ``rate`` per second up to ``capacity`` (defaults to
+    one second's worth). ``reserve()`` never blocks, so it can be used from
+    both threaded and asyncio code.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, tokens=1):
+        """Take tokens and return the seconds to wait before using them."""
+        with self.lock:
+            self._refill()
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def try_acquire(self, tokens=1):
+        """Take tokens only if they are available right now."""
+        with self.lock:
+            self._refill()
+            if self.tokens < tokens:
+                return False
+            self.tokens -= tokens
+            return True
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available."""
+        delay = self.reserve(tokens)
+        if delay:
+            time.sleep(delay)
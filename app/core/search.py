@@ -0,0 +1,293 @@
+"""
+Site-wide search across clients, contacts, devices, invoices and content.
+
+Models are registered with ``register()``, after which signals keep one
+``SearchDocument`` row per object holding its title and searchable text.
+On PostgreSQL a trigger maintains each document's weighted ``tsvector``
+and GIN indexes serve both full-text and trigram (typo tolerant) matches,
+so searches no longer scan the source tables with ``ILIKE``. The trigger,
+indexes and ``pg_trgm`` extension are installed after migrations by
+``install_postgres_search()``. Other databases fall back to substring
+matching on the documents, which is enough for local development.
+
+Fields of related objects, e.g. ``'client.name'``, are followed: when the
+followed value changes, the documents of the objects pointing at it are
+rewritten too. Searches match whole words and word prefixes, so results
+appear while a word is still being typed.
+"""
+import re
+from operator import attrgetter
+
+from django.contrib.contenttypes.models import ContentType
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .models import SearchDocument
+
+SEARCH_CONFIG = 'english'
+WORD = re.compile(r'[^\W_]+')
+
+POSTGRES_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"""
+    CREATE OR REPLACE FUNCTION core_searchdocument_update_vector() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.body, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS core_searchdocument_vector ON core_searchdocument",
+    """
+    CREATE TRIGGER core_searchdocument_vector
+    BEFORE INSERT OR UPDATE OF title, body ON core_searchdocument
+    FOR EACH ROW EXECUTE FUNCTION core_searchdocument_update_vector()
+    """,
+    "CREATE INDEX IF NOT EXISTS core_searchdocument_vector_gin ON core_searchdocument USING gin (search_vector)",
+    "CREATE INDEX IF NOT EXISTS core_searchdocument_title_trgm ON core_searchdocument USING gin (title gin_trgm_ops)",
+    # Documents written before the trigger existed
+    "UPDATE core_searchdocument SET title = title WHERE search_vector IS NULL",
+]
+
+registry = {}
+# Related model -> [(registered model, relation, followed field names)]
+followers = {}
+
+
+class SearchSpec:
+    """How to turn instances of a registered model into search documents."""
+
+    def __init__(self, model, title, fields, select_related=()):
+        self.model = model
+        self.title = attrgetter(title) if isinstance(title, str) else title
+        self.fields = [attrgetter(field) for field in fields]
+        self.select_related = select_related
+        # 'client.name' follows the name field of the client relation
+        self.follows = {}
+        for field in fields:
+            if '.' in field:
+                relation, name = field.split('.', 1)
+                self.follows.setdefault(relation, set()).add(name)
+
+    def document(self, obj):
+        values = (field(obj) for field in self.fields)
+        return SearchDocument(
+            content_type=ContentType.objects.get_for_model(self.model),
+            object_id=obj.pk,
+            title=str(self.title(obj))[:255],
+            body='\n'.join(str(value) for value in values if value),
+        )
+
+
+def register(model, title, fields, select_related=()):
+    """Make a model searchable.
+
+    ``title`` is an attribute name or a callable taking the instance, and
+    ``fields`` are attribute paths (``'client.name'`` follows relations)
+    whose values make up the document text. A followed relation must be a
+    foreign key and the field read through it a concrete field.
+    ``select_related`` is used when rebuilding the index in bulk.
+    """
+    spec = registry[model] = SearchSpec(model, title, fields, select_related)
+    uid = f'search-{model._meta.label_lower}'
+    post_save.connect(index_instance, sender=model, dispatch_uid=uid)
+    post_delete.connect(unindex_instance, sender=model, dispatch_uid=uid)
+
+    for relation, names in spec.follows.items():
+        related = model._meta.get_field(relation).related_model
+        followers.setdefault(related, []).append((model, relation, names))
+        uid = f'search-follow-{related._meta.label_lower}'
+        pre_save.connect(remember_followed_values, sender=related, dispatch_uid=uid)
+        post_save.connect(reindex_followers, sender=related, dispatch_uid=uid)
+
+
+def save_documents(documents):
+    """Insert or update documents in one statement."""
+    SearchDocument.objects.bulk_create(
+        documents,
+        update_conflicts=True,
+        unique_fields=['content_type', 'object_id'],
+        update_fields=['title', 'body', 'updated_at'],
+    )
+
+
+def index_instance(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    save_documents([registry[sender].document(instance)])
+
+
+def unindex_instance(sender, instance, **kwargs):
+    SearchDocument.objects.filter(
+        content_type=ContentType.objects.get_for_model(sender),
+        object_id=instance.pk,
+    ).delete()
+
+
+def remember_followed_values(sender, instance, raw=False, **kwargs):
+    """Read the followed fields as stored, to tell after saving if they changed."""
+    if raw or instance._state.adding:
+        return
+    names = set().union(*(names for _, _, names in followers[sender]))
+    instance._search_followed = sender._default_manager.filter(pk=instance.pk).values(*names).first()
+
+
+def reindex_followers(sender, instance, created=False, raw=False, **kwargs):
+    """Rewrite the documents showing a related object's changed fields."""
+    stored = instance.__dict__.pop('_search_followed', None)
+    if raw or created or stored is None:
+        return
+    for model, relation, names in followers[sender]:
+        if any(stored[name] != getattr(instance, name) for name in names):
+            index_queryset(model, model.objects.filter(**{relation: instance}))
+
+
+def index_queryset(model, queryset, batch_size=1000):
+    """Write the documents of a queryset of a registered model, returning the count."""
+    spec = registry[model]
+    queryset = queryset.select_related(*spec.select_related).order_by('pk')
+
+    count = 0
+    batch = []
+    for obj in queryset.iterator(chunk_size=batch_size):
+        batch.append(spec.document(obj))
+        if len(batch) >= batch_size:
+            save_documents(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        save_documents(batch)
+        count += len(batch)
+    return count
+
+
+def index_objects(model, pks):
+    """Write documents for objects saved without signals, e.g. by bulk_create."""
+    spec = registry[model]
+    objects = model.objects.select_related(*spec.select_related).filter(pk__in=pks)
+    save_documents([spec.document(obj) for obj in objects])
+
+
+def reindex(model, batch_size=1000):
+    """Rebuild the documents of a registered model and return how many there are."""
+    content_type = ContentType.objects.get_for_model(model)
+    count = index_queryset(model, model.objects.all(), batch_size)
+
+    # Objects deleted without signals, e.g. by queryset deletes
+    SearchDocument.objects.filter(content_type=content_type).exclude(
+        object_id__in=model.objects.values('pk')
+    ).delete()
+    return count
+
+
+def install_postgres_search(sender=None, using='default', **kwargs):
+    """Install the search trigger and indexes; a no-op outside PostgreSQL.
+
+    Connected to ``post_migrate``, so it runs idempotently after every
+    ``migrate``.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    if SearchDocument._meta.db_table not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for statement in POSTGRES_SQL:
+            cursor.execute(statement)
+
+
+def content_types_for(models):
+    return list(ContentType.objects.get_for_models(*models).values())
+
+
+def text_query(text):
+    """Full-text query matching ``text`` as websearch syntax or as word prefixes."""
+    query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    words = WORD.findall(text)
+    if words:
+        prefixes = ' & '.join(f"{word}:*" for word in words)
+        query |= SearchQuery(prefixes, config=SEARCH_CONFIG, search_type='raw')
+    return query
+
+
+def matching_documents(text, models=None):
+    """Return documents matching ``text``, optionally limited to some models."""
+    documents = SearchDocument.objects.all()
+    if models:
+        documents = documents.filter(content_type__in=content_types_for(models))
+    text = text.strip()
+
+    if connections[documents.db].vendor == 'postgresql':
+        return documents.filter(Q(search_vector=text_query(text)) | Q(title__trigram_similar=text))
+
+    terms = Q()
+    for term in text.split():
+        terms &= Q(title__icontains=term) | Q(body__icontains=term)
+    return documents.filter(terms)
+
+
+def search_documents(text, models=None):
+    """Return matching documents ordered by relevance, best first."""
+    documents = matching_documents(text, models)
+    text = text.strip()
+
+    if connections[documents.db].vendor == 'postgresql':
+        return documents.annotate(
+            rank=SearchRank(F('search_vector'), text_query(text)),
+            similarity=TrigramSimilarity('title', text),
+        ).order_by('-rank', '-similarity', 'title')
+
+    return documents.annotate(
+        rank=Case(
+            When(title__iexact=text, then=Value(1.0)),
+            When(title__icontains=text, then=Value(0.5)),
+            default=Value(0.1),
+            output_field=FloatField(),
+        ),
+    ).order_by('-rank', 'title')
+
+
+def search(text, models=None, limit=20):
+    """Ranked search across registered models.
+
+    Returns up to ``limit`` documents, each with the matched model instance
+    attached as ``object``; every model in the results costs one query.
+    """
+    if not text.strip():
+        return []
+    documents = list(search_documents(text, models).select_related('content_type')[:limit])
+
+    ids_by_type = {}
+    for document in documents:
+        ids_by_type.setdefault(document.content_type, []).append(document.object_id)
+    objects = {}
+    for content_type, ids in ids_by_type.items():
+        model = content_type.model_class()
+        queryset = model.objects.select_related(*registry[model].select_related) if model in registry else model.objects
+        for pk, obj in queryset.in_bulk(ids).items():
+            objects[content_type.id, pk] = obj
+
+    results = []
+    for document in documents:
+        document.object = objects.get((document.content_type_id, document.object_id))
+        if document.object is not None:
+            results.append(document)
+    return results
+
+
+class IndexedSearchAdminMixin:
+    """Admin mixin answering the changelist search box from the search index.
+
+    The model must be registered; ``search_fields`` still has to be set for
+    the admin to show the search box.
+    """
+
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term.strip() or self.model not in registry:
+            return super().get_search_results(request, queryset, search_term)
+        ids = matching_documents(search_term, [self.model]).order_by().values('object_id')
+        return queryset.filter(pk__in=ids), False
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import push, system_settings
+from .models import Notification, SystemSetting
+from .notifications import invalidate_counters, notification_event
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def drop_unread_counter(sender, instance, **kwargs):
+    """Single saves and deletes bypass the counters; rebuild them on the next read."""
+    invalidate_counters([instance.user_id])
+
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, raw=False, **kwargs):
+    """Notifications created one by one; ``notifications.notify()`` pushes its own."""
+    if created and not raw:
+        push.publish_on_commit([([push.user_channel(instance.user_id)], 'notification', notification_event(instance))])
+
+
+@receiver(post_save, sender=SystemSetting)
+@receiver(post_delete, sender=SystemSetting)
+def reload_system_settings(sender, instance, **kwargs):
+    transaction.on_commit(system_settings.invalidate)
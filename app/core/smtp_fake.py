@@ -0,0 +1,92 @@
+"""
+Local stand-in for an SMTP server.
+
+Run it with ``python manage.py fake_smtp`` and point ``EMAIL_HOST`` and
+``EMAIL_PORT`` at it to see outgoing email without a mail server. It
+speaks enough SMTP for Django's SMTP backend (no TLS or authentication),
+keeps received messages in memory and counts connections, so batching over
+one connection can be checked. Recipients containing one of the ``reject``
+markers are refused, to exercise per-message failures.
+"""
+import threading
+from email import message_from_bytes, policy
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+
+class FakeSMTPHandler(StreamRequestHandler):
+
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+        self.reply('220 fake-smtp ready')
+        sender, recipients = None, []
+        while line := self.rfile.readline():
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+            if verb in ('HELO', 'EHLO'):
+                self.reply('250 fake-smtp')
+            elif verb == 'MAIL':
+                sender, recipients = command.partition(':')[2].strip(' <>'), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipient = command.partition(':')[2].strip(' <>')
+                if any(marker in recipient for marker in self.server.reject):
+                    self.reply('550 Mailbox unavailable')
+                    continue
+                recipients.append(recipient)
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                self.receive(sender, recipients)
+                self.reply('250 OK')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                break
+            else:
+                self.reply('502 Command not implemented')
+
+    def receive(self, sender, recipients):
+        lines = []
+        while (line := self.rfile.readline()) not in (b'.\r\n', b'.\n', b''):
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b'..') else line)
+        message = message_from_bytes(b''.join(lines), policy=policy.default)
+        with self.server.lock:
+            self.server.messages.append({'from': sender, 'to': recipients, 'message': message})
+        if self.server.verbose:
+            print(f"Message from {sender} to {', '.join(recipients)}: {message['Subject']}")
+
+
+class FakeSMTPServer(ThreadingTCPServer):
+    """In-memory SMTP stand-in recording messages and connections."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), reject=(), verbose=False):
+        super().__init__(address, FakeSMTPHandler)
+        self.reject = tuple(reject)
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.messages = []
+        self.connections = 0
+
+    @property
+    def host(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        """Serve from a background thread and return the server."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
@@ -0,0 +1,125 @@
+"""
+Cached, typed access to ``SystemSetting`` values.
+
+Every process keeps all settings in memory and reads them without touching
+the database. Saving or deleting a setting changes a version key in the
+shared cache (Redis), and each process compares its copy's version with it
+at most every ``SYSTEM_SETTINGS_CHECK_INTERVAL`` seconds, reloading all
+settings in one query when it changed. Changes therefore reach every
+gunicorn and Celery process within that interval, and immediately in the
+process that made them.
+
+    from core import system_settings
+
+    system_settings.get_int('invoice_due_days', 30)
+    system_settings.get_bool('maintenance_mode')
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import SystemSetting
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'core:system-settings:version'
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y', 'on'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', 'off', ''}
+
+_lock = threading.Lock()
+_state = {'version': None, 'values': {}, 'public': {}, 'checked_at': None}
+
+
+def invalidate():
+    """Make every process reload settings, this one on its next read."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+    _state['checked_at'] = None
+
+
+def current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Lost with the cache; start a new version every process will adopt
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def load():
+    """Return all settings as ``{key: value}``, reloading them if they changed."""
+    checked_at = _state['checked_at']
+    now = time.monotonic()
+    if checked_at is not None and now - checked_at < settings.SYSTEM_SETTINGS_CHECK_INTERVAL:
+        return _state['values']
+
+    with _lock:
+        version = current_version()
+        if version != _state['version']:
+            values, public = {}, {}
+            for key, value, is_public in SystemSetting.objects.values_list('key', 'value', 'is_public'):
+                values[key] = value
+                if is_public:
+                    public[key] = value
+            _state.update(version=version, values=values, public=public)
+        _state['checked_at'] = now
+    return _state['values']
+
+
+def public_settings():
+    """Settings visible to non-admin users, as ``{key: value}``."""
+    load()
+    return dict(_state['public'])
+
+
+def get(key, default=None):
+    """A setting's raw string value, or ``default`` if it is not set."""
+    return load().get(key, default)
+
+
+def _typed(key, default, convert):
+    value = load().get(key)
+    if value is None:
+        return default
+    try:
+        return convert(value)
+    except (TypeError, ValueError):
+        logger.warning("System setting %r has an invalid value %r; using %r", key, value, default)
+        return default
+
+
+def get_int(key, default=None):
+    return _typed(key, default, lambda value: int(value.strip()))
+
+
+def get_float(key, default=None):
+    return _typed(key, default, lambda value: float(value.strip()))
+
+
+def parse_bool(value):
+    value = value.strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise ValueError(value)
+
+
+def get_bool(key, default=False):
+    return _typed(key, default, parse_bool)
+
+
+def get_list(key, default=None):
+    """A comma separated setting as a list of stripped, non-empty strings."""
+    return _typed(key, default if default is not None else [], lambda value: [
+        item.strip() for item in value.split(',') if item.strip()
+    ])
+
+
+def get_json(key, default=None):
+    return _typed(key, default, json.loads)
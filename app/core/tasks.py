@@ -0,0 +1,23 @@
+from celery import shared_task
+from django.core.cache import cache
+
+# Cache key held while a processing run is queued, so a burst of uploads
+# queues one task instead of one per image
+IMAGES_SCHEDULED_KEY = 'images:processing-scheduled'
+
+
+def schedule_image_processing(delay=1):
+    """Queue image processing unless a run is already waiting."""
+    if cache.add(IMAGES_SCHEDULED_KEY, 1, timeout=60):
+        process_images.apply_async(countdown=delay)
+
+
+@shared_task
+def process_images(batch_size=50):
+    """Task to generate the resized variants of newly uploaded images in this worker process."""
+    from .images import process_pending
+
+    # Uploads from now on need a new run
+    cache.delete(IMAGES_SCHEDULED_KEY)
+    counts = process_pending(batch_size=batch_size, processes=1)
+    return f"Images: {counts['ready']} processed, {counts['failed']} failed"
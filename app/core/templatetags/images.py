@@ -0,0 +1,21 @@
+from django import template
+
+from core.images import picture_context, variant_url
+
+register = template.Library()
+
+
+@register.inclusion_tag('core/picture.html')
+def picture(image, alt='', sizes='100vw', width=None, css_class=''):
+    """Render an image field as a ``<picture>`` with WebP and fallback variants.
+
+    ``width`` picks the variant used by browsers without ``srcset`` support;
+    it defaults to the largest. Images not processed yet use the original.
+    """
+    return dict(picture_context(image, width), alt=alt, sizes=sizes, css_class=css_class)
+
+
+@register.simple_tag
+def image_variant(image, width):
+    """URL of the variant of an image field best suited to ``width`` pixels."""
+    return variant_url(image, int(width))
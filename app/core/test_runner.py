@@ -0,0 +1,20 @@
+"""
+Test runner for the project.
+
+Turns ``QUERY_BUDGET_STRICT`` on, so a view or task going over its query
+budget fails the test exercising it instead of only logging a warning.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget_strict = settings.QUERY_BUDGET_STRICT
+        settings.QUERY_BUDGET_STRICT = 1
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_BUDGET_STRICT = self._query_budget_strict
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,275 @@
+import logging
+import tempfile
+from io import BytesIO
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+from celery import shared_task
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+
+from clients.models import Client
+from monitoring.models import Device, MonitoringResult
+from clients.importer import ClientImporter, DeviceImporter
+from . import images, notifications, push, queries, search
+from .changelists import CURSOR_VAR
+from .models import ImageAsset, SearchDocument
+
+
+class LargeTableChangeListTests(TestCase):
+    """Keyset paging of the MonitoringResult changelist."""
+
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        device = Device.objects.create(client=Client.objects.create(name='Acme', slug='acme'), name='router', ip_address='10.0.0.1')
+        MonitoringResult.objects.bulk_create([MonitoringResult(device=device) for _ in range(150)])
+        self.url = reverse('admin:monitoring_monitoringresult_changelist')
+
+    def get(self, query=''):
+        response = self.client.get(self.url + query, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_older_then_newest(self):
+        first = self.get()
+        self.assertIsNone(first.first_url)
+        self.assertIsNotNone(first.next_url)
+        first_ids = [result.pk for result in first.result_list]
+        self.assertEqual(len(first_ids), 100)
+
+        second = self.get(first.next_url)
+        second_ids = [result.pk for result in second.result_list]
+        self.assertEqual(len(second_ids), 50)
+        self.assertLess(max(second_ids), min(first_ids))
+        self.assertIsNone(second.next_url)
+        self.assertNotIn(CURSOR_VAR, parse_qs(urlsplit(second.first_url).query))
+
+        newest = self.get(second.first_url)
+        self.assertEqual([result.pk for result in newest.result_list], first_ids)
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(self.url, {CURSOR_VAR: 'W251bGwsIG51bGxd'}, HTTP_HOST='localhost')
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('e=1', response['Location'])
+
+
+class ImageProcessingTests(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings = override_settings(MEDIA_ROOT=media_root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def store(self, name, color):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 20), color).save(buffer, 'PNG')
+        name = default_storage.save(name, ContentFile(buffer.getvalue()))
+        return ImageAsset.objects.create(name=name)
+
+    def test_unexpected_errors_fail_only_their_image(self):
+        good = self.store('good.png', 'red')
+        bad = self.store('bad.png', 'blue')
+        transpose = images.ImageOps.exif_transpose
+
+        def exif_transpose(image):
+            # What Pillow raises on some corrupt PNGs
+            if image.getpixel((0, 0)) == (0, 0, 255):
+                raise SyntaxError('broken PNG file')
+            return transpose(image)
+
+        with mock.patch.object(images.ImageOps, 'exif_transpose', exif_transpose):
+            counts = images.process_pending(processes=1)
+
+        self.assertEqual(counts, {'ready': 1, 'failed': 1})
+        good.refresh_from_db()
+        bad.refresh_from_db()
+        self.assertEqual((good.status, good.width), ('ready', 40))
+        self.assertTrue(good.variants)
+        self.assertEqual((bad.status, bad.error), ('failed', 'broken PNG file'))
+
+
+@shared_task(query_budget=3)
+def count_users(times):
+    for _ in range(times):
+        User.objects.filter(pk=1).exists()
+
+
+class QueryBudgetTests(TestCase):
+    """The test runner turns QUERY_BUDGET_STRICT on."""
+
+    def run_queries(self, times):
+        for pk in range(times):
+            User.objects.filter(pk=pk).exists()
+
+    def test_repeated_shapes_are_reported(self):
+        with self.assertLogs('core.queries', logging.WARNING) as logs:
+            with queries.max_queries(20) as recorder:
+                self.run_queries(12)
+                list(User.objects.filter(pk__in=[1, 2, 3]))
+                list(User.objects.filter(pk__in=[4, 5]))
+
+        [(shape, count)] = recorder.repeated()
+        self.assertEqual(count, 12)
+        self.assertNotRegex(shape, r'\d')
+        self.assertEqual(len(recorder.shapes), 2)
+        self.assertIn('12 x SELECT', logs.output[0])
+
+    def test_block_over_budget_raises(self):
+        with self.assertRaises(queries.QueryBudgetExceeded) as raised:
+            with queries.max_queries(5, label='dashboard'):
+                self.run_queries(12)
+        message = str(raised.exception)
+        self.assertIn('dashboard: 12 queries', message)
+        self.assertIn('over the budget of 5', message)
+        self.assertIn('12 x SELECT', message)
+
+    @override_settings(QUERY_BUDGET=5)
+    def test_request_over_budget_raises(self):
+        def view(request):
+            self.run_queries(6)
+            return HttpResponse()
+
+        middleware = queries.QueryBudgetMiddleware(view)
+        with self.assertRaises(queries.QueryBudgetExceeded):
+            middleware(RequestFactory().get('/dashboard/'))
+
+        with override_settings(QUERY_BUDGET=6), self.assertLogs('core.queries', logging.DEBUG):
+            self.assertEqual(middleware(RequestFactory().get('/dashboard/')).status_code, 200)
+
+    def test_task_over_budget_fails(self):
+        self.assertTrue(count_users.apply(args=(3,)).successful())
+
+        result = count_users.apply(args=(4,))
+        self.assertTrue(result.failed())
+        self.assertIsInstance(result.result, queries.QueryBudgetExceeded)
+        self.assertIn('over the budget of 3', str(result.result))
+
+
+class PushTests(TransactionTestCase):
+    # Not TestCase: load_user closes connections, which would end its transaction
+
+    def test_channels_follow_the_users_access(self):
+        staff = User(pk=1, is_staff=True)
+        user = User(pk=2)
+
+        self.assertEqual(push.channels_for(staff, ''), ['push:user:1', push.STAFF_CHANNEL])
+        self.assertEqual(
+            push.channels_for(staff, 'client=3,x&client=4'),
+            ['push:user:1', 'push:client:3', 'push:client:4'],
+        )
+        self.assertEqual(push.channels_for(user, 'client=3'), ['push:user:2'])
+        self.assertEqual(push.channels_for(user, ''), ['push:user:2'])
+
+    async def stream(self, cookie=None):
+        headers = [(b'cookie', cookie.encode())] if cookie else []
+        scope = {'type': 'http', 'path': settings.PUSH_PATH, 'headers': headers, 'query_string': b''}
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        async def application(scope, receive, send):
+            raise AssertionError("Event requests are answered by the push application")
+
+        await push.PushApplication(application)(scope, receive, send)
+        return sent
+
+    async def test_anonymous_requests_are_forbidden(self):
+        for cookie in (None, f'{settings.SESSION_COOKIE_NAME}=unknown'):
+            start, body = await self.stream(cookie)
+            self.assertEqual(start['status'], 403)
+            self.assertEqual(body['body'], b'Forbidden')
+
+
+class SearchTests(TestCase):
+    """The substring fallback used outside PostgreSQL."""
+
+    def setUp(self):
+        self.acme = Client.objects.create(name='Acme Industries', slug='acme', city='Springfield')
+        self.router = Device.objects.create(client=self.acme, name='Core router', ip_address='10.0.0.1')
+        Client.objects.create(name='Globex', slug='globex')
+
+    def titles(self, text, models=None):
+        return [document.title for document in search.search(text, models)]
+
+    def test_words_match_by_prefix(self):
+        self.assertEqual(self.titles('acm'), ['Acme Industries', 'Core router'])
+        self.assertEqual(self.titles('rout acm'), ['Core router'])
+        self.assertEqual(self.titles('acm', [Client]), ['Acme Industries'])
+        self.assertEqual(self.titles('initech'), [])
+
+    def test_followed_fields_are_reindexed(self):
+        self.acme.name = 'Initech'
+        self.acme.save()
+        self.assertEqual(self.titles('initech'), ['Initech', 'Core router'])
+        self.assertEqual(self.titles('industries'), [])
+
+    def test_bulk_imported_rows_are_searchable(self):
+        ClientImporter().run([{'name': 'Umbrella Corp', 'city': 'Raccoon City'}])
+        DeviceImporter().run([{'client': 'umbrella-corp', 'name': 'Lab switch', 'ip_address': '10.1.0.1'}])
+
+        # Title matches rank first
+        self.assertEqual(self.titles('umbrel'), ['Umbrella Corp', 'Lab switch'])
+        self.assertEqual(self.titles('raccoon'), ['Umbrella Corp'])
+        self.assertEqual(SearchDocument.objects.count(), 5)
+
+    def test_admin_search_uses_the_index(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        response = self.client.get(
+            reverse('admin:clients_client_changelist'), {'q': 'spring'}, HTTP_HOST='localhost',
+        )
+        self.assertEqual([client.pk for client in response.context['cl'].result_list], [self.acme.pk])
+
+
+class UnreadCounterTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def test_counters_follow_notifications(self):
+        self.assertEqual(notifications.unread_count(self.alice), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            notifications.notify([self.alice, self.bob], 'Hello', 'World')
+        # Only counters that exist are adjusted
+        self.assertEqual(cache.get(notifications.counter_key(self.alice.pk)), 1)
+        self.assertIsNone(cache.get(notifications.counter_key(self.bob.pk)))
+        self.assertEqual(notifications.unread_count(self.bob), 1)
+
+        notifications.adjust_counters({self.alice.pk: -2})
+        self.assertIsNone(cache.get(notifications.counter_key(self.alice.pk)))
+        self.assertEqual(notifications.unread_count(self.alice), 1)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/1',
+    }})
+    def test_redis_counters_are_adjusted_in_one_round_trip(self):
+        client = mock.Mock()
+        with mock.patch('django.core.cache.backends.redis.RedisCacheClient.get_client', return_value=client), \
+                mock.patch.object(notifications, 'COUNTER_BATCH_SIZE', 2):
+            notifications.adjust_counters({1: 1, 2: -1, 3: 1})
+
+        client.register_script.assert_called_once_with(notifications.ADJUST_COUNTERS_SCRIPT)
+        pipeline = client.pipeline.return_value
+        script = client.register_script.return_value
+        self.assertEqual(script.call_args_list, [
+            mock.call(keys=[':1:notifications:unread:1', ':1:notifications:unread:2'], args=[1, -1], client=pipeline),
+            mock.call(keys=[':1:notifications:unread:3'], args=[1], client=pipeline),
+        ])
+        pipeline.execute.assert_called_once_with()
+        client.incr.assert_not_called()
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import DeviceType, Device, MonitoringResult, Alert
+
+from core.changelists import AutocompleteFilter, LargeTableAdminMixin
+from core.search import IndexedSearchAdminMixin
+from .models import DeviceType, Device, MonitoringResult, Alert, DeviceOutage
 
 
 @admin.register(DeviceType)
@@ -9,9 +12,10 @@ class DeviceTypeAdmin(admin.ModelAdmin):
 
 
 @admin.register(Device)
-class DeviceAdmin(admin.ModelAdmin):
-    list_display = ('name', 'client', 'device_type', 'ip_address', 'status', 'monitoring_enabled')
+class DeviceAdmin(IndexedSearchAdminMixin, admin.ModelAdmin):
+    list_display = ('name', 'client', 'device_type', 'ip_address', 'status', 'monitoring_enabled', 'billing_price')
     list_filter = ('status', 'monitoring_enabled', 'device_type', 'client')
+    list_select_related = ('client', 'device_type')
     search_fields = ('name', 'ip_address', 'hostname', 'notes')
     autocomplete_fields = ['client', 'device_type']
     fieldsets = (
@@ -32,12 +36,20 @@ class DeviceAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_billing_price()
+
+    @admin.display(description='Billing price', ordering='effective_price')
+    def billing_price(self, obj):
+        return obj.effective_price
+
 
 @admin.register(MonitoringResult)
-class MonitoringResultAdmin(admin.ModelAdmin):
+class MonitoringResultAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('device', 'check_time', 'ping_status', 'ping_latency', 'snmp_status', 'cpu_load')
-    list_filter = ('ping_status', 'snmp_status', 'device')
-    date_hierarchy = 'check_time'
+    list_filter = ('check_time', 'ping_status', 'snmp_status', ('device', AutocompleteFilter))
+    list_select_related = ('device',)
+    keyset = ('check_time', 'id')
     readonly_fields = ('device', 'check_time', 'ping_status', 'ping_latency', 'snmp_status', 'cpu_load', 'memory_used', 'disk_used')
 
     def has_add_permission(self, request):
@@ -45,11 +57,14 @@ class MonitoringResultAdmin(admin.ModelAdmin):
 
 
 @admin.register(Alert)
-class AlertAdmin(admin.ModelAdmin):
+class AlertAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ('title', 'device', 'severity', 'status', 'created_at')
-    list_filter = ('severity', 'status', 'device__client')
+    list_filter = (
+        'created_at', 'severity', 'status', ('device__client', AutocompleteFilter), ('device', AutocompleteFilter),
+    )
+    list_select_related = ('device',)
     search_fields = ('title', 'message', 'device__name')
-    date_hierarchy = 'created_at'
+    keyset = ('created_at', 'id')
     fieldsets = (
         (None, {
             'fields': ('device', 'title', 'message', 'severity', 'status')
@@ -59,3 +74,16 @@ class AlertAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at',)
+
+
+@admin.register(DeviceOutage)
+class DeviceOutageAdmin(admin.ModelAdmin):
+    list_display = ('device', 'started_at', 'ended_at', 'duration')
+    list_filter = ('device__client',)
+    list_select_related = ('device',)
+    search_fields = ('device__name',)
+    date_hierarchy = 'started_at'
+    readonly_fields = ('device', 'started_at', 'ended_at')
+
+    def has_add_permission(self, request):
+        return False  # Built from monitoring results
@@ -0,0 +1,179 @@
+"""
+Batched alert notifications.
+
+A new alert does not notify anyone by itself: it queues a digest to go out
+``ALERT_DIGEST_WINDOW`` seconds later, and every alert raised meanwhile
+joins that digest. A digest claims all alerts not notified yet, groups
+them by client and severity, and sends every active staff user one
+in-app notification and one email covering all groups, so an outage that
+raises hundreds of alerts produces one message per recipient.
+
+Emails are rendered from the ``alert_digest`` EmailTemplate (a built-in
+default is used until one is created) and all of a digest's emails are sent
+over one SMTP connection by ``core.mail``.
+
+Claiming the alerts and creating the notifications commit together, so
+every claimed alert reaches the notifications. Emails go out after that
+commit; recipients whose email failed get it again from
+``retry_alert_digest_emails``, up to ``DIGEST_EMAIL_ATTEMPTS`` times, rebuilt
+from the same alerts. A worker dying between the commit and the sending
+loses only that digest's emails.
+"""
+from functools import lru_cache
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.template import Template
+from django.template.defaultfilters import pluralize
+from django.utils import timezone
+
+from core import mail, notifications
+from core.models import EmailTemplate
+from .models import Alert
+
+DIGEST_TEMPLATE_NAME = 'alert_digest'
+DEFAULT_SUBJECT = "{{ alert_count }} new monitoring alert{{ alert_count|pluralize }}"
+DEFAULT_CONTENT = """Hello {{ recipient.first_name|default:recipient.username }},
+
+{{ alert_count }} new alert{{ alert_count|pluralize }} for {{ client_count }} client{{ client_count|pluralize }}:
+{% for group in groups %}
+{{ group.client }} - {{ group.severity_label }} ({{ group.count }})
+{% for alert in group.alerts %}  * {{ alert.device }}: {{ alert.title }}
+{% endfor %}{% if group.more %}  ... and {{ group.more }} more
+{% endif %}{% endfor %}"""
+
+SEVERITY_ORDER = {'critical': 0, 'warning': 1, 'info': 2}
+NOTIFICATION_TYPES = {'critical': 'error', 'warning': 'warning'}
+# Alerts listed per group; the rest are only counted
+ALERTS_PER_GROUP = 10
+DIGEST_EMAIL_ATTEMPTS = 4
+DIGEST_RETRY_DELAY = 60  # seconds, doubled after every attempt
+
+
+def claim_alerts(max_alerts=5000):
+    """Mark alerts not notified yet as notified and return them."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Alert.objects.filter(status='new', notified_at__isnull=True)
+            .select_for_update(skip_locked=True)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:max_alerts]
+        )
+        Alert.objects.filter(id__in=ids).update(notified_at=now)
+    return list(Alert.objects.filter(id__in=ids).select_related('device__client').order_by('created_at'))
+
+
+def group_alerts(alerts):
+    """Group alerts by client and severity, most severe first."""
+    severity_labels = dict(Alert.SEVERITY_CHOICES)
+    groups = {}
+    for alert in alerts:
+        client = alert.device.client
+        key = (client.pk, alert.severity)
+        if key not in groups:
+            groups[key] = {
+                'client': client.name,
+                'severity': alert.severity,
+                'severity_label': severity_labels.get(alert.severity, alert.severity),
+                'count': 0,
+                'alerts': [],
+            }
+        group = groups[key]
+        group['count'] += 1
+        if len(group['alerts']) < ALERTS_PER_GROUP:
+            group['alerts'].append({'title': alert.title, 'device': alert.device.name})
+    for group in groups.values():
+        group['more'] = group['count'] - len(group['alerts'])
+    return sorted(groups.values(), key=lambda g: (SEVERITY_ORDER.get(g['severity'], 9), g['client']))
+
+
+@lru_cache(maxsize=None)
+def default_templates():
+    return Template(DEFAULT_SUBJECT), Template(DEFAULT_CONTENT)
+
+
+def digest_templates():
+    """Return compiled subject and body templates for digest emails."""
+    template = EmailTemplate.objects.filter(name=DIGEST_TEMPLATE_NAME, is_active=True).first()
+    if template is None:
+        return default_templates()
+    return mail.compile_template(template)
+
+
+def build_emails(recipients, context):
+    compiled = digest_templates()
+    return [
+        mail.render_message(compiled, recipient.email, dict(context, recipient=recipient))
+        for recipient in recipients
+    ]
+
+
+def notification_text(groups):
+    return '\n'.join(f"{group['client']}: {group['count']} {group['severity']}" for group in groups)
+
+
+def digest_context(alerts):
+    return {
+        'groups': group_alerts(alerts),
+        'alert_count': len(alerts),
+        'client_count': len({alert.device.client_id for alert in alerts}),
+    }
+
+
+def send_digest_emails(alerts, recipients, context, attempt=1):
+    """Email a digest and queue another attempt for the recipients it failed for.
+
+    Returns the number of emails sent.
+    """
+    recipients = [user for user in recipients if user.email]
+    # One connection for the whole batch; failures are logged by the mailer
+    with mail.BulkMailer(connections=1) as mailer:
+        report = mailer.send(build_emails(recipients, context))
+
+    failed = {address for failure in report['failures'] for address in failure['to']}
+    if failed and attempt < DIGEST_EMAIL_ATTEMPTS:
+        from .tasks import retry_alert_digest_emails
+
+        retry_alert_digest_emails.apply_async(
+            args=[[alert.pk for alert in alerts], [user.pk for user in recipients if user.email in failed], attempt + 1],
+            countdown=DIGEST_RETRY_DELAY * 2 ** (attempt - 1),
+        )
+    return report['sent']
+
+
+def resend_digest_emails(alert_ids, user_ids, attempt):
+    """Email a digest of earlier claimed alerts to some staff users again."""
+    alerts = list(Alert.objects.filter(id__in=alert_ids).select_related('device__client').order_by('created_at'))
+    recipients = list(User.objects.filter(id__in=user_ids, is_staff=True, is_active=True))
+    if not alerts or not recipients:
+        return 0
+    return send_digest_emails(alerts, recipients, digest_context(alerts), attempt)
+
+
+def send_digest(max_alerts=5000):
+    """Notify staff of all alerts raised since the last digest.
+
+    Returns counts of alerts covered, notifications and emails sent.
+    """
+    counts = {'alerts': 0, 'notifications': 0, 'emails': 0}
+    with transaction.atomic():
+        alerts = claim_alerts(max_alerts)
+        if not alerts:
+            return counts
+        counts['alerts'] = len(alerts)
+
+        context = digest_context(alerts)
+        groups = context['groups']
+        recipients = list(User.objects.filter(is_staff=True, is_active=True))
+        client_count = context['client_count']
+        counts['notifications'] = notifications.notify(
+            recipients,
+            title=f"{len(alerts)} new alert{pluralize(len(alerts))} for {client_count} client{pluralize(client_count)}",
+            message=notification_text(groups),
+            type=NOTIFICATION_TYPES.get(groups[0]['severity'], 'info'),
+            link='/admin/monitoring/alert/?status__exact=new',
+        )
+
+    counts['emails'] = send_digest_emails(alerts, recipients, context)
+    return counts
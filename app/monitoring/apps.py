@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+
+
+class MonitoringConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'monitoring'
+
+    def ready(self):
+        # Register signal handlers
+        from . import signals  # noqa: F401
+        from core import audit, search
+        from .models import Device
+
+        search.register(
+            Device, 'name',
+            ['name', 'hostname', 'ip_address', 'mac_address', 'notes', 'client.name'],
+            select_related=['client'],
+        )
+        audit.register(Device)
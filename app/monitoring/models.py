@@ -1,4 +1,8 @@
+from decimal import Decimal
+
 from django.db import models
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
 from clients.models import Client, ServiceAgreement
 
 
@@ -12,6 +16,54 @@ class DeviceType(models.Model):
         return self.name
 
 
+class DeviceQuerySet(models.QuerySet):
+    """QuerySet with set-based pricing helpers for devices."""
+
+    def with_billing_price(self):
+        """Annotate each device with its effective price as ``effective_price``.
+
+        Mirrors ``Device.billing_price`` (custom price, else the device type
+        default, else 0) but resolves it in SQL, so pricing a fleet is a
+        single query instead of one ``device_type`` lookup per device.
+        """
+        return self.annotate(
+            effective_price=Coalesce(
+                'custom_price',
+                'device_type__default_price',
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=10, decimal_places=2),
+            )
+        )
+
+    def billable(self):
+        """Devices that should be billed (active ones)."""
+        return self.filter(status='active')
+
+    def price_totals(self):
+        """Return per-client/per-device-type device counts and price totals.
+
+        Each row is a dict with ``client``, ``device_type``,
+        ``device_type__name``, ``device_count`` and ``total_price``.
+        """
+        return (
+            self.with_billing_price()
+            .order_by()
+            .values('client', 'device_type', 'device_type__name')
+            .annotate(device_count=Count('id'), total_price=Sum('effective_price'))
+            .order_by('client', 'device_type__name')
+        )
+
+    def total_price(self):
+        """Return the summed effective price of all devices in the queryset."""
+        return self.with_billing_price().aggregate(
+            total=Coalesce(
+                Sum('effective_price'),
+                Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            )
+        )['total']
+
+
 class Device(models.Model):
     """Model representing a monitored device."""
     STATUS_CHOICES = [
@@ -46,12 +98,34 @@ class Device(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = DeviceQuerySet.as_manager()
+    
+    # Status and client as last read from or written to the database
+    _loaded_status = None
+    _loaded_client_id = None
+    
     def __str__(self):
         return f"{self.name} ({self.ip_address})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember stored values so saves can detect status and client changes
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_client_id = instance.__dict__.get('client_id')
+        return instance
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self._loaded_status = self.status
+        self._loaded_client_id = self.client_id
+    
     @property
     def billing_price(self):
         """Returns the price to bill for this device"""
+        # Use the SQL-resolved price when loaded via with_billing_price()
+        if hasattr(self, 'effective_price'):
+            return self.effective_price
         if self.custom_price is not None:
             return self.custom_price
         elif self.device_type:
@@ -81,11 +155,67 @@ class MonitoringResult(models.Model):
     
     class Meta:
         ordering = ['-check_time']
+        # Keys of the API's keyset pagination
+        indexes = [
+            models.Index(fields=['check_time', 'id']),
+            models.Index(fields=['device', 'check_time', 'id']),
+        ]
         
     def __str__(self):
         return f"{self.device.name} check at {self.check_time}"
 
 
+class DeviceAvailability(models.Model):
+    """Current up/down state of a device as built from its monitoring results.
+
+    ``last_result_id`` records how far the results have been processed, so
+    each outage build only reads results newer than the previous one.
+    """
+    STATUS_CHOICES = [
+        ('up', 'Up'),
+        ('down', 'Down'),
+        ('unknown', 'Unknown'),
+    ]
+    
+    device = models.OneToOneField(Device, related_name='availability', on_delete=models.CASCADE)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='unknown')
+    since = models.DateTimeField()
+    last_check_at = models.DateTimeField()
+    last_result_id = models.BigIntegerField(default=0, db_index=True)
+    
+    class Meta:
+        verbose_name_plural = 'device availability'
+    
+    def __str__(self):
+        return f"{self.device.name} {self.status} since {self.since}"
+
+
+class DeviceOutage(models.Model):
+    """A period during which a device failed its checks.
+
+    The outage starts at the first failed check and ends at the next
+    successful one; ``ended_at`` is empty while the device is still down.
+    """
+    device = models.ForeignKey(Device, related_name='outages', on_delete=models.CASCADE)
+    started_at = models.DateTimeField()
+    ended_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-started_at']
+        indexes = [
+            models.Index(fields=['device', 'started_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.device.name} down at {self.started_at}"
+    
+    @property
+    def duration(self):
+        if self.ended_at is None:
+            return None
+        return self.ended_at - self.started_at
+
+
 class Alert(models.Model):
     """Model representing monitoring alerts."""
     SEVERITY_CHOICES = [
@@ -108,9 +238,16 @@ class Alert(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     acknowledged_at = models.DateTimeField(null=True, blank=True)
     resolved_at = models.DateTimeField(null=True, blank=True)
+    # Set once the alert went out in a digest
+    notified_at = models.DateTimeField(null=True, blank=True)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'notified_at']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['device', 'created_at', 'id']),
+        ]
         
     def __str__(self):
         return f"{self.severity} alert for {self.device.name}: {self.title}"
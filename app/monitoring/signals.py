@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core import push
+from .models import Alert, Device
+
+
+@receiver(post_save, sender=Alert)
+def queue_alert_digest(sender, instance, raw=False, **kwargs):
+    """New alerts are batched into a digest rather than sent one by one."""
+    if raw or instance.status != 'new' or instance.notified_at is not None:
+        return
+    from .tasks import schedule_alert_digest
+    transaction.on_commit(schedule_alert_digest)
+
+
+@receiver(post_save, sender=Alert)
+def push_alert(sender, instance, created, raw=False, **kwargs):
+    """Push new alerts and status changes to staff dashboards."""
+    if raw:
+        return
+    if Alert.device.is_cached(instance):
+        client_id, device = instance.device.client_id, instance.device.name
+    else:
+        client_id, device = Device.objects.values_list('client_id', 'name').get(pk=instance.device_id)
+    push.publish_on_commit([(
+        [push.STAFF_CHANNEL, push.client_channel(client_id)],
+        'alert',
+        {
+            'id': instance.pk,
+            'created': created,
+            'status': instance.status,
+            'severity': instance.severity,
+            'title': instance.title,
+            'device': device,
+            'device_id': instance.device_id,
+            'client_id': client_id,
+        },
+    )])
@@ -3,9 +3,12 @@ import time
 from datetime import datetime
 from celery import shared_task
 from pysnmp.hlapi import *
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
 from .models import Device, MonitoringResult, Alert
+from .uptime import build_outages
 
 @shared_task
 def monitor_all_devices():
@@ -81,6 +84,41 @@ def check_device(device_id):
     except Exception as e:
         return f"Error monitoring device {device_id}: {str(e)}"
 
+@shared_task
+def build_device_outages():
+    """Task to turn new monitoring results into outage intervals."""
+    processed = build_outages()
+    if processed is None:
+        return "Outage build already running"
+    return f"Processed {processed} monitoring results"
+
+# Cache key held while a digest is queued; alerts raised meanwhile join it
+ALERT_DIGEST_SCHEDULED_KEY = 'monitoring:alert-digest-scheduled'
+
+def schedule_alert_digest():
+    """Queue a digest for the end of the window unless one is already waiting."""
+    window = settings.ALERT_DIGEST_WINDOW
+    if cache.add(ALERT_DIGEST_SCHEDULED_KEY, 1, timeout=window + 60):
+        send_alert_digest.apply_async(countdown=window)
+
+@shared_task
+def send_alert_digest():
+    """Task to notify staff of new alerts in one batch."""
+    from .alerting import send_digest
+
+    # Alerts raised from now on need a new digest
+    cache.delete(ALERT_DIGEST_SCHEDULED_KEY)
+    counts = send_digest()
+    return f"Alert digest: {counts['alerts']} alerts, {counts['notifications']} notifications, {counts['emails']} emails"
+
+@shared_task
+def retry_alert_digest_emails(alert_ids, user_ids, attempt):
+    """Task to send a digest's emails again to the recipients they failed for."""
+    from .alerting import resend_digest_emails
+
+    sent = resend_digest_emails(alert_ids, user_ids, attempt)
+    return f"Alert digest retry {attempt}: {sent} of {len(user_ids)} emails sent"
+
 def check_ping(ip_address, count=3, timeout=1):
     """Perform a ping check on the specified IP address."""
     try:
@@ -183,6 +221,8 @@ def create_alert(device, title, message, severity='warning'):
         if time_diff.total_seconds() > 3600:  # 1 hour
             existing_alert.created_at = timezone.now()
             existing_alert.message = message
+            # Still unresolved after an hour; include it in the next digest again
+            existing_alert.notified_at = None
             existing_alert.save()
     else:
         # Create a new alert
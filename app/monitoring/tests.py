@@ -0,0 +1,86 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from clients.models import Client
+from core.models import Notification
+from core.smtp_fake import FakeSMTPServer
+from . import alerting
+from .models import Alert, Device
+
+
+class AlertDigestTests(TestCase):
+    """Send alert digests through the local fake SMTP server."""
+
+    def setUp(self):
+        self.server = FakeSMTPServer(reject=['bounce']).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        settings = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST=self.server.host,
+            EMAIL_PORT=self.server.port,
+            EMAIL_USE_TLS=0,
+            EMAIL_SEND_RATE=0,
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        client = Client.objects.create(name='Acme', slug='acme')
+        device = Device.objects.create(client=client, name='router', ip_address='10.0.0.1')
+        self.alerts = [
+            Alert.objects.create(device=device, title=f'Alert {index}', message='Down', severity='critical')
+            for index in range(3)
+        ]
+        self.staff = [
+            User.objects.create_user('alice', 'alice@example.com', is_staff=True),
+            User.objects.create_user('bob', 'bob@example.com', is_staff=True),
+        ]
+        User.objects.create_user('carol', 'carol@example.com')
+
+    def recipients(self):
+        return sorted(address for message in self.server.messages for address in message['to'])
+
+    def test_digest_notifies_and_emails_staff_once(self):
+        counts = alerting.send_digest()
+
+        self.assertEqual(counts, {'alerts': 3, 'notifications': 2, 'emails': 2})
+        self.assertEqual(self.recipients(), ['alice@example.com', 'bob@example.com'])
+        self.assertEqual(self.server.connections, 1)
+        self.assertIn('3 new monitoring alerts', self.server.messages[0]['message']['Subject'])
+        self.assertEqual(Notification.objects.count(), 2)
+        self.assertFalse(Alert.objects.filter(notified_at__isnull=True).exists())
+
+        self.assertEqual(alerting.send_digest()['alerts'], 0)
+        self.assertEqual(len(self.server.messages), 2)
+
+    def test_failed_emails_are_retried(self):
+        bounced = User.objects.create_user('dave', 'bounce@example.com', is_staff=True)
+
+        with mock.patch('monitoring.tasks.retry_alert_digest_emails.apply_async') as retry:
+            counts = alerting.send_digest()
+        self.assertEqual(counts['emails'], 2)
+        retry.assert_called_once()
+        alert_ids, user_ids, attempt = retry.call_args.kwargs['args']
+        self.assertEqual(sorted(alert_ids), sorted(alert.pk for alert in self.alerts))
+        self.assertEqual(user_ids, [bounced.pk])
+        self.assertEqual(attempt, 2)
+        self.assertEqual(retry.call_args.kwargs['countdown'], alerting.DIGEST_RETRY_DELAY)
+
+        self.server.reject = ()
+        self.assertEqual(alerting.resend_digest_emails(alert_ids, user_ids, attempt), 1)
+        self.assertIn('bounce@example.com', self.recipients())
+        self.assertIn('Alert 0', self.server.messages[-1]['message'].get_content())
+
+    def test_retries_stop_after_the_last_attempt(self):
+        User.objects.create_user('dave', 'bounce@example.com', is_staff=True)
+        alerting.claim_alerts()
+
+        with mock.patch('monitoring.tasks.retry_alert_digest_emails.apply_async') as retry:
+            user_ids = list(User.objects.filter(email='bounce@example.com').values_list('id', flat=True))
+            sent = alerting.resend_digest_emails(
+                [alert.pk for alert in self.alerts], user_ids, alerting.DIGEST_EMAIL_ATTEMPTS,
+            )
+        self.assertEqual(sent, 0)
+        retry.assert_not_called()
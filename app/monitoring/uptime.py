@@ -0,0 +1,209 @@
+"""
+Uptime and outage tracking built from monitoring results.
+
+Raw ``MonitoringResult`` rows are run-length encoded per device: only the
+checks where a device changes between up and down matter, and each down run
+becomes a ``DeviceOutage`` interval. Builds are incremental, reading only
+results newer than the last one processed. Uptime over any period is then
+answered from the handful of outage intervals overlapping it rather than
+from the results themselves. Devices changing state are pushed to staff
+dashboards (``core.push``).
+"""
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from core import push
+from .models import Device, DeviceAvailability, DeviceOutage, MonitoringResult
+
+DOWN_STATUSES = ('down', 'unreachable')
+
+# Cache key held while a build runs, so overlapping runs do not
+# process the same results twice
+BUILD_LOCK_KEY = 'monitoring:outage-build'
+
+# Results are written by concurrent check tasks, so ids do not commit in
+# order: a row may become visible after one with a higher id. Builds only
+# read results older than this, by which time every lower id has committed.
+RESULT_SETTLE_DELAY = timedelta(seconds=60)
+
+
+def result_state(ping_status, snmp_status):
+    """Return 'up', 'down' or None when a check says nothing about the device."""
+    status = ping_status if ping_status != 'unknown' else snmp_status
+    if status == 'up':
+        return 'up'
+    if status in DOWN_STATUSES:
+        return 'down'
+    return None
+
+
+def apply_results(rows):
+    """Fold a batch of result rows, in id order, into availability and outages."""
+    device_ids = {row[1] for row in rows}
+    states = {
+        state.device_id: state
+        for state in DeviceAvailability.objects.filter(device_id__in=device_ids)
+    }
+    open_outages = {
+        outage.device_id: outage
+        for outage in DeviceOutage.objects.filter(device_id__in=device_ids, ended_at__isnull=True)
+    }
+    new_states = []
+    new_outages = []
+    closed_outages = []
+    changed = {}
+
+    for pk, device_id, check_time, ping_status, snmp_status in rows:
+        state = states.get(device_id)
+        if state is None:
+            state = DeviceAvailability(device_id=device_id, since=check_time)
+            states[device_id] = state
+            new_states.append(state)
+        state.last_result_id = pk
+        state.last_check_at = check_time
+
+        current = result_state(ping_status, snmp_status)
+        if current is None or current == state.status:
+            continue
+        if current == 'down':
+            outage = DeviceOutage(device_id=device_id, started_at=check_time)
+            new_outages.append(outage)
+            open_outages[device_id] = outage
+        elif device_id in open_outages:
+            outage = open_outages.pop(device_id)
+            outage.ended_at = check_time
+            if outage.pk is not None:
+                closed_outages.append(outage)
+        state.status = current
+        state.since = check_time
+        changed[device_id] = state
+
+    DeviceAvailability.objects.bulk_create(new_states)
+    DeviceAvailability.objects.bulk_update(
+        [state for state in states.values() if state.pk is not None and state not in new_states],
+        ['status', 'since', 'last_check_at', 'last_result_id'],
+    )
+    DeviceOutage.objects.bulk_create(new_outages)
+    DeviceOutage.objects.bulk_update(closed_outages, ['ended_at'])
+    if changed:
+        push.publish_on_commit(device_events(changed))
+
+
+def device_events(states):
+    """Push messages for ``{device id: DeviceAvailability}`` that changed state."""
+    devices = Device.objects.filter(pk__in=states).values_list('pk', 'client_id', 'name')
+    return [
+        (
+            [push.STAFF_CHANNEL, push.client_channel(client_id)],
+            'device',
+            {
+                'device_id': pk,
+                'device': name,
+                'client_id': client_id,
+                'status': states[pk].status,
+                'since': states[pk].since.isoformat(),
+            },
+        )
+        for pk, client_id, name in devices
+    ]
+
+
+def build_outages(batch_size=5000):
+    """Process monitoring results added since the last build.
+
+    Results newer than ``RESULT_SETTLE_DELAY`` wait for the next build.
+    Returns the number of results processed, or None if another build is
+    already running.
+    """
+    if not cache.add(BUILD_LOCK_KEY, 1, timeout=600):
+        return None
+    processed = 0
+    settled_before = timezone.now() - RESULT_SETTLE_DELAY
+    try:
+        while True:
+            with transaction.atomic():
+                cursor = DeviceAvailability.objects.aggregate(cursor=Max('last_result_id'))['cursor'] or 0
+                rows = list(
+                    MonitoringResult.objects.filter(id__gt=cursor)
+                    .order_by('id')
+                    .values_list('id', 'device_id', 'check_time', 'ping_status', 'snmp_status')[:batch_size]
+                )
+                # Stop at the first result too recent to have settled; the
+                # cursor must not pass ids that may still commit
+                settled = next((i for i, row in enumerate(rows) if row[2] >= settled_before), len(rows))
+                if not settled:
+                    break
+                apply_results(rows[:settled])
+            processed += settled
+            if settled < len(rows):
+                break
+    finally:
+        cache.delete(BUILD_LOCK_KEY)
+    return processed
+
+
+def period_bounds(start_date, end_date):
+    """Return aware datetimes covering whole local days from start to end inclusive."""
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+    end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+    return start, end
+
+
+def device_uptime(devices, start, end):
+    """Return uptime over [start, end) for each device, keyed by device id.
+
+    Each value is a dict with ``monitored`` and ``downtime`` timedeltas,
+    ``uptime`` as a percentage and the clipped ``outages`` as
+    (start, end) pairs. Time before a device was added or after now is
+    not counted as monitored.
+    """
+    devices = list(devices)
+    now = timezone.now()
+    outages = (
+        DeviceOutage.objects.filter(device__in=devices, started_at__lt=end)
+        .filter(Q(ended_at__isnull=True) | Q(ended_at__gt=start))
+        .order_by('started_at')
+        .values_list('device_id', 'started_at', 'ended_at')
+    )
+    intervals = {}
+    for device_id, started_at, ended_at in outages:
+        intervals.setdefault(device_id, []).append((started_at, ended_at or now))
+
+    results = {}
+    for device in devices:
+        period_start = max(start, device.created_at)
+        period_end = min(end, now)
+        monitored = max(period_end - period_start, timedelta(0))
+        clipped = []
+        downtime = timedelta(0)
+        for started_at, ended_at in intervals.get(device.id, []):
+            started_at, ended_at = max(started_at, period_start), min(ended_at, period_end)
+            if ended_at > started_at:
+                clipped.append((started_at, ended_at))
+                downtime += ended_at - started_at
+        results[device.id] = {
+            'monitored': monitored,
+            'downtime': downtime,
+            'uptime': 100.0 * (1 - downtime / monitored) if monitored else 100.0,
+            'outages': clipped,
+        }
+    return results
+
+
+def client_uptime(client, start, end):
+    """Return the combined uptime of a client's monitored devices over [start, end)."""
+    devices = Device.objects.filter(client=client, monitoring_enabled=True).only('id', 'created_at')
+    per_device = device_uptime(devices, start, end)
+    monitored = sum((row['monitored'] for row in per_device.values()), timedelta(0))
+    downtime = sum((row['downtime'] for row in per_device.values()), timedelta(0))
+    return {
+        'monitored': monitored,
+        'downtime': downtime,
+        'uptime': 100.0 * (1 - downtime / monitored) if monitored else 100.0,
+        'devices': per_device,
+    }
@@ -2,6 +2,8 @@
 ASGI config for nxtep project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+Server-sent events are answered by ``core.push`` and everything else by
+Django; serve it with an ASGI server, e.g. ``uvicorn nxtep.asgi:application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +15,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'nxtep.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from core.push import PushApplication  # noqa: E402  (needs Django set up)
+
+application = PushApplication(django_application)
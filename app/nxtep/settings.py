@@ -1,6 +1,8 @@
 import os
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -20,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third-party apps
     'rest_framework',
@@ -34,16 +37,20 @@ INSTALLED_APPS = [
     'monitoring',
     'billing',
     'content_manager',
+    'api',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'content_manager.middleware.StaticSiteMiddleware',
+    'core.queries.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.AuditMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
@@ -62,6 +69,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.notifications',
             ],
         },
     },
@@ -69,6 +77,8 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'nxtep.wsgi.application'
 
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
 # Database
 DATABASES = {
     'default': {
@@ -113,6 +123,15 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'mediafiles')
 
+# Resized variants of uploaded images, stored under MEDIA_ROOT
+IMAGE_VARIANTS_DIR = 'variants'
+IMAGE_VARIANT_WIDTHS = [320, 640, 960, 1280, 1920]
+IMAGE_VARIANT_QUALITY = int(os.environ.get('IMAGE_VARIANT_QUALITY', 80))
+
+# Invoice and quote PDFs
+BILLING_PDF_FONT = os.environ.get('BILLING_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf')
+BILLING_LOGO_PATH = os.environ.get('BILLING_LOGO_PATH', os.path.join(BASE_DIR, 'static', 'img', 'logo.png'))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -123,11 +142,114 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    # Record active devices shortly before midnight for prorated billing
+    'snapshot-device-usage': {
+        'task': 'billing.tasks.snapshot_device_usage',
+        'schedule': crontab(hour=23, minute=55),
+    },
+    'age-receivables': {
+        'task': 'billing.tasks.age_receivables',
+        'schedule': crontab(hour=0, minute=15),
+    },
+    'build-device-outages': {
+        'task': 'monitoring.tasks.build_device_outages',
+        'schedule': 300.0,
+    },
+    'sync-stripe-outbox': {
+        'task': 'billing.tasks.sync_stripe_outbox',
+        'schedule': 60.0,
+    },
+    'dispatch-social-posts': {
+        'task': 'content_manager.tasks.dispatch_social_posts',
+        'schedule': 30.0,
+    },
+    'refresh-social-analytics': {
+        'task': 'content_manager.tasks.refresh_social_analytics',
+        'schedule': 600.0,
+    },
+    # Webhooks schedule processing themselves; this catches stragglers
+    'process-stripe-events': {
+        'task': 'billing.tasks.process_stripe_events',
+        'schedule': 60.0,
+    },
+    # New alerts schedule digests themselves; this catches stragglers
+    'send-alert-digest': {
+        'task': 'monitoring.tasks.send_alert_digest',
+        'schedule': 300.0,
+    },
+}
+
+# Cache settings
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}/1",
+    }
+}
 
 # Stripe settings
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY', '')
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY', '')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+STRIPE_CURRENCY = os.environ.get('STRIPE_CURRENCY', 'usd')
+# Requests per second per sync worker (Stripe allows 100/s live, 25/s in test mode)
+STRIPE_SYNC_RATE = float(os.environ.get('STRIPE_SYNC_RATE', 20))
+STRIPE_SYNC_BATCH_SIZE = int(os.environ.get('STRIPE_SYNC_BATCH_SIZE', 100))
+
+# Social media publishing
+SOCIAL_PUBLISHING_ADAPTERS = {
+    'fake': 'content_manager.publishing.FakeAdapter',
+}
+SOCIAL_DISPATCH_BATCH_SIZE = int(os.environ.get('SOCIAL_DISPATCH_BATCH_SIZE', 500))
+# Posts published at the same time by one worker
+SOCIAL_DISPATCH_CONCURRENCY = int(os.environ.get('SOCIAL_DISPATCH_CONCURRENCY', 50))
+
+# Static export of the public website, rebuilt in the background on changes
+SITE_EXPORT_ENABLED = int(os.environ.get('SITE_EXPORT_ENABLED', 0))
+SITE_EXPORT_ROOT = os.environ.get('SITE_EXPORT_ROOT', os.path.join(BASE_DIR, 'site_export'))
+
+# Seconds a process may serve SystemSetting values before checking for changes
+SYSTEM_SETTINGS_CHECK_INTERVAL = 1.0
+
+# Audit log entries are buffered and written in bulk by a background thread
+AUDIT_BUFFER_SIZE = 100
+AUDIT_FLUSH_INTERVAL = 5  # seconds
+AUDIT_ASYNC = int(os.environ.get('AUDIT_ASYNC', 1))
+
+# Query budgets per request and Celery task (0 for no limit); the same
+# query shape repeated this often is reported as a likely N+1
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 50))
+QUERY_TASK_BUDGET = int(os.environ.get('QUERY_TASK_BUDGET', 0))
+QUERY_REPEAT_THRESHOLD = 10
+# Raise instead of logging when over budget; the test runner turns it on
+QUERY_BUDGET_STRICT = int(os.environ.get('QUERY_BUDGET_STRICT', 0))
+QUERY_SERVER_TIMING = DEBUG
+
+# Live updates pushed over server-sent events (see core.push); needs an
+# ASGI server such as uvicorn
+PUSH_REDIS_URL = f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:{os.environ.get('REDIS_PORT', '6379')}/0"
+PUSH_PATH = '/events/'
+PUSH_KEEPALIVE = 15  # seconds
+
+# Email
+EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.environ.get('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.environ.get('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = int(os.environ.get('EMAIL_USE_TLS', 0))
+EMAIL_TIMEOUT = 30
+DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@localhost')
+# Bulk mail: parallel SMTP connections, messages per second (0 for no limit)
+# and messages sent over one connection before it is replaced
+EMAIL_POOL_SIZE = int(os.environ.get('EMAIL_POOL_SIZE', 4))
+EMAIL_SEND_RATE = float(os.environ.get('EMAIL_SEND_RATE', 10))
+EMAIL_MESSAGES_PER_CONNECTION = int(os.environ.get('EMAIL_MESSAGES_PER_CONNECTION', 100))
+
+# Seconds new alerts are collected before staff are notified in one digest
+ALERT_DIGEST_WINDOW = int(os.environ.get('ALERT_DIGEST_WINDOW', 60))
 
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
@@ -137,13 +259,17 @@ CORS_ALLOWED_ORIGINS = [
 
 # Rest Framework settings
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 10,
+    # Append-only resources use api.pagination.KeysetPagination instead
+    'DEFAULT_PAGINATION_CLASS': 'api.pagination.PagePagination',
+    'PAGE_SIZE': 50,
+    'DEFAULT_VERSIONING_CLASS': 'rest_framework.versioning.NamespaceVersioning',
+    'ALLOWED_VERSIONS': ['v1'],
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # Clients, devices and invoices of every client are staff only data
     'DEFAULT_PERMISSION_CLASSES': [
-        'rest_framework.permissions.IsAuthenticated',
+        'rest_framework.permissions.IsAdminUser',
     ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
@@ -11,8 +11,9 @@ urlpatterns = [
     # path('dashboard/', include('core.urls')),
     # path('clients/', include('clients.urls')),
     # path('monitoring/', include('monitoring.urls')),
-    # path('billing/', include('billing.urls')),
-    # path('content/', include('content_manager.urls')),
+    path('billing/', include('billing.urls')),
+    path('content/', include('content_manager.urls')),
+    path('api/v1/', include('api.urls', namespace='v1')),
 ]
 
 # Serve static files during development